@@ -0,0 +1,92 @@
+"""
+Benchmark crawl jobs run by the daemon against one ``scrapy crawl`` per job.
+
+    python benchmarks/bench_daemon.py [--jobs 8] [--recipes 20] [--latency 0.02]
+                                      [--workers 2] [--slots 4]
+
+Serves a small synthetic recipe site locally, answering after
+``--latency`` seconds like a remote one, and crawls it ``--jobs`` times:
+as separate ``scrapy crawl`` processes, then as jobs submitted to a warm
+daemon one at a time, then all at once. Reports the time per job and the
+total time. Every job crawls the same local site, so the daemon is
+allowed to run them all concurrently (``jobs_per_domain``).
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.synthetic_site import TEST_SETTINGS, SyntheticRecipeSite, crawl_command  # noqa: E402
+from webscraper.daemon import CrawlDaemon  # noqa: E402
+
+
+def separate_processes(site, jobs):
+    elapsed = []
+    for _ in range(jobs):
+        start = time.perf_counter()
+        subprocess.run(crawl_command(site), cwd=ROOT, check=True, stderr=subprocess.DEVNULL)
+        elapsed.append(time.perf_counter() - start)
+    return elapsed
+
+
+def daemon_jobs(daemon, site, jobs, concurrent):
+    spec = {'domain': '127.0.0.1', 'start_url': f'{site.base_url}/recipes'}
+    elapsed = []
+    if concurrent:
+        start = time.perf_counter()
+        submitted = [daemon.submit(spec) for _ in range(jobs)]
+        for job in submitted:
+            for _ in daemon.follow_items(job):
+                pass
+        return [time.perf_counter() - start]
+    for _ in range(jobs):
+        start = time.perf_counter()
+        job = daemon.submit(spec)
+        for _ in daemon.follow_items(job):
+            pass
+        elapsed.append(time.perf_counter() - start)
+        assert job.items == site.recipes, job.status()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=8)
+    parser.add_argument('--recipes', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--slots', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per response')
+    args = parser.parse_args()
+
+    site = SyntheticRecipeSite(recipes=args.recipes, delay=args.latency).start()
+    try:
+        print(f'{args.jobs} jobs of {args.recipes} recipes each')
+        elapsed = separate_processes(site, args.jobs)
+        print(f'  scrapy crawl per job    {sum(elapsed) / len(elapsed) * 1000:8.0f} ms/job'
+              f'  {sum(elapsed):6.2f} s total')
+
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            daemon = CrawlDaemon(directory, workers=args.workers, slots=args.slots,
+                                 jobs_per_domain=args.jobs, settings=TEST_SETTINGS).start()
+            print(f'  daemon startup          {(time.perf_counter() - start) * 1000:8.0f} ms (once)')
+            try:
+                elapsed = daemon_jobs(daemon, site, args.jobs, concurrent=False)
+                print(f'  daemon, one at a time   {sum(elapsed) / len(elapsed) * 1000:8.0f} ms/job'
+                      f'  {sum(elapsed):6.2f} s total')
+                total = daemon_jobs(daemon, site, args.jobs, concurrent=True)[0]
+                print(f'  daemon, all at once     {total / args.jobs * 1000:8.0f} ms/job'
+                      f'  {total:6.2f} s total')
+            finally:
+                daemon.stop()
+    finally:
+        site.stop()
+
+
+if __name__ == '__main__':
+    main()
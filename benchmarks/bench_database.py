@@ -0,0 +1,80 @@
+"""
+Benchmark DatabasePipeline against one INSERT and commit per item.
+
+    python benchmarks/bench_database.py [--items 20000] [--batch-size 500]
+
+Both variants write the same items to a fresh SQLite file and report
+rows per second.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webscraper.items import WebscraperItem  # noqa: E402
+from webscraper.pipelines import DatabasePipeline  # noqa: E402
+
+
+def make_items(count):
+    for i in range(count):
+        yield WebscraperItem(
+            url=f'https://example.com/recipes/recipe-{i}',
+            title=f'Recipe {i}',
+            ingredients=['2 cups flour', '1 lemon (zested)', f'{i} g chicken'],
+            time={'prep': 10, 'cook': i % 50, 'total': 10 + i % 50},
+            dietary_labels=['Gluten-free'],
+            fitness_relevance='kcal: 250, protein: 12g',
+            difficulty='Easy',
+            instructions='Mix.\nBake until golden.',
+            ratings='4.5/5 (10 ratings)',
+        )
+
+
+def per_item(path, items):
+    pipeline = DatabasePipeline(None)
+    conn = sqlite3.connect(path)
+    conn.execute(pipeline.create_table_sql())
+    sql = pipeline.upsert_sql()
+    start = time.perf_counter()
+    for item in items:
+        conn.execute(sql, pipeline.row(item))
+        conn.commit()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+
+def batched(path, items, batch_size):
+    pipeline = DatabasePipeline(lambda: sqlite3.connect(path), batch_size=batch_size)
+    start = time.perf_counter()
+    pipeline.open_spider(None)
+    for item in items:
+        # Blocking put: the benchmark runs outside the reactor
+        pipeline.queue.put(pipeline.row(item))
+    pipeline.close_spider(None)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    items = list(make_items(args.items))
+    with tempfile.TemporaryDirectory() as directory:
+        results = [
+            ('per-item insert', per_item(os.path.join(directory, 'a.db'), items)),
+            (f'batched (batch={args.batch_size})',
+             batched(os.path.join(directory, 'b.db'), items, args.batch_size)),
+        ]
+    for name, elapsed in results:
+        print(f'{name:<24} {args.items / elapsed:>12,.0f} rows/s  ({elapsed:.2f}s)')
+
+
+if __name__ == '__main__':
+    main()
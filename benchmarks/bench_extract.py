@@ -0,0 +1,138 @@
+"""
+Benchmark the Scrapy-free extraction API against the spider.
+
+    python benchmarks/bench_extract.py [--docs 500] [--padding 50000]
+
+Reports cold-start time (fresh interpreter: import plus first document)
+and per-document cost for:
+
+- RecipeSpider.parse_recipe on an HtmlResponse
+- extract_recipe() called per document
+- extract_many() over the whole batch
+
+and, per document, the __POST_CONTENT__ fast path (raw bytes, no DOM)
+against the DOM path it replaces, on the same pages.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.synthetic_site import recipe_json  # noqa: E402
+
+COLD_START = {
+    'spider': (
+        'from scrapy.http import HtmlResponse, Request\n'
+        'from webscraper.spiders.recipe_spider import RecipeSpider\n'
+        'url = "https://example.com/recipes/r"\n'
+        'RecipeSpider().parse_recipe(HtmlResponse(url=url, body=HTML.encode(), request=Request(url)))\n'
+    ),
+    'extract_recipe': (
+        'from webscraper.extract import extract_recipe\n'
+        'extract_recipe(HTML, "https://example.com/recipes/r")\n'
+    ),
+}
+
+
+def make_page(index, padding):
+    filler = '<p>' + 'lorem ipsum ' * (padding // 12) + '</p>'
+    # Head scripts and styles like a real recipe site's
+    head = (
+        '<meta charset="utf-8"><link rel="stylesheet" href="/site.css">'
+        '<script>window.dataLayer=[{"page":"recipe"}];</script>'
+        '<style>' + '.card{margin:0}' * 100 + '</style>'
+    )
+    return (
+        f'<html><head>{head}<title>Recipe {index} &amp; sides</title></head><body>'
+        f'<nav>{"<a href=/recipes/x>x</a>" * 50}</nav>{filler}'
+        f'<script id="__POST_CONTENT__">{json.dumps(recipe_json(index))}</script>'
+        '<script src="/analytics.js" async></script>'
+        '</body></html>'
+    )
+
+
+def cold_start(name, html, runs=5):
+    code = f'HTML = {html!r}\n' + COLD_START[name]
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def per_document(pages):
+    from scrapy.http import HtmlResponse, Request
+    from webscraper.extract import extract_many, extract_recipe
+    from webscraper.spiders.recipe_spider import RecipeSpider
+
+    urls = [f'https://example.com/recipes/r{i}' for i in range(len(pages))]
+    spider = RecipeSpider()
+    results = {}
+
+    start = time.perf_counter()
+    for html, url in zip(pages, urls):
+        spider.parse_recipe(HtmlResponse(url=url, body=html.encode(), request=Request(url)))
+    results['spider'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for html, url in zip(pages, urls):
+        extract_recipe(html, url)
+    results['extract_recipe'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in extract_many(zip(pages, urls)):
+        pass
+    results['extract_many'] = time.perf_counter() - start
+    return results
+
+
+def fast_path(pages):
+    from webscraper.extract import Extractor
+
+    bodies = [html.encode('utf-8') for html in pages]
+    extractor = Extractor()
+    results = {}
+
+    start = time.perf_counter()
+    for body in bodies:
+        extractor.extract_dom(body, 'https://example.com/recipes/r')
+    results['DOM path'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for body in bodies:
+        assert extractor.extract_embedded(body, 'https://example.com/recipes/r') is not None
+    results['fast path'] = time.perf_counter() - start
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=500)
+    parser.add_argument('--padding', type=int, default=50000, help='bytes of filler per page')
+    args = parser.parse_args()
+
+    pages = [make_page(i, args.padding) for i in range(args.docs)]
+    print('cold start (import + first document, best of 5)')
+    for name in COLD_START:
+        print(f'  {name:<16} {cold_start(name, pages[0]) * 1000:8.1f} ms')
+    print(f'per document ({args.docs} docs, ~{len(pages[0]) // 1024} KiB each)')
+    for name, elapsed in per_document(pages).items():
+        print(f'  {name:<16} {elapsed / args.docs * 1000:8.2f} ms')
+
+    from webscraper.extract import json_loads
+    print(f'__POST_CONTENT__ pages ({json_loads.__module__} decoder)')
+    results = fast_path(pages)
+    for name, elapsed in results.items():
+        print(f'  {name:<16} {elapsed / args.docs * 1000:8.3f} ms')
+    print(f'  speedup          {results["DOM path"] / results["fast path"]:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Benchmark the download transfer profiles against a local fixture server.
+
+    python benchmarks/bench_transfer.py [--requests 2000] [--concurrency 16] [--latency 0]
+
+Starts a Twisted fixture server with a plain HTTP/1.1 port and a TLS port
+(which negotiates h2 over ALPN when the h2 package is installed) serving
+small recipe pages, compressed with zstd, br or gzip as the client
+accepts. Each profile then fetches the same pages with response
+compression on and off, in a fresh process, and reports requests per
+second and bytes on the wire (request plus response, as counted by
+Scrapy's DownloaderStats before decompression).
+"""
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests.synthetic_site import recipe_json  # noqa: E402
+
+# (profile, scheme) pairs; 'default' is Scrapy without the TransferProfile add-on
+RUNS = [
+    ('default', 'http'),
+    ('keepalive', 'http'),
+    ('default', 'https'),
+    ('keepalive', 'https'),
+    ('h2', 'https'),
+]
+
+
+def make_page(index):
+    links = ''.join(f'<li><a href="/recipes/recipe-{i}">Recipe {i}</a></li>'
+                    for i in range(index, index + 40))
+    return (
+        f'<html><head><title>Recipe {index}</title></head><body>'
+        f'<nav><ul>{links}</ul></nav>'
+        f'<script id="__POST_CONTENT__">{json.dumps(recipe_json(index))}</script>'
+        '</body></html>'
+    ).encode('utf-8')
+
+
+def encoders():
+    from scrapy.utils._compression import brotli, zstd
+    return [
+        ('zstd', zstd.compress),
+        ('br', brotli.compress),
+        ('gzip', gzip.compress),
+    ]
+
+
+def self_signed_certificate():
+    import datetime
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                          serialization.NoEncryption()),
+        cert.public_bytes(serialization.Encoding.PEM),
+    )
+
+
+def serve(latency):
+    """Run the fixture server and print its ports as JSON."""
+    import importlib.util
+
+    from OpenSSL import crypto
+    from twisted.internet import reactor, ssl
+    from twisted.web import resource, server
+
+    compressors = encoders()
+    pages = {}
+
+    class Page(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            index = int(request.path.rsplit(b'-', 1)[-1] or 0) % 1000
+            accepted = {token.split(b';')[0].strip()
+                        for token in (request.getHeader(b'accept-encoding') or b'').split(b',')}
+            body, encoding = pages.get((index, frozenset(accepted)), (None, None))
+            if body is None:
+                body = make_page(index)
+                for name, compress in compressors:
+                    if name.encode() in accepted:
+                        body, encoding = compress(body), name
+                        break
+                pages[index, frozenset(accepted)] = body, encoding
+            request.setHeader(b'content-type', b'text/html; charset=utf-8')
+            if encoding:
+                request.setHeader(b'content-encoding', encoding.encode())
+            if not latency:
+                return body
+            reactor.callLater(latency / 1000, lambda: (request.write(body), request.finish()))
+            return server.NOT_DONE_YET
+
+    site = server.Site(Page())
+    key, cert = self_signed_certificate()
+    protocols = [b'h2', b'http/1.1'] if importlib.util.find_spec('h2') else [b'http/1.1']
+    options = ssl.CertificateOptions(
+        privateKey=crypto.load_privatekey(crypto.FILETYPE_PEM, key),
+        certificate=crypto.load_certificate(crypto.FILETYPE_PEM, cert),
+        acceptableProtocols=protocols,
+    )
+    http = reactor.listenTCP(0, site, interface='127.0.0.1')
+    https = reactor.listenSSL(0, site, options, interface='127.0.0.1')
+    print(json.dumps({'http': http.getHost().port, 'https': https.getHost().port,
+                      'protocols': [p.decode() for p in protocols]}), flush=True)
+    reactor.run()
+
+
+def crawl(base_url, profile, compression, requests, concurrency, stats_path):
+    """Fetch ``requests`` pages from ``base_url`` and dump the crawl stats."""
+    import scrapy
+    from scrapy.crawler import CrawlerProcess
+
+    class BenchSpider(scrapy.Spider):
+        name = 'bench'
+
+        async def start(self):
+            for i in range(requests):
+                yield scrapy.Request(f'{base_url}/recipes/recipe-{i}', dont_filter=True)
+
+        def parse(self, response):
+            pass
+
+    settings = {
+        'CONCURRENT_REQUESTS': concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+        'COMPRESSION_ENABLED': compression,
+        'ROBOTSTXT_OBEY': False,
+        'TELNETCONSOLE_ENABLED': False,
+        'LOG_LEVEL': 'ERROR',
+    }
+    if profile != 'default':
+        settings['ADDONS'] = {'webscraper.addons.TransferProfile': 100}
+        settings['TRANSFER_PROFILE'] = profile
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(BenchSpider)
+    process.crawl(crawler)
+    process.start()
+    with open(stats_path, 'w') as f:
+        json.dump(crawler.stats.get_stats(), f, default=str)
+
+
+def run(base_url, profile, compression, args):
+    with tempfile.NamedTemporaryFile(suffix='.json') as stats_file:
+        subprocess.run(
+            [sys.executable, __file__, 'crawl', base_url, profile, str(int(compression)),
+             str(args.requests), str(args.concurrency), stats_file.name],
+            cwd=ROOT, check=True,
+        )
+        with open(stats_file.name) as f:
+            stats = json.load(f)
+    # Wire bytes: compressed bodies, counted before HttpCompressionMiddleware
+    wire = stats.get('downloader/request_bytes', 0) + stats.get('downloader/response_bytes', 0)
+    return stats.get('response_received_count', 0) / stats['elapsed_time_seconds'], wire
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        return serve(float(sys.argv[2]))
+    if sys.argv[1:2] == ['crawl']:
+        base_url, profile, compression, requests, concurrency, stats_path = sys.argv[2:]
+        return crawl(base_url, profile, compression == '1', int(requests),
+                     int(concurrency), stats_path)
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0, help='server delay per response, ms')
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, __file__, 'serve', str(args.latency)],
+                              cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    try:
+        ports = json.loads(server.stdout.readline())
+        print(f'{args.requests} requests, concurrency {args.concurrency}, '
+              f'server ALPN: {", ".join(ports["protocols"])}')
+        print(f'  {"profile":<10} {"scheme":<6} {"compression":<11} {"req/s":>8} {"wire KiB":>10}')
+        for profile, scheme in RUNS:
+            base_url = f'{scheme}://127.0.0.1:{ports[scheme]}'
+            for compression in (False, True):
+                rate, wire = run(base_url, profile, compression, args)
+                print(f'  {profile:<10} {scheme:<6} {"on" if compression else "off":<11} '
+                      f'{rate:8.0f} {wire / 1024:10.0f}')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ import pytest
 from scrapy.http import Request, Response
 from webscraper.spiders.recipe_spider import RecipeSpider
 from webscraper.items import WebscraperItem
+from tests.synthetic_site import SyntheticRecipeSite
 
 
 @pytest.fixture
@@ -53,4 +54,12 @@ def mock_response():
         </body>
     </html>
     '''
-    return Response(url=url, body=body.encode('utf-8')) 
\ No newline at end of file
+    return Response(url=url, body=body.encode('utf-8')) 
+
+
+@pytest.fixture
+def recipe_site():
+    """Serve a synthetic recipe site on a local port for integration tests."""
+    site = SyntheticRecipeSite().start()
+    yield site
+    site.stop()
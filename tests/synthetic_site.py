@@ -0,0 +1,203 @@
+"""
+A small synthetic recipe site served from a local thread, used by the
+integration tests that need a real crawl.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def recipe_json(index):
+    """Return the embedded __POST_CONTENT__ payload for recipe ``index``."""
+    return {
+        'ingredients': [{'ingredients': [
+            {'quantityText': '2 cups', 'ingredientText': 'flour'},
+            {'quantityText': '1', 'ingredientText': 'lemon', 'note': 'zested'},
+            {'quantityText': f'{index} g', 'ingredientText': 'chicken'},
+        ]}],
+        'cookAndPrepTime': {
+            'preparationMax': 600,
+            'cookingMax': 60 * (index % 50),
+            'total': 600 + 60 * (index % 50),
+        },
+        'diet': [{'display': 'Gluten-free'}] if index % 2 else [],
+        'skillLevel': 'Easy',
+        'methodSteps': [
+            {'content': [{'type': 'html', 'data': {'value': f'<p>Step one for recipe {index}.</p>'}}]},
+            {'content': [{'type': 'html', 'data': {'value': '<p>Bake until <b>golden</b>.</p>'}}]},
+        ],
+        'userRatings': {'avg': 4.5, 'total': index},
+        'nutritions': [
+            {'label': 'kcal', 'value': str(200 + index), 'unit': ''},
+            {'label': 'protein', 'value': '12', 'unit': 'g'},
+        ],
+    }
+
+
+class SyntheticRecipeSite:
+    """Serve ``recipes`` recipe pages behind paginated category pages.
+
+    Layout::
+
+        /recipes                      -> links to every category page
+        /recipes/category/page-<k>    -> links to ``per_page`` recipes
+        /recipes/recipe-<i>           -> recipe page, links to the next recipe
+
+    ``delay`` adds latency to every response, which gives tests time to
+    interrupt a crawl mid-run. ``hits`` counts requests per path and
+    ``connections`` the TCP connections accepted.
+    """
+
+    def __init__(self, recipes=50, per_page=10, delay=0.0, padding=0):
+        self.recipes = recipes
+        self.per_page = per_page
+        self.delay = delay
+        self.padding = padding
+        self.hits = Counter()
+        self.connections = 0
+        self.routes = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def recipe_urls(self):
+        return {f'{self.base_url}/recipes/recipe-{i}' for i in range(self.recipes)}
+
+    def page(self, path):
+        """Return ``(status, headers, body)`` for ``path``."""
+        if path in self.routes:
+            return self.routes[path](path)
+        pages = (self.recipes + self.per_page - 1) // self.per_page
+        if path == '/recipes':
+            links = [f'/recipes/category/page-{k}' for k in range(pages)]
+            return self.html('All recipes', links)
+        if path.startswith('/recipes/category/page-'):
+            k = int(path.rsplit('-', 1)[1])
+            start = k * self.per_page
+            stop = min(start + self.per_page, self.recipes)
+            links = [f'/recipes/recipe-{i}' for i in range(start, stop)]
+            return self.html(f'Category page {k}', links)
+        if path.startswith('/recipes/recipe-'):
+            i = int(path.rsplit('-', 1)[1])
+            if i >= self.recipes:
+                return 404, {'Content-Type': 'text/html'}, b'not found'
+            links = ['/about', f'/recipes/recipe-{(i + 1) % self.recipes}']
+            payload = json.dumps(recipe_json(i))
+            extra = f'<script id="__POST_CONTENT__" type="application/json">{payload}</script>'
+            return self.html(f'Recipe {i}', links, extra)
+        return 404, {'Content-Type': 'text/html'}, b'not found'
+
+    def html(self, title, links, extra=''):
+        anchors = ''.join(f'<a href="{href}">{href}</a>' for href in links)
+        filler = '<p>' + 'x' * self.padding + '</p>' if self.padding else ''
+        body = (
+            f'<html><head><title>{title}</title></head>'
+            f'<body><h1>{title}</h1>{anchors}{filler}{extra}</body></html>'
+        )
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, body.encode('utf-8')
+
+    def start(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                with site._lock:
+                    site.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0].split('#', 1)[0]
+                with site._lock:
+                    site.hits[path] += 1
+                if site.delay:
+                    time.sleep(site.delay)
+                status, headers, body = site.page(path)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # The client hung up early, e.g. on seeing the headers
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Crawl politeness is turned off so test crawls run at full speed
+TEST_SETTINGS = {
+    'DOWNLOAD_DELAY': 0,
+    'AUTOTHROTTLE_ENABLED': False,
+    'LOG_LEVEL': 'WARNING',
+}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CRAWL_SCRIPT = """
+import json, sys
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+start_url, overrides, stats_path = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3]
+settings = get_project_settings()
+settings.setdict(overrides, priority='cmdline')
+process = CrawlerProcess(settings)
+crawler = process.create_crawler('recipe_spider')
+process.crawl(crawler, domain='127.0.0.1', start_url=start_url)
+process.start()
+with open(stats_path, 'w') as f:
+    json.dump(crawler.stats.get_stats(), f, default=str)
+"""
+
+
+def crawl_command(site, **settings):
+    """Return the ``scrapy crawl`` command line that crawls ``site``.
+
+    ``settings`` are passed on as ``-s NAME=VALUE``.
+    """
+    command = [
+        sys.executable, '-m', 'scrapy', 'crawl', 'recipe_spider',
+        '-a', 'domain=127.0.0.1',
+        '-a', f'start_url={site.base_url}/recipes',
+    ]
+    for name, value in dict(TEST_SETTINGS, **settings).items():
+        command += ['-s', f'{name}={value}']
+    return command
+
+
+def run_crawl(site, stats_path, timeout=300, **settings):
+    """Crawl ``site`` in a subprocess and return the final crawl stats."""
+    command = [
+        sys.executable, '-c', CRAWL_SCRIPT, f'{site.base_url}/recipes',
+        json.dumps(dict(TEST_SETTINGS, **settings)), str(stats_path),
+    ]
+    subprocess.run(command, cwd=REPO_ROOT, check=True, timeout=timeout)
+    with open(stats_path) as f:
+        return json.load(f)
@@ -0,0 +1,120 @@
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from scrapy.settings import Settings
+
+from webscraper.addons import H2_HANDLER, POOLED_HANDLER, TransferProfile, available_encodings
+from webscraper.handlers import DomainConnectionPool
+from tests.synthetic_site import REPO_ROOT, run_crawl
+
+
+def apply_profile(**settings):
+    settings = Settings(settings)
+    TransferProfile().update_settings(settings)
+    return settings
+
+
+class TestTransferProfile:
+    """Test cases for the TransferProfile add-on."""
+
+    def test_disabled_by_default(self):
+        """Test that the add-on is not configured without TRANSFER_PROFILE."""
+        from scrapy.exceptions import NotConfigured
+        with pytest.raises(NotConfigured):
+            apply_profile()
+        with pytest.raises(NotConfigured):
+            apply_profile(TRANSFER_PROFILE='quic')
+
+    def test_keepalive_profile(self):
+        """Test that the keep-alive profile installs the pooled handler and compression."""
+        settings = apply_profile(TRANSFER_PROFILE='keepalive', COMPRESSION_ENABLED=False)
+        handlers = settings.getwithbase('DOWNLOAD_HANDLERS')
+        assert handlers['http'] == handlers['https'] == POOLED_HANDLER
+        # Project settings outrank add-ons, so only the default is overridden
+        assert settings.getbool('COMPRESSION_ENABLED') is False
+        assert apply_profile(TRANSFER_PROFILE='keepalive').getbool('COMPRESSION_ENABLED')
+
+    def test_h2_profile(self, monkeypatch):
+        """Test that HTTPS uses HTTP/2 only when h2 is installed."""
+        monkeypatch.setattr('webscraper.addons._importable', lambda module: True)
+        handlers = apply_profile(TRANSFER_PROFILE='h2').getwithbase('DOWNLOAD_HANDLERS')
+        assert handlers['https'] == H2_HANDLER
+        assert handlers['http'] == POOLED_HANDLER
+
+        monkeypatch.setattr('webscraper.addons._importable', lambda module: module != 'h2')
+        handlers = apply_profile(TRANSFER_PROFILE='h2').getwithbase('DOWNLOAD_HANDLERS')
+        assert handlers['https'] == POOLED_HANDLER
+
+    def test_explicit_handlers_win(self):
+        """Test that handlers set in the project are left alone."""
+        settings = apply_profile(TRANSFER_PROFILE='h2', DOWNLOAD_HANDLERS={'https': 'my.Handler'})
+        assert settings.getwithbase('DOWNLOAD_HANDLERS')['https'] == 'my.Handler'
+
+    def test_domain_concurrency_merged_into_slots(self):
+        """Test that per-domain concurrency lands in DOWNLOAD_SLOTS."""
+        settings = apply_profile(
+            TRANSFER_PROFILE='keepalive',
+            TRANSFER_DOMAIN_CONCURRENCY={'a.example': 16, 'b.example': 4},
+            DOWNLOAD_SLOTS={'a.example': {'delay': 1}, 'b.example': {'concurrency': 2}},
+        )
+        assert settings.getdict('DOWNLOAD_SLOTS') == {
+            'a.example': {'delay': 1, 'concurrency': 16},
+            'b.example': {'concurrency': 2},
+        }
+
+    def test_available_encodings(self):
+        """Test that gzip is always decodable and brotli/zstd are detected."""
+        encodings = available_encodings()
+        assert encodings[-2:] == ['gzip', 'deflate']
+        assert set(encodings) <= {'zstd', 'br', 'gzip', 'deflate'}
+
+    def test_pool_size_per_host(self):
+        """Test that the keep-alive pool size is looked up by hostname."""
+        pool = DomainConnectionPool(None, default_size=2, sizes={'Busy.example': 16})
+        assert pool.size_for((b'https', b'busy.example', 443)) == 16
+        assert pool.size_for((b'https', b'other.example', 443)) == 2
+
+    def test_private_pool_hooks_exist(self):
+        """Test that the Scrapy and Twisted internals the pooled handler uses are still there."""
+        # The handlers need an installed reactor, so build them in a child process
+        script = textwrap.dedent("""
+            from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+            from scrapy.utils.reactor import install_reactor
+            from scrapy.utils.test import get_crawler
+            from twisted.web.client import HTTPConnectionPool
+
+            install_reactor('twisted.internet.asyncioreactor.AsyncioSelectorReactor')
+            from webscraper.handlers import DomainConnectionPool, PooledHTTP11DownloadHandler
+
+            assert callable(getattr(HTTPConnectionPool, '_putConnection', None)), \\
+                'HTTPConnectionPool._putConnection is gone; update DomainConnectionPool'
+            crawler = get_crawler(settings_dict={'TWISTED_REACTOR_ENABLED': True, 'TRANSFER_POOL_SIZE': 3})
+            scrapy_pool = getattr(HTTP11DownloadHandler(crawler), '_pool', None)
+            assert isinstance(scrapy_pool, HTTPConnectionPool), \\
+                'HTTP11DownloadHandler._pool is gone; update PooledHTTP11DownloadHandler'
+            assert hasattr(scrapy_pool, '_factory'), \\
+                'HTTPConnectionPool._factory is gone; update PooledHTTP11DownloadHandler'
+
+            pool = PooledHTTP11DownloadHandler(crawler)._pool
+            assert isinstance(pool, DomainConnectionPool)
+            assert pool._factory is scrapy_pool._factory
+            assert pool.default_size == 3
+        """)
+        result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT,
+                                capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+
+    @pytest.mark.integration
+    def test_crawl_reuses_connections(self, recipe_site, tmp_path):
+        """Test that a crawl with the keep-alive profile completes over few connections."""
+        stats = run_crawl(recipe_site, tmp_path / 'stats.json', TRANSFER_PROFILE='keepalive',
+                          CONCURRENT_REQUESTS_PER_DOMAIN=4)
+        assert stats['item_scraped_count'] == recipe_site.recipes
+        # A connection is occasionally opened while another is being returned to the pool
+        assert recipe_site.connections <= stats['downloader/response_count'] // 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
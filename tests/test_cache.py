@@ -0,0 +1,99 @@
+import json
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from webscraper.cache import ExtractionCache, content_key
+from webscraper.spiders.recipe_spider import RecipeSpider
+from tests.synthetic_site import recipe_json
+
+PAGE = (
+    '<html><head><title>Recipe</title>{script}</head><body>'
+    '<script id="__POST_CONTENT__">' + json.dumps(recipe_json(4)) + '</script>'
+    '</body></html>'
+)
+
+
+def page(script=''):
+    return PAGE.replace('{script}', script).encode('utf-8')
+
+
+class TestExtractionCache:
+    """Test cases for ExtractionCache."""
+
+    def test_key_ignores_volatile_content(self):
+        """Test that scripts, comments and whitespace do not change the key."""
+        tracked = page('<script>ga("send", "pageview", "abc123")</script>\n<!-- 17ms -->')
+        assert content_key(tracked) == content_key(page())
+        assert content_key(page().replace(b'Recipe', b'Other')) != content_key(page())
+
+    def test_key_keeps_embedded_recipe_json(self):
+        """Test that the embedded recipe data is part of the key."""
+        changed = page().replace(b'"skillLevel": "Easy"', b'"skillLevel": "Hard"')
+        assert content_key(changed) != content_key(page())
+
+    def test_key_keeps_whitespace_inside_text(self):
+        """Test that only whitespace between tags is ignored."""
+        assert content_key(page().replace(b'</head><body>', b'</head>\n  <body>')) == content_key(page())
+        spaced_text = page().replace(b'<title>Recipe</title>', b'<title>Re  cipe</title>')
+        assert content_key(spaced_text) != content_key(page().replace(b'Recipe', b'Re cipe'))
+        spaced_json = page().replace(b'"skillLevel": "Easy"', b'"skillLevel": "Easy  "')
+        assert content_key(spaced_json) != content_key(page().replace(b'"Easy"', b'"Easy "'))
+        # Markup inside the recipe JSON is data too
+        steps = page().replace(b'<p>Bake until', b'<p>Mix.</p> <p>Bake until')
+        assert content_key(steps) != content_key(steps.replace(b'</p> <p>', b'</p><p>'))
+
+    def test_key_depends_on_extractor_version(self):
+        """Test that a new extractor version invalidates old entries."""
+        assert content_key(page(), version=1) != content_key(page(), version=2)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first."""
+        cache = ExtractionCache(max_entries=2)
+        cache.put(b'a', {'title': 'a'})
+        cache.put(b'b', {'title': 'b'})
+        cache.get(b'a')
+        cache.put(b'c', {'title': 'c'})
+        assert list(cache.entries) == [b'a', b'c']
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        """Test that entries are reloaded from disk by a new cache."""
+        path = str(tmp_path / 'cache.db')
+        cache = ExtractionCache(path=path)
+        cache.put(b'k', {'url': 'https://example.com/a', 'title': 'T'})
+        cache.close()
+
+        cache = ExtractionCache(path=path)
+        assert cache.get(b'k') == {'title': 'T'}
+        cache.close()
+
+    def test_spider_hit_skips_parser(self, monkeypatch):
+        """Test that a cache hit returns the stored item without parsing."""
+        crawler = get_crawler(RecipeSpider, {'EXTRACTION_CACHE_ENABLED': True})
+        spider = RecipeSpider.from_crawler(crawler)
+
+        first = 'https://example.com/recipes/soup'
+        response = HtmlResponse(url=first, body=page(), request=Request(first))
+        item = spider.parse_recipe(response)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('parser should not run on a cache hit')
+
+        monkeypatch.setattr(spider._extractor, 'extract', fail)
+        mirror = 'https://example.com/recipes/soup?utm_source=newsletter'
+        response = HtmlResponse(url=mirror, body=page('<script>track()</script>'),
+                                request=Request(mirror))
+        cached = spider.parse_recipe(response)
+
+        assert cached['url'] == mirror
+        assert dict(cached, url=first) == dict(item)
+        stats = crawler.stats
+        assert stats.get_value('extraction_cache/hits') == 1
+        assert stats.get_value('extraction_cache/misses') == 1
+        assert stats.get_value('extraction_cache/hit_rate') == 0.5
+        assert stats.get_value('extraction_cache/time_saved_ms') > 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
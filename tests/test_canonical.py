@@ -0,0 +1,153 @@
+import pytest
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from webscraper.canonical import CanonicalUrls, UrlRules
+from webscraper.items import WebscraperItem
+from webscraper.spiders.recipe_spider import RecipeSpider
+from tests.synthetic_site import run_crawl
+
+
+def make_middleware(**settings):
+    crawler = get_crawler(RecipeSpider, dict({'CANONICAL_ENABLED': True}, **settings))
+    return CanonicalUrls.from_crawler(crawler), crawler.stats
+
+
+def page(url, canonical=None):
+    link = f'<link rel="canonical" href="{canonical}">' if canonical else ''
+    body = f'<html><head>{link}</head><body></body></html>'.encode()
+    return HtmlResponse(url=url, body=body, request=Request(url))
+
+
+def scheduled(mw, response, urls):
+    mw.process_spider_input(response)
+    return [r.url for r in mw.process_spider_output(response, [Request(u) for u in urls])]
+
+
+class TestUrlRules:
+    """Test cases for UrlRules."""
+
+    def test_canonical_url(self):
+        """Test that tracking parameters, fragments and host noise are removed."""
+        rules = UrlRules()
+        assert rules.canonical_url(
+            'HTTPS://Example.COM:443/Soup?utm_source=x&page=2&fbclid=abc#comments'
+        ) == 'https://example.com/Soup?page=2'
+        assert rules.canonical_url('http://example.com:8080') == 'http://example.com:8080/'
+        # Kept parameters keep their order and encoding
+        assert rules.canonical_url('https://e.com/s?q=a%20b&UTM_Medium=x&b=1') == 'https://e.com/s?q=a%20b&b=1'
+
+    def test_allow_and_deny_lists(self):
+        """Test that the query allow list overrides the deny list."""
+        url = 'https://e.com/s?page=2&sort=new&ref=home'
+        assert UrlRules(query_allow=['page']).canonical_url(url) == 'https://e.com/s?page=2'
+        assert UrlRules(query_deny=['s*']).canonical_url(url) == 'https://e.com/s?page=2&ref=home'
+
+    def test_dedupe_key(self):
+        """Test that www., trailing-slash and parameter-order variants share a key."""
+        rules = UrlRules()
+        key = rules.dedupe_key('https://example.com/soup?a=1&b=2')
+        assert rules.dedupe_key('https://www.example.com/soup/?b=2&a=1#top') == key
+        assert rules.dedupe_key('https://example.com/soup?a=1&b=3') != key
+        strict = UrlRules(ignore_www=False, ignore_trailing_slash=False)
+        assert strict.dedupe_key('https://www.example.com/soup') != strict.dedupe_key('https://example.com/soup')
+        assert strict.dedupe_key('https://example.com/soup/') != strict.dedupe_key('https://example.com/soup')
+
+
+class TestCanonicalUrls:
+    """Test cases for the CanonicalUrls spider middleware."""
+
+    def test_collapses_variants(self):
+        """Test that link variants are rewritten and scheduled once."""
+        mw, stats = make_middleware()
+        urls = scheduled(mw, page('https://example.com/recipes'), [
+            'https://example.com/recipes/soup?utm_source=newsletter',
+            'https://www.example.com/recipes/soup/',
+            'https://example.com/recipes/soup#comments',
+            'https://example.com/recipes/stew',
+            'https://example.com/recipes/stew',
+            'https://example.com/recipes?utm_campaign=x',
+        ])
+        assert urls == ['https://example.com/recipes/soup', 'https://example.com/recipes/stew']
+        assert stats.get_value('canonical/rewritten') == 1
+        # The exact duplicate and the fragment variant were Scrapy's to drop anyway
+        assert stats.get_value('canonical/avoided_fetches') == 2
+
+    def test_learns_rel_canonical(self):
+        """Test that aliases of a page with rel=canonical are never fetched."""
+        mw, stats = make_middleware()
+        alias = page('https://example.com/recipe/soup-print', canonical='/recipes/soup')
+        assert scheduled(mw, alias, [
+            'https://example.com/recipes/soup',
+            'https://example.com/recipe/soup-print?utm_source=x',
+            'https://example.com/recipes/stew',
+        ]) == ['https://example.com/recipes/stew']
+        assert stats.get_value('canonical/aliases') == 1
+        assert stats.get_value('canonical/avoided_fetches') == 2
+
+    def test_items_use_canonical_url(self):
+        """Test that items carry the canonical URL and duplicate pages are dropped."""
+        mw, stats = make_middleware()
+        first = page('https://example.com/recipes/soup?utm_source=x', canonical='https://example.com/recipes/soup')
+        mw.process_spider_input(first)
+        items = list(mw.process_spider_output(first, [WebscraperItem(url=first.url)]))
+        assert items[0]['url'] == 'https://example.com/recipes/soup'
+
+        # Already queued before the alias was learned: fetched, but its item is a duplicate
+        second = page('https://example.com/recipe/soup', canonical='https://example.com/recipes/soup')
+        mw.process_spider_input(second)
+        assert list(mw.process_spider_output(second, [WebscraperItem(url=second.url)])) == []
+        assert stats.get_value('canonical/duplicate_items') == 1
+
+    def test_ignores_home_page_and_offsite_canonicals(self):
+        """Test that implausible rel=canonical targets are not learned."""
+        mw, stats = make_middleware()
+        mw.process_spider_input(page('https://example.com/recipes/soup', canonical='https://example.com/'))
+        mw.process_spider_input(page('https://example.com/recipes/stew', canonical='https://other.com/stew'))
+        assert mw.aliases == {}
+
+    def test_dont_filter_requests_untouched(self):
+        """Test that requests with dont_filter bypass canonicalization."""
+        mw, stats = make_middleware()
+        response = page('https://example.com/recipes')
+        mw.process_spider_input(response)
+        request = Request('https://example.com/recipes?utm_source=x', dont_filter=True)
+        assert list(mw.process_spider_output(response, [request, request])) == [request, request]
+
+    @pytest.mark.integration
+    def test_crawl_fetches_each_recipe_once(self, recipe_site, tmp_path):
+        """Test that a crawl over link variants and aliases yields each recipe once."""
+        site = recipe_site
+        default = site.page
+
+        def category(path):
+            k = int(path.rsplit('-', 1)[1])
+            links = []
+            for i in range(k * site.per_page, min((k + 1) * site.per_page, site.recipes)):
+                links += [f'/recipes/recipe-{i}?utm_source=feed', f'/recipes/recipe-{i}/',
+                          f'/recipes/recipe-{i}#reviews', f'/recipe/recipe-{i}']
+            return site.html(f'Category page {k}', links)
+
+        def alias(path):
+            status, headers, body = default('/recipes/recipe-' + path.rstrip('/').rsplit('-', 1)[1])
+            canonical = f'<link rel="canonical" href="/recipes/recipe-{path.rstrip("/").rsplit("-", 1)[1]}">'
+            return status, headers, body.replace(b'<head>', b'<head>' + canonical.encode())
+
+        for k in range(site.recipes // site.per_page):
+            site.routes[f'/recipes/category/page-{k}'] = category
+        for i in range(site.recipes):
+            site.routes[f'/recipes/recipe-{i}/'] = alias
+            site.routes[f'/recipe/recipe-{i}'] = alias
+
+        stats = run_crawl(site, tmp_path / 'stats.json')
+        assert stats['item_scraped_count'] == site.recipes
+        assert stats['canonical/avoided_fetches'] > 0
+        for i in range(site.recipes):
+            # The canonical page plus at most one alias fetched before it was learned
+            fetches = sum(site.hits[p] for p in (f'/recipes/recipe-{i}', f'/recipes/recipe-{i}/',
+                                                 f'/recipe/recipe-{i}'))
+            assert fetches <= 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
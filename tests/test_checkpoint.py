@@ -0,0 +1,118 @@
+import json
+import os
+import signal
+import subprocess
+import time
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+from webscraper.checkpoint import CrawlCheckpoint, load_checkpoint, url_key
+from webscraper.items import WebscraperItem
+from tests.synthetic_site import REPO_ROOT, crawl_command
+
+
+def read_items(directory):
+    with open(os.path.join(directory, 'items.jl'), encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+class TestCrawlCheckpoint:
+    """Test cases for CrawlCheckpoint."""
+
+    def make_page(self, url, links=(), item=True):
+        response = HtmlResponse(url=url, body=b'<html></html>', request=Request(url))
+        result = [Request(link) for link in links]
+        if item:
+            result.append(WebscraperItem(url=url, title='t'))
+        return response, result
+
+    def test_snapshot_and_resume(self, tmp_path):
+        """Test that done pages are dropped and pending ones are resumed."""
+        checkpoint = CrawlCheckpoint(str(tmp_path), interval=0)
+        response, result = self.make_page('https://example.com/recipes/a',
+                                          links=['https://example.com/recipes/b'])
+        for i in checkpoint.process_spider_output(response, result, None):
+            if isinstance(i, WebscraperItem):
+                checkpoint.item_scraped(i, response, None)
+        checkpoint.snapshot()
+
+        state = load_checkpoint(str(tmp_path))
+        assert state['pending'] == ['https://example.com/recipes/b']
+        assert url_key('https://example.com/recipes/a') in state['done']
+        assert state['items'] == 1
+
+        resumed = CrawlCheckpoint(str(tmp_path), interval=0)
+        assert resumed.resumed
+        response, result = self.make_page('https://example.com/recipes/b',
+                                          links=['https://example.com/recipes/a'],
+                                          item=False)
+        output = list(resumed.process_spider_output(response, result, None))
+        assert output == []
+
+    def test_page_not_done_until_item_exported(self, tmp_path):
+        """Test that a page stays pending while its item is in the pipeline."""
+        checkpoint = CrawlCheckpoint(str(tmp_path), interval=0)
+        response, result = self.make_page('https://example.com/recipes/a')
+        list(checkpoint.process_spider_output(response, result, None))
+        checkpoint.snapshot()
+        assert url_key(response.url) not in load_checkpoint(str(tmp_path))['done']
+
+    def test_torn_tail_is_discarded(self, tmp_path):
+        """Test that data written after the last snapshot is truncated on load."""
+        checkpoint = CrawlCheckpoint(str(tmp_path), interval=0)
+        checkpoint._record('frontier', 'https://example.com/recipes/a')
+        checkpoint.snapshot()
+        with open(tmp_path / 'frontier.log', 'ab') as f:
+            f.write(b'https://example.com/recipes/tor')
+        with open(tmp_path / 'manifest.log', 'ab') as f:
+            f.write(b'{"frontier": 9')
+
+        state = load_checkpoint(str(tmp_path))
+        assert state['pending'] == ['https://example.com/recipes/a']
+        assert os.path.getsize(tmp_path / 'frontier.log') == state['offsets']['frontier']
+
+    def test_no_checkpoint(self, tmp_path):
+        """Test that an empty directory starts a fresh crawl."""
+        assert load_checkpoint(str(tmp_path)) is None
+        assert not CrawlCheckpoint(str(tmp_path), interval=0).resumed
+
+
+@pytest.mark.integration
+@pytest.mark.slow
+def test_killed_crawl_resumes_to_same_output(recipe_site, tmp_path):
+    """Kill a crawl mid-run with SIGKILL and check the resumed export is complete."""
+    recipe_site.recipes = 40
+    recipe_site.delay = 0.05
+    directory = str(tmp_path / 'checkpoint')
+    command = crawl_command(recipe_site, CHECKPOINT_DIR=directory,
+                            CHECKPOINT_INTERVAL=0.1, CONCURRENT_REQUESTS=2)
+
+    process = subprocess.Popen(command, cwd=REPO_ROOT)
+    items_path = os.path.join(directory, 'items.jl')
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if os.path.exists(items_path) and os.path.getsize(items_path) > 0:
+            if len(read_items(directory)) >= 10:
+                break
+        time.sleep(0.05)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+
+    killed_hits = dict(recipe_site.hits)
+    # Loading truncates whatever the kill left after the last snapshot
+    load_checkpoint(directory)
+    exported_before = {item['url'] for item in read_items(directory)}
+    assert 0 < len(exported_before) < recipe_site.recipes
+
+    subprocess.run(command, cwd=REPO_ROOT, check=True, timeout=120)
+
+    urls = [item['url'] for item in read_items(directory)]
+    assert len(urls) == len(set(urls))
+    assert set(urls) == recipe_site.recipe_urls()
+    assert load_checkpoint(directory)['pending'] == []
+
+    # Pages exported before the crash are not fetched again
+    for url in exported_before:
+        path = url[len(recipe_site.base_url):]
+        assert recipe_site.hits[path] == killed_hits[path], url
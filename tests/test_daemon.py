@@ -0,0 +1,404 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from tests.synthetic_site import TEST_SETTINGS, SyntheticRecipeSite
+from webscraper.daemon import CrawlDaemon, FairQueue, Job, crawl_arguments, job_spec, main, make_server
+
+
+class FakeWorker:
+    """Stands in for a worker process; records the messages sent to it."""
+
+    def __init__(self, index, events, settings, context):
+        self.index = index
+        self.pid = 1000 + index
+        self.exitcode = None
+        self.running = {}
+        self.jobs_run = 0
+        self.ready = True
+        self.accepting = True
+        self.sent = []
+        self.is_alive = True
+
+    def start(self):
+        pass
+
+    def alive(self):
+        return self.is_alive
+
+    def send(self, *message):
+        self.sent.append(message)
+
+    def terminate(self):
+        self.is_alive = False
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = CrawlDaemon(str(tmp_path), workers=2, slots=1, worker_class=FakeWorker)
+    daemon.add_worker()
+    daemon.add_worker()
+    return daemon
+
+
+def finish(daemon, job, reason='finished'):
+    with daemon.changed:
+        daemon.handle_event(('finished', job.id, {'finish_reason': reason}))
+        daemon.check_workers()
+        daemon.dispatch()
+
+
+class TestJobSpec:
+    """Test cases for validating submitted jobs."""
+
+    def test_defaults_and_arguments(self):
+        """Test that a job becomes spider arguments and CloseSpider settings."""
+        spec = job_spec({'domain': 'Example.com', 'max_items': 10, 'max_time': 1.5,
+                         'settings': {'DOWNLOAD_DELAY': 0}})
+        assert spec['domain'] == 'example.com' and spec['discovery'] == 'crawl'
+        assert crawl_arguments(spec) == ({'domain': 'example.com'}, {
+            'DOWNLOAD_DELAY': 0, 'CLOSESPIDER_ITEMCOUNT': 10, 'CLOSESPIDER_TIMEOUT': 1.5})
+
+        spec = job_spec({'domain': 'example.com', 'discovery': 'pages', 'urls': ['https://example.com/a']})
+        assert crawl_arguments(spec)[0] == {
+            'domain': 'example.com', 'start_urls': ['https://example.com/a'], 'follow_links': False}
+
+    @pytest.mark.parametrize('data', [
+        [],
+        {},
+        {'domain': ''},
+        {'domain': 'example.com', 'discovery': 'sitemap'},
+        {'domain': 'example.com', 'discovery': 'pages'},
+        {'domain': 'example.com', 'urls': ['https://example.com/a']},
+        {'domain': 'example.com', 'max_items': -1},
+        {'domain': 'example.com', 'max_pages': 2.5},
+        {'domain': 'example.com', 'max_items': True},
+        {'domain': 'example.com', 'settings': []},
+        {'domain': 'example.com', 'settings': {'FEEDS': {'/tmp/x.jl': {'format': 'jsonlines'}}}},
+        {'domain': 'example.com', 'settings': {'ITEM_PIPELINES': {'os.system': 1}}},
+        {'domain': 'example.com', 'settings': {'DOWNLOAD_DELAY': [1]}},
+        {'domain': 'example.com', 'priority': 1},
+        {'domain': '../../etc'},
+    ])
+    def test_invalid(self, data):
+        """Test that malformed jobs are rejected."""
+        with pytest.raises(ValueError):
+            job_spec(data)
+
+
+class TestScheduling:
+    """Test cases for how jobs are queued and handed to workers."""
+
+    def test_fair_queue(self, tmp_path):
+        """Test that domains take turns and busy domains are skipped."""
+        fair = FairQueue()
+        jobs = [Job(job_spec({'domain': domain}), str(tmp_path)) for domain in 'aaab']
+        for job in jobs:
+            fair.push(job)
+        assert fair.pop() is jobs[0]
+        assert fair.pop() is jobs[3]
+        assert fair.pop(skip={'a'}) is None
+        assert fair.remove(jobs[2]) and len(fair) == 1
+        assert fair.pop() is jobs[1]
+
+    def test_dispatch(self, daemon):
+        """Test that a domain runs one job at a time, on the worker that last crawled it."""
+        a1, a2, _ = (daemon.submit({'domain': 'a.com'}) for _ in range(3))
+        b = daemon.submit({'domain': 'www.b.com'})
+        assert [a1.state, b.state, a2.state] == ['running', 'running', 'queued']
+        first, second = daemon.workers
+        assert first.sent == [('run', a1.id, 'a.com', {'domain': 'a.com'}, {})]
+        assert b.worker is second
+
+        finish(daemon, b)
+        # The second worker is free, but a.com already has a job running
+        assert a2.state == 'queued' and not second.running
+        finish(daemon, a1)
+        assert a2.state == 'running' and a2.worker is first
+        assert daemon.status()['queued'] == 1
+
+    def test_items_and_status(self, daemon, tmp_path):
+        """Test that items are appended to the job's file and the final status is saved."""
+        job = daemon.submit({'domain': 'a.com'})
+        with daemon.changed:
+            daemon.handle_event(('progress', job.id, b'{"n": 1}\n{"n": 2}\n', 2, 3))
+        assert job.items == 2 and job.pages == 3
+        assert b''.join(daemon.follow_items(job, follow=False)) == b'{"n": 1}\n{"n": 2}\n'
+        assert b''.join(daemon.follow_items(job, offset=9, follow=False)) == b'{"n": 2}\n'
+
+        finish(daemon, job, reason='closespider_itemcount')
+        assert b''.join(daemon.follow_items(job)) == b'{"n": 1}\n{"n": 2}\n'
+        assert [status['state'] for status in daemon.follow_status(job)] == ['finished']
+        with open(tmp_path / f'{job.id}.json') as f:
+            assert json.load(f)['reason'] == 'closespider_itemcount'
+
+    def test_follow_items_waits_for_the_job(self, daemon):
+        """Test that streaming readers get items as they arrive and stop when the job ends."""
+        job = daemon.submit({'domain': 'a.com'})
+        chunks = daemon.follow_items(job)
+        received = []
+        reader = threading.Thread(target=lambda: received.extend(chunks))
+        reader.start()
+        with daemon.changed:
+            daemon.handle_event(('progress', job.id, b'{"n": 1}\n', 1, 1))
+        finish(daemon, job)
+        reader.join(5)
+        assert not reader.is_alive() and received == [b'{"n": 1}\n']
+
+    def test_cancel(self, daemon):
+        """Test that queued jobs are dropped and running jobs are told to close."""
+        running = daemon.submit({'domain': 'a.com'})
+        queued = daemon.submit({'domain': 'a.com'})
+        assert daemon.cancel(queued.id).state == 'cancelled'
+        assert daemon.cancel(running.id).state == 'running'
+        assert daemon.workers[0].sent[-1] == ('cancel', running.id)
+        finish(daemon, running, reason='cancelled')
+        assert running.state == 'cancelled'
+        assert daemon.cancel('nope') is None
+
+    def test_dead_worker(self, daemon):
+        """Test that a crashed worker's jobs fail and the worker is replaced."""
+        job = daemon.submit({'domain': 'a.com'})
+        crashed = job.worker
+        crashed.is_alive, crashed.exitcode = False, -9
+        with daemon.changed:
+            daemon.check_workers()
+        assert job.state == 'failed' and 'code -9' in job.error
+        assert crashed not in daemon.workers and len(daemon.workers) == 2
+
+    def test_per_domain_directories_run_one_job_per_domain(self, tmp_path):
+        """Test that workers keeping per-domain directories get one job per domain."""
+        daemon = CrawlDaemon(str(tmp_path), workers=2, slots=2, jobs_per_domain=2, worker_class=FakeWorker)
+        daemon.add_worker()
+        with daemon.changed:
+            daemon.handle_event(('ready', 0, 1000, ['CHANGEFEED_DIR']))
+        first, second = daemon.submit({'domain': 'a.com'}), daemon.submit({'domain': 'a.com'})
+        assert [first.state, second.state] == ['running', 'queued']
+        finish(daemon, first)
+        assert second.state == 'running'
+
+    def test_recycle(self, tmp_path):
+        """Test that a worker is replaced once it has run recycle_after jobs."""
+        daemon = CrawlDaemon(str(tmp_path), workers=1, recycle_after=2, worker_class=FakeWorker)
+        worker = daemon.add_worker()
+        jobs = [daemon.submit({'domain': domain}) for domain in 'abc']
+        assert [job.state for job in jobs] == ['running', 'running', 'queued']
+        finish(daemon, jobs[0])
+        assert worker in daemon.workers
+        finish(daemon, jobs[1])
+        assert worker.sent[-1] == ('stop',) and worker not in daemon.workers
+        assert jobs[2].worker is daemon.workers[0]
+
+    def test_keep_finished(self, tmp_path):
+        """Test that only the last keep_finished finished jobs are remembered."""
+        daemon = CrawlDaemon(str(tmp_path), keep_finished=2, worker_class=FakeWorker)
+        jobs = [daemon.submit({'domain': 'a.com'}) for _ in range(3)]
+        for job in jobs:
+            daemon.cancel(job.id)
+        assert list(daemon.jobs) == [jobs[1].id, jobs[2].id]
+
+
+class TestApi:
+    """Test cases for the HTTP job API."""
+
+    @pytest.fixture
+    def api(self, daemon):
+        server = make_server(daemon, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+        server.shutdown()
+        server.server_close()
+
+    def call(self, url, method='GET', data=None, **headers):
+        body = json.dumps(data).encode() if data is not None else None
+        headers = {'Content-Type': 'application/json', **headers}
+        request = urllib.request.Request(url, body, headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def test_jobs(self, api, daemon):
+        """Test submitting, reading, streaming and cancelling jobs."""
+        status, body = self.call(f'{api}/jobs', 'POST', {'domain': 'a.com', 'max_items': 5})
+        job = json.loads(body)
+        assert status == 201 and job['state'] == 'running' and job['worker'] == 1000
+        status, body = self.call(f'{api}/jobs', 'POST', {'domain': 'a.com', 'max_items': 'all'})
+        assert status == 400 and 'max_items' in json.loads(body)['error']
+
+        with daemon.changed:
+            daemon.handle_event(('progress', job['id'], b'{"n": 1}\n', 1, 1))
+        status, body = self.call(f'{api}/jobs/{job["id"]}/items?follow=0')
+        assert status == 200 and body == b'{"n": 1}\n'
+        assert json.loads(self.call(f'{api}/jobs/{job["id"]}')[1])['items'] == 1
+        assert json.loads(self.call(f'{api}/jobs')[1])['jobs'][0]['id'] == job['id']
+
+        status, body = self.call(f'{api}/jobs/{job["id"]}', 'DELETE')
+        assert status == 200 and daemon.workers[0].sent[-1] == ('cancel', job['id'])
+        assert self.call(f'{api}/jobs/nope')[0] == 404
+        assert self.call(f'{api}/jobs/{job["id"]}/nope')[0] == 404
+        assert self.call(f'{api}/nope', 'POST', {})[0] == 404
+
+    def test_rejects_cross_site_requests(self, api, daemon):
+        """Test that simple form posts and rebound host names are refused."""
+        status, body = self.call(f'{api}/jobs', 'POST', {'domain': 'a.com'}, **{'Content-Type': 'text/plain'})
+        assert status == 415
+        assert self.call(f'{api}/jobs', 'POST', {'domain': 'a.com'}, Host='evil.example:6810')[0] == 403
+        assert self.call(f'{api}/status', Host='evil.example')[0] == 403
+        assert self.call(f'{api}/status', Host='localhost:6810')[0] == 200
+        assert not daemon.jobs
+
+    def test_token(self, daemon):
+        """Test that a server with a token refuses requests without it."""
+        server = make_server(daemon, port=0, token='s3cret')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        try:
+            assert self.call(f'{url}/status')[0] == 401
+            assert self.call(f'{url}/status', Authorization='Bearer nope')[0] == 401
+            assert self.call(f'{url}/status', Authorization='Bearer s3cret')[0] == 200
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_unix_socket(self, daemon, tmp_path, capsys, monkeypatch):
+        """Test that the API is served on a Unix socket and the client reaches it."""
+        path = str(tmp_path / 'daemon.sock')
+        umask = os.umask(0o022)
+        try:
+            server = make_server(daemon, socket_path=path, token='s3cret')
+        finally:
+            assert os.umask(umask) == 0o022
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            assert os.stat(path).st_mode & 0o777 == 0o600
+            assert main(['status', '--socket', path]) == 1
+            assert 'token' in json.loads(capsys.readouterr().out)['error']
+            monkeypatch.setenv('WEBSCRAPER_DAEMON_TOKEN', 's3cret')
+            assert main(['submit', 'a.com', '--max-pages', '3', '--socket', path]) == 0
+            job = json.loads(capsys.readouterr().out)
+            assert daemon.job(job['id']).spec['max_pages'] == 3
+            assert main(['status', '--socket', path]) == 0
+            assert json.loads(capsys.readouterr().out)['running'] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_serve_binds_host(self, tmp_path, monkeypatch):
+        """Test that ``serve --host`` binds the API to that address."""
+        class FakeDaemon:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def start(self):
+                pass
+
+            def stop(self):
+                pass
+
+        bound = []
+
+        def fake_make_server(daemon, port, host, socket_path, token):
+            bound.append((host, port, socket_path))
+            server = make_server(daemon, port=0, host=host)
+            server.serve_forever = lambda: bound.append(server.server_address[0])
+            return server
+
+        monkeypatch.setattr('webscraper.daemon.CrawlDaemon', FakeDaemon)
+        monkeypatch.setattr('webscraper.daemon.make_server', fake_make_server)
+        monkeypatch.setattr('signal.signal', lambda *args: None)
+        assert main(['serve', '--host', '127.0.0.2', '--port', '6899', '--dir', str(tmp_path)]) == 0
+        assert bound == [('127.0.0.2', 6899, None), '127.0.0.2']
+
+
+@pytest.mark.slow
+@pytest.mark.integration
+class TestDaemonCrawl:
+    """Test cases for crawls run by real worker processes."""
+
+    def test_jobs_share_a_warm_worker(self, tmp_path):
+        """Test that concurrent jobs run in one worker, with exact item budgets and cancelling."""
+        sites = [SyntheticRecipeSite().start(), SyntheticRecipeSite(recipes=30, delay=0.05).start(),
+                 SyntheticRecipeSite(delay=0.2).start()]
+        checkpoints = tmp_path / 'checkpoints'
+        daemon = CrawlDaemon(str(tmp_path), workers=1, slots=3,
+                             settings=dict(TEST_SETTINGS, CHECKPOINT_DIR=str(checkpoints))).start()
+        try:
+            full = daemon.submit({'domain': '127.0.0.1', 'start_url': f'{sites[0].base_url}/recipes'})
+            # Another host name for the same server, so it counts as another domain
+            budget = daemon.submit({
+                'domain': 'localhost', 'max_items': 5,
+                'start_url': sites[1].base_url.replace('127.0.0.1', 'localhost') + '/recipes',
+            })
+            pages = daemon.submit({
+                'domain': '127.0.0.1', 'discovery': 'pages',
+                'urls': [f'{sites[2].base_url}/recipes/recipe-{i}' for i in range(3)],
+                # Overrides the daemon's DOWNLOAD_DELAY of 0
+                'settings': {'DOWNLOAD_DELAY': 0.3},
+            })
+            # Waits for the other 127.0.0.1 job, although a slot is free
+            assert [full.state, budget.state, pages.state] == ['running', 'running', 'queued']
+
+            assert len(b''.join(daemon.follow_items(budget)).splitlines()) == 5
+            assert budget.reason == 'closespider_itemcount'
+            assert len(b''.join(daemon.follow_items(full)).splitlines()) == 50
+            assert full.state == 'finished' and full.stats['item_scraped_count'] == 50
+            assert len(b''.join(daemon.follow_items(pages)).splitlines()) == 3
+            assert sites[2].hits['/recipes/recipe-3'] == 0
+            assert pages.stats['elapsed_time_seconds'] > 0.25
+
+            slow = daemon.submit({'domain': '127.0.0.1', 'start_url': f'{sites[2].base_url}/recipes'})
+            for status in daemon.follow_status(slow):
+                if status['items']:
+                    daemon.cancel(slow.id)
+            assert slow.state == 'cancelled' and slow.items < 50
+            assert len({job.worker.pid for job in (full, budget, pages, slow)}) == 1
+            # Checkpoints are kept per domain, and only until a job finishes
+            assert sorted(os.listdir(checkpoints)) == ['127.0.0.1', 'localhost']
+        finally:
+            daemon.stop()
+            for site in sites:
+                site.stop()
+        assert not daemon.workers
+
+    def test_jobs_of_a_domain_share_its_change_feed(self, tmp_path):
+        """Test that a domain's second job reports changes against its first."""
+        site = SyntheticRecipeSite(recipes=10).start()
+        feeds = tmp_path / 'changes'
+        settings = dict(TEST_SETTINGS, CHANGEFEED_DIR=str(feeds), CHECKPOINT_DIR=str(tmp_path / 'checkpoints'))
+        daemon = CrawlDaemon(str(tmp_path), workers=1, slots=2, jobs_per_domain=2, settings=settings).start()
+        spec = {'domain': '127.0.0.1', 'start_url': f'{site.base_url}/recipes'}
+        try:
+            first, second = daemon.submit(spec), daemon.submit(spec)
+            assert second.state == 'queued'
+            assert len(b''.join(daemon.follow_items(first)).splitlines()) == 10
+            list(daemon.follow_items(second))
+            assert second.state == 'finished' and second.items == 10
+            assert not os.path.exists(tmp_path / 'checkpoints' / '127.0.0.1')
+
+            site.recipes = 9
+            renamed = site.page('/recipes/recipe-3')[2].replace(b'Recipe 3<', b'Lemon chicken<')
+            site.routes['/recipes/recipe-3'] = lambda path: (200, {'Content-Type': 'text/html'}, renamed)
+            third = daemon.submit(spec)
+            list(daemon.follow_items(third))
+            assert third.items == 9
+        finally:
+            daemon.stop()
+            site.stop()
+
+        feeds = sorted((feeds / '127.0.0.1').glob('changes-*.jl'))
+        assert len(feeds) == 3
+        ops = [[(c['op'], c['url'].rsplit('/', 1)[1]) for c in map(json.loads, f.read_text().splitlines())]
+               for f in feeds]
+        assert [op for op, _ in ops[0]] == ['added'] * 10
+        assert ops[1] == []
+        assert ops[2] == [('changed', 'recipe-3'), ('removed', 'recipe-9')]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
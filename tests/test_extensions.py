@@ -0,0 +1,113 @@
+import sys
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from webscraper.extensions import MemoryBudget, current_rss
+from webscraper.spiders.recipe_spider import RecipeSpider
+from tests.synthetic_site import run_crawl
+
+
+class FakeEngine:
+    def __init__(self):
+        self.paused = False
+        self.scraper = type('Scraper', (), {'slot': None})()
+        self.downloader = type('Downloader', (), {'active': set()})()
+
+    def pause(self):
+        self.paused = True
+
+    def unpause(self):
+        self.paused = False
+
+
+class TestMemoryBudget:
+    """Test cases for MemoryBudget."""
+
+    def make_budget(self, **kwargs):
+        crawler = get_crawler(RecipeSpider)
+        crawler.engine = FakeEngine()
+        return MemoryBudget(crawler, **kwargs)
+
+    def test_current_rss(self):
+        """Test that the current RSS is a plausible size."""
+        assert 1 << 20 < current_rss() < 1 << 40
+
+    def test_current_rss_without_proc_or_resource(self, monkeypatch):
+        """Test that the RSS falls back to getrusage, then to 0 without it."""
+        def no_proc(*args, **kwargs):
+            raise OSError('no /proc')
+
+        monkeypatch.setattr('builtins.open', no_proc)
+        assert 1 << 20 < current_rss() < 1 << 40
+        monkeypatch.setitem(sys.modules, 'resource', None)
+        assert current_rss() == 0
+
+    def test_pauses_over_rss_ceiling(self):
+        """Test that scheduling pauses over the ceiling and resumes under it."""
+        budget = self.make_budget(rss_limit=1)
+        budget.check()
+        assert budget.crawler.engine.paused
+        assert budget.crawler.stats.get_value('memory_budget/pauses') == 1
+
+        budget.rss_limit = 1 << 50
+        budget.check()
+        assert not budget.crawler.engine.paused
+
+    def test_resumes_when_stalled(self):
+        """Test that an idle crawl is not left paused forever."""
+        budget = self.make_budget(rss_limit=1)
+        budget.check()
+        budget.check()
+        assert not budget.crawler.engine.paused
+        assert budget.crawler.stats.get_value('memory_budget/stalls') == 1
+
+    def test_timeline_is_bounded(self):
+        """Test that the memory timeline never grows past its size."""
+        budget = self.make_budget()
+        for _ in range(1000):
+            budget.check()
+        assert len(budget.timeline) < MemoryBudget.TIMELINE_SIZE
+
+    def test_parse_recipe_releases_tree(self, spider):
+        """Test that items hold plain strings, not parts of the parsed tree."""
+        body = (b'<html><head><title>Soup</title></head><body>'
+                b'<li class="wprm-recipe-ingredient">1 cup lentils</li>'
+                + b'<span class="wprm-recipe-tag">Vegan</span>' * 100 + b'</body></html>')
+        url = 'https://example.com/recipes/soup'
+        item = spider.parse_recipe(HtmlResponse(url=url, body=body, request=Request(url)))
+        assert type(item['title']) is str
+        assert item['dietary_labels'] == ['Vegan']
+
+
+@pytest.mark.integration
+@pytest.mark.slow
+def test_memory_stays_flat_on_long_crawl(recipe_site, tmp_path):
+    """Crawl a large synthetic site and check traced memory stops growing after warm-up."""
+    recipe_site.recipes = 1500
+    recipe_site.per_page = 50
+    recipe_site.padding = 20000
+    stats = run_crawl(
+        recipe_site, tmp_path / 'stats.json',
+        CONCURRENT_REQUESTS=16,
+        CONCURRENT_REQUESTS_PER_DOMAIN=16,
+        MEMORY_BUDGET_ENABLED=True,
+        MEMORY_BUDGET_RSS_MB=2048,
+        MEMORY_BUDGET_INFLIGHT_MB=4,
+        MEMORY_BUDGET_CHECK_INTERVAL=0.2,
+        MEMORY_BUDGET_TRACEMALLOC=10,
+    )
+
+    assert stats['item_scraped_count'] == recipe_site.recipes
+    assert len(stats['memory_budget/top_allocators']) == 10
+
+    # Instant samples swing with in-flight responses and GC cycles, so
+    # compare the floor of the middle and last third of the crawl
+    timeline = stats['memory_budget/timeline']
+    total = timeline[-1][0]
+    middle = [traced for responses, _, traced in timeline if total / 3 <= responses < total * 2 / 3]
+    last = [traced for responses, _, traced in timeline if responses >= total * 2 / 3]
+    assert middle and last
+    # Anything proportional to the pages crawled would grow by several MB here
+    assert min(last) - min(middle) < 2.0, timeline
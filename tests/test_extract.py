@@ -0,0 +1,169 @@
+import json
+import subprocess
+import sys
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+from webscraper.extract import (
+    Extractor, extract_many, extract_recipe, extract_time_minutes, find_post_content,
+)
+from tests.synthetic_site import REPO_ROOT, recipe_json
+
+
+def post_content_page(index, title='<title>Recipe</title>', before=''):
+    return (
+        f'<html><head>{title}</head><body>{before}'
+        f'<script id="__POST_CONTENT__">{json.dumps(recipe_json(index))}</script>'
+        '</body></html>'
+    )
+
+
+@pytest.fixture
+def extractor():
+    return Extractor()
+
+
+class TestExtract:
+    """Test cases for the Scrapy-free extraction API."""
+
+    def test_import_does_not_load_scrapy(self):
+        """Test that importing the API pulls in neither Scrapy, Twisted nor bs4."""
+        code = (
+            'import sys, webscraper.extract; '
+            'print(sorted({m.split(".")[0] for m in sys.modules} '
+            '& {"scrapy", "twisted", "bs4", "lxml"}))'
+        )
+        output = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        assert output.strip() == '[]'
+
+    def test_extract_recipe_from_embedded_json(self):
+        """Test extraction of a page with __POST_CONTENT__ JSON."""
+        recipe = extract_recipe(post_content_page(3), 'https://example.com/recipes/r3')
+        assert recipe['url'] == 'https://example.com/recipes/r3'
+        assert recipe['title'] == 'Recipe'
+        assert recipe['ingredients'] == ['2 cups flour', '1 lemon (zested)', '3 g chicken']
+        assert recipe['time'] == {'prep': 10, 'cook': 3, 'total': 13}
+        assert recipe['dietary_labels'] == ['Gluten-free']
+        assert recipe['instructions'] == 'Step one for recipe 3.\nBake until golden.'
+        assert recipe['ratings'] == '4.5/5 (3 ratings)'
+
+    def test_extract_recipe_accepts_bytes(self):
+        """Test that undecoded response bodies can be passed directly."""
+        html = post_content_page(1).encode('utf-8')
+        assert extract_recipe(html, 'u')['ingredients'][0] == '2 cups flour'
+
+    def test_matches_spider(self, spider):
+        """Test that the spider and the library API produce the same item."""
+        url = 'https://example.com/recipes/r5'
+        html = post_content_page(5)
+        response = HtmlResponse(url=url, body=html.encode('utf-8'), request=Request(url))
+        assert dict(spider.parse_recipe(response)) == extract_recipe(html, url)
+
+    def test_extract_many_streams(self):
+        """Test that batch mode yields one recipe per document, in order."""
+        documents = ((post_content_page(i), f'https://example.com/recipes/r{i}') for i in range(5))
+        recipes = extract_many(documents)
+        assert not isinstance(recipes, list)
+        assert [recipe['url'] for recipe in recipes] == [
+            f'https://example.com/recipes/r{i}' for i in range(5)
+        ]
+
+    @pytest.mark.parametrize('text, minutes', [
+        ('prep 15 minutes', 15),
+        ('cook 2 hours', 120),
+        ('total 1h 30m', 90),
+        ('3 hrs', 180),
+        ('soon', 0),
+    ])
+    def test_extract_time_minutes(self, text, minutes):
+        """Test time parsing in its supported formats."""
+        assert extract_time_minutes(text) == minutes
+
+
+class TestEmbeddedFastPath:
+    """Test cases for reading __POST_CONTENT__ JSON without building a DOM."""
+
+    @pytest.mark.parametrize('title', [
+        '<title>Recipe</title>',
+        '<title>Mac &amp; Cheese&nbsp;&#39;s &copy;</title>',
+        '<TITLE lang="en">  Crème brûlée\n</TITLE>',
+        '<title></title>',
+        '',
+        '<script>var t = "<title>No</title>";</script><!-- <title>Old</title> --><title>New</title>',
+    ])
+    def test_matches_dom_path(self, extractor, title):
+        """Test that the fast path returns exactly what the DOM path does."""
+        html = post_content_page(7, title=title).encode('utf-8')
+        fast = extractor.extract_embedded(html, 'u')
+        assert fast is not None
+        assert fast == extractor.extract_dom(html, 'u')
+        assert list(fast) == list(extractor.extract_dom(html, 'u'))
+
+    def test_does_not_build_a_dom(self, extractor, monkeypatch):
+        """Test that extract() never parses pages the fast path handles."""
+        def make_soup(html):
+            raise AssertionError('DOM built')
+        monkeypatch.setattr(extractor, 'make_soup', make_soup)
+        assert extractor.extract(post_content_page(2), 'u')['ratings'] == '4.5/5 (2 ratings)'
+
+    @pytest.mark.parametrize('html', [
+        # Malformed JSON: the DOM path falls back to generic HTML parsing
+        '<html><head><title>R</title></head><body><script id="__POST_CONTENT__">{"a": </script>'
+        '<ul><li>2 cups of flour</li></ul></body></html>',
+        # WPRM pages are parsed from their markup
+        post_content_page(1, before='<ul><li class="wprm-recipe-ingredient">1 cup rice</li></ul>'),
+        # The first <title> may belong to an inline SVG
+        post_content_page(1, title='<svg><title>Icon</title></svg><title>Soup</title>'),
+        post_content_page(1, title='<title>Fish <i>and</i> chips</title>'),
+        # Only a commented-out script: the DOM has no recipe data at all
+        post_content_page(1).replace('<script', '<!-- <script').replace('</script>', '</script> -->'),
+    ])
+    def test_falls_back_to_dom(self, extractor, html):
+        """Test that pages the fast path cannot be sure about go through the DOM."""
+        assert extractor.extract_embedded(html, 'u') is None
+        assert extractor.extract(html, 'u') == extractor.extract_dom(html, 'u')
+
+    def test_rejects_non_utf8_bytes(self, extractor):
+        """Test that bytes in another encoding are left to the DOM path."""
+        html = post_content_page(1, title='<title>Crème</title>').encode('latin-1')
+        assert extractor.extract_embedded(html, 'u') is None
+
+    @pytest.mark.parametrize('tag, found', [
+        (b'<script id="__POST_CONTENT__">', True),
+        (b"<script type='application/json' ID='__POST_CONTENT__' async>", True),
+        (b'<script id=__POST_CONTENT__>', True),
+        (b'<script id="__POST_CONTENT__2">', False),
+        (b'<script data-id="__POST_CONTENT__">', False),
+        (b'<div id="__POST_CONTENT__">', False),
+    ])
+    def test_find_post_content(self, tag, found):
+        """Test that only a script whose id is exactly __POST_CONTENT__ is used."""
+        body = b'<script>document.getElementById("__POST_CONTENT__")</script>' + tag + b' {"a": 1} </script>'
+        assert find_post_content(body) == (b' {"a": 1} ' if found else None)
+
+    @pytest.mark.parametrize('comment', [
+        '<!-- <script id="__POST_CONTENT__">{"skillLevel": "Old"}</script> -->',
+        '<!--> <!---> <!-- a --><!-- <script id="__POST_CONTENT__"></script> -->',
+    ])
+    def test_skips_commented_out_scripts(self, extractor, comment):
+        """Test that a script inside a comment is not taken for the page's data."""
+        html = post_content_page(3, before=comment).encode('utf-8')
+        fast = extractor.extract_embedded(html, 'u')
+        assert fast is not None and fast['difficulty'] == 'Easy'
+        assert fast == extractor.extract_dom(html, 'u')
+
+    @pytest.mark.parametrize('charset', ['utf-8', 'iso-8859-1', None])
+    def test_spider_matches_dom_path(self, spider, charset):
+        """Test that the spider's item does not depend on which path was taken."""
+        url = 'https://example.com/recipes/r4'
+        html = post_content_page(4, title='<title>Crème</title>' if charset else '<title>Soup</title>')
+        headers = {'Content-Type': f'text/html; charset={charset}' if charset else 'text/html'}
+        response = HtmlResponse(url=url, body=html.encode(charset or 'ascii'), headers=headers,
+                                request=Request(url))
+        assert dict(spider.parse_recipe(response)) == Extractor().extract_dom(response.text, url)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,132 @@
+import json
+
+import pytest
+
+from webscraper.index import IndexBuilder, RecipeIndex, ingredient_tokens, main
+from webscraper.items import WebscraperItem
+from webscraper.pipelines import IndexPipeline
+
+
+def recipe(name, ingredients, total=None, diets=()):
+    return {
+        'url': f'https://example.com/recipes/{name}',
+        'ingredients': ingredients,
+        'time': {'total': total} if total is not None else {},
+        'dietary_labels': list(diets),
+    }
+
+
+RECIPES = [
+    recipe('lemon-chicken', ['500g chicken thighs', '2 lemons (juiced)'], 25),
+    recipe('roast-chicken', ['1 whole chicken', '1 lemon'], 90),
+    recipe('lemon-tart', ['3 lemons', '200 g butter'], 60, ['Vegetarian']),
+    recipe('chicken-salad', ['2 cups chicken', '1 tbsp olive oil'], 15, ['Gluten-free']),
+    recipe('pasta', ['400 g spaghetti'], None, ['Vegan', 'Vegetarian']),
+]
+
+
+class TestRecipeIndex:
+    """Test cases for the recipe index."""
+
+    def build(self, directory, items, segment_size=2):
+        builder = IndexBuilder(str(directory), segment_size=segment_size)
+        for item in items:
+            builder.add(item)
+        builder.close()
+        return RecipeIndex(str(directory))
+
+    def test_ingredient_tokens(self):
+        """Test that quantities, units and notes are dropped and plurals folded."""
+        assert ingredient_tokens('2 cups Lemons (zested)') == ['lemon']
+        assert ingredient_tokens('1 tbsp olive oil') == ['olive', 'oil']
+
+    def test_ingredient_intersection(self, tmp_path):
+        """Test that every queried ingredient must match."""
+        with self.build(tmp_path, RECIPES) as index:
+            assert sorted(index.search(['chicken', 'lemon'])) == [
+                'https://example.com/recipes/lemon-chicken',
+                'https://example.com/recipes/roast-chicken',
+            ]
+            assert index.search(['chicken', 'spaghetti']) == []
+
+    def test_time_range(self, tmp_path):
+        """Test range filters with and without ingredient terms."""
+        with self.build(tmp_path, RECIPES) as index:
+            assert index.search(['chicken', 'lemon'], max_time=30) == [
+                'https://example.com/recipes/lemon-chicken',
+            ]
+            assert sorted(index.search(min_time=20, max_time=60)) == [
+                'https://example.com/recipes/lemon-chicken',
+                'https://example.com/recipes/lemon-tart',
+            ]
+
+    def test_dietary_labels(self, tmp_path):
+        """Test that dietary labels are normalized and queryable."""
+        with self.build(tmp_path, RECIPES) as index:
+            assert sorted(index.search(diets=['vegetarian'])) == [
+                'https://example.com/recipes/lemon-tart',
+                'https://example.com/recipes/pasta',
+            ]
+            assert index.search(diets=['Gluten Free']) == [
+                'https://example.com/recipes/chicken-salad',
+            ]
+
+    def test_incremental_updates_supersede(self, tmp_path):
+        """Test that re-indexing a URL replaces its earlier version."""
+        self.build(tmp_path, RECIPES).close()
+        changed = recipe('lemon-chicken', ['500g chicken thighs', '1 lime'], 25)
+        with self.build(tmp_path, [changed, recipe('new', ['1 lemon'], 5)]) as index:
+            assert index.search(['lemon'], max_time=30) == ['https://example.com/recipes/new']
+            assert index.search(['lime']) == ['https://example.com/recipes/lemon-chicken']
+
+    def test_unflushed_tail_is_discarded(self, tmp_path):
+        """Test that a builder reopens cleanly after a crash before flushing."""
+        builder = IndexBuilder(str(tmp_path), segment_size=2)
+        for item in RECIPES[:3]:
+            builder.add(item)
+        # Simulate a crash: the third document is never flushed
+        with open(tmp_path / 'urls.txt', 'ab') as f:
+            f.write(b'https://example.com/torn')
+        builder = IndexBuilder(str(tmp_path), segment_size=2)
+        assert builder.next_doc == 2
+        builder.close()
+        assert (tmp_path / 'urls.txt').read_bytes().count(b'\n') == 2
+
+    def test_pipeline_and_cli(self, tmp_path, spider, capsys):
+        """Test that the pipeline indexes items and the CLI queries them."""
+        pipeline = IndexPipeline(str(tmp_path / 'index'))
+        pipeline.open_spider(spider)
+        for data in RECIPES:
+            item = WebscraperItem(**data)
+            assert pipeline.process_item(item, spider) is item
+        pipeline.close_spider(spider)
+
+        main(['query', str(tmp_path / 'index'), '-i', 'lemon', '--max-time', '60'])
+        assert capsys.readouterr().out.split() == [
+            'https://example.com/recipes/lemon-chicken',
+            'https://example.com/recipes/lemon-tart',
+        ]
+
+    def test_ingredient_without_words_is_an_error(self, tmp_path, capsys):
+        """Test that an ingredient made only of units or stopwords is not ignored."""
+        export = tmp_path / 'recipes.jl'
+        export.write_text(''.join(json.dumps(item) + '\n' for item in RECIPES))
+        main(['build', str(tmp_path / 'index'), str(export)])
+        with RecipeIndex(str(tmp_path / 'index')) as index:
+            with pytest.raises(ValueError, match='cups'):
+                index.search(['lemon', 'cups'])
+        with pytest.raises(SystemExit):
+            main(['query', str(tmp_path / 'index'), '-i', 'of'])
+        assert 'no searchable words' in capsys.readouterr().err
+
+    def test_cli_build_from_export(self, tmp_path, capsys):
+        """Test building the index from a JSON lines export."""
+        export = tmp_path / 'recipes.jl'
+        export.write_text(''.join(json.dumps(item) + '\n' for item in RECIPES))
+        main(['build', str(tmp_path / 'index'), str(export)])
+        main(['query', str(tmp_path / 'index'), '-i', 'butter'])
+        assert capsys.readouterr().out.split() == ['https://example.com/recipes/lemon-tart']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
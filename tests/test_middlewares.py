@@ -0,0 +1,334 @@
+import time
+
+import pytest
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured, StopDownload
+from scrapy.http import Headers, HtmlResponse, Request
+from scrapy.http.request import NO_CALLBACK
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import ConnectionRefusedError
+
+from webscraper.middlewares import DomainCircuitBreaker, WebscraperDownloaderMiddleware
+from webscraper.spiders.recipe_spider import RecipeSpider
+from tests.synthetic_site import run_crawl
+
+PDF = b'%PDF-1.4 ' + b'x' * 100000
+
+
+def parse(response):
+    pass
+
+
+def make_middleware(**settings):
+    crawler = get_crawler(RecipeSpider, dict({'EARLY_ABORT_ENABLED': True}, **settings))
+    return WebscraperDownloaderMiddleware.from_crawler(crawler), crawler.stats
+
+
+def fetch(mw, url, content_type, length=1000):
+    """Run ``url`` through the middleware as far as its headers; return the request."""
+    request = Request(url, callback=parse)
+    mw.process_request(request)
+    headers = Headers({'Content-Type': content_type})
+    try:
+        mw.headers_received(headers, length, request)
+    except StopDownload as e:
+        with pytest.raises(IgnoreRequest):
+            mw.process_exception(request, e)
+    else:
+        mw.process_response(request, HtmlResponse(url, headers=headers, body=b'<html></html>'))
+    return request
+
+
+class TestEarlyAbort:
+    """Test cases for early rejection in WebscraperDownloaderMiddleware."""
+
+    def test_disabled_by_default(self):
+        """Test that the middleware is not configured unless enabled."""
+        with pytest.raises(NotConfigured):
+            WebscraperDownloaderMiddleware.from_crawler(get_crawler(RecipeSpider))
+
+    def test_rejects_non_html_on_headers(self):
+        """Test that a non-HTML Content-Type stops the download."""
+        mw, stats = make_middleware()
+        request = fetch(mw, 'https://example.com/recipes/card.pdf', b'application/pdf', 250000)
+        assert request.meta['early_abort'] == 'content_type'
+        assert stats.get_value('early_abort/content_type') == 1
+        assert stats.get_value('early_abort/bytes_saved') == 250000
+
+    def test_keeps_html(self):
+        """Test that HTML and responses without a Content-Type are let through."""
+        mw, stats = make_middleware()
+        assert 'early_abort' not in fetch(mw, 'https://example.com/a', b'text/html; charset=utf-8').meta
+        assert 'early_abort' not in fetch(mw, 'https://example.com/b', b'').meta
+        assert stats.get_value('early_abort/bytes_saved') is None
+
+    def test_rejects_oversized_pages(self):
+        """Test that a Content-Length over the limit stops the download."""
+        mw, stats = make_middleware(EARLY_ABORT_MAXSIZE=10000)
+        assert fetch(mw, 'https://example.com/huge', b'text/html', 20000).meta['early_abort'] == 'too_large'
+        # Unknown lengths (chunked responses) are left to DOWNLOAD_MAXSIZE
+        assert 'early_abort' not in fetch(mw, 'https://example.com/chunked', b'text/html', -1).meta
+        assert stats.get_value('early_abort/too_large') == 1
+
+    def test_learns_non_html_paths(self):
+        """Test that an extension returning non-HTML repeatedly is skipped per domain."""
+        mw, stats = make_middleware(EARLY_ABORT_LEARN_THRESHOLD=2)
+        fetch(mw, 'https://example.com/uploads/a/one.pdf', b'application/pdf', 5000)
+        fetch(mw, 'https://example.com/uploads/b/two.PDF', b'application/pdf', 3000)
+        with pytest.raises(IgnoreRequest):
+            mw.process_request(Request('https://example.com/files/three.pdf', callback=parse))
+        # Other domains have to learn their own rules
+        assert mw.process_request(Request('https://other.example/files/three.pdf', callback=parse)) is None
+        assert stats.get_value('early_abort/rules') == 1
+        assert stats.get_value('early_abort/learned_skips') == 1
+        assert stats.get_value('early_abort/bytes_saved') == 5000 + 3000 + 4000
+
+    def test_html_prevents_and_undoes_rules(self):
+        """Test that a path that has returned HTML is never skipped."""
+        mw, stats = make_middleware(EARLY_ABORT_LEARN_THRESHOLD=2)
+        fetch(mw, 'https://example.com/pages/about', b'text/html')
+        fetch(mw, 'https://example.com/pages/feed.xml', b'application/rss+xml')
+        fetch(mw, 'https://example.com/pages/atom.xml', b'application/atom+xml')
+        assert mw.rules['example.com'] == {('ext', '.xml')}
+
+        # A page requested before the rule was learned turns out to be HTML
+        fetch(mw, 'https://example.com/blog/feed', b'application/rss+xml')
+        in_flight = Request('https://example.com/news/feed', callback=parse)
+        mw.process_request(in_flight)
+        fetch(mw, 'https://example.com/recipes/feed', b'application/rss+xml')
+        assert ('name', 'feed') in mw.rules['example.com']
+        mw.process_response(in_flight, HtmlResponse(in_flight.url, body=b'<html></html>'))
+        assert mw.process_request(Request('https://example.com/tips/feed', callback=parse)) is None
+
+    def test_directories_are_not_learned(self):
+        """Test that assets sharing a directory with recipes do not block it."""
+        mw, stats = make_middleware(EARLY_ABORT_LEARN_THRESHOLD=2)
+        fetch(mw, 'https://example.com/recipes/a.jpg', b'image/jpeg')
+        fetch(mw, 'https://example.com/recipes/b.png', b'image/png')
+        fetch(mw, 'https://example.com/recipes/c.pdf', b'application/pdf')
+        assert mw.process_request(Request('https://example.com/recipes/chicken-soup', callback=parse)) is None
+        assert stats.get_value('early_abort/rules') is None
+
+    def test_page_extensions_learn_file_names(self):
+        """Test that image.php returning images does not block recipe.php."""
+        mw, stats = make_middleware(EARLY_ABORT_LEARN_THRESHOLD=2)
+        for i in range(2):
+            fetch(mw, f'https://example.com/image.php?id={i}', b'image/jpeg')
+        assert mw.rules['example.com'] == {('name', 'image.php')}
+        assert mw.process_request(Request('https://example.com/recipe.php?id=7', callback=parse)) is None
+        with pytest.raises(IgnoreRequest):
+            mw.process_request(Request('https://example.com/image.php?id=9', callback=parse))
+
+    def test_requests_without_callback_are_exempt(self):
+        """Test that robots.txt and similar internal requests are never rejected."""
+        mw, stats = make_middleware()
+        request = Request('https://example.com/robots.txt', callback=NO_CALLBACK)
+        mw.process_request(request)
+        mw.headers_received(Headers({'Content-Type': 'text/plain'}), 100, request)
+        request = Request('https://example.com/data.json', callback=parse, meta={'dont_abort_early': True})
+        mw.headers_received(Headers({'Content-Type': 'application/json'}), 100, request)
+        assert stats.get_value('early_abort/content_type') is None
+
+    @pytest.mark.integration
+    def test_crawl_skips_assets(self, recipe_site, tmp_path):
+        """Test that a crawl aborts asset downloads and learns to stop requesting them."""
+        cards = [f'/recipes/cards/card-{i}.pdf' for i in range(30)]
+        for path in cards:
+            recipe_site.routes[path] = lambda path: (200, {'Content-Type': 'application/pdf'}, PDF)
+        recipe_site.routes['/recipes/huge'] = lambda path: recipe_site.html('Huge', [], 'x' * 300000)
+        index = recipe_site.page('/recipes')[2].decode()
+        recipe_site.routes['/recipes'] = lambda path: recipe_site.html(
+            'All recipes', cards + ['/recipes/huge'], index)
+
+        stats = run_crawl(recipe_site, tmp_path / 'stats.json', EARLY_ABORT_ENABLED=True,
+                          EARLY_ABORT_MAXSIZE=200000, CONCURRENT_REQUESTS_PER_DOMAIN=1)
+        assert stats['item_scraped_count'] == recipe_site.recipes
+        assert stats['early_abort/too_large'] == 1
+        # Up to CONCURRENT_REQUESTS were already queued in the downloader when the rule was learned
+        fetched = sum(recipe_site.hits[path] for path in cards)
+        assert fetched == stats['early_abort/content_type'] <= 3 + 8
+        assert stats['early_abort/learned_skips'] == len(cards) - fetched
+        assert stats['early_abort/bytes_saved'] >= len(cards) * len(PDF)
+        assert stats['early_abort/time_saved_ms'] > 0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(**settings):
+    defaults = {'CIRCUIT_BREAKER_ENABLED': True, 'CIRCUIT_BREAKER_THRESHOLD': 3,
+                'CIRCUIT_BREAKER_BACKOFF': 10}
+    crawler = get_crawler(RecipeSpider, dict(defaults, **settings))
+    mw = DomainCircuitBreaker.from_crawler(crawler)
+    mw.clock = FakeClock()
+    mw.scheduled = []
+    mw.schedule = mw.scheduled.append
+    return mw, crawler.stats
+
+
+def attempt(mw, url, status=200, retry_times=0, headers=None):
+    """Send ``url`` through the breaker; return False if it was parked or dropped."""
+    request = Request(url, callback=parse, meta={'retry_times': retry_times} if retry_times else {})
+    try:
+        mw.process_request(request)
+    except IgnoreRequest as e:
+        mw.process_exception(request, e)
+        return False
+    if status is None:
+        mw.process_exception(request, ConnectionRefusedError())
+    else:
+        mw.process_response(request, HtmlResponse(url, status=status, headers=headers, body=b''))
+    return True
+
+
+class TestCircuitBreaker:
+    """Test cases for the DomainCircuitBreaker downloader middleware."""
+
+    def test_disabled_unless_enabled(self):
+        """Test that the middleware is not configured unless enabled."""
+        with pytest.raises(NotConfigured):
+            DomainCircuitBreaker.from_crawler(get_crawler(RecipeSpider))
+
+    def test_opens_after_consecutive_failures(self):
+        """Test that consecutive failures open the breaker and park the domain's requests."""
+        mw, stats = make_breaker()
+        for status in (503, 503, 200, 503, None):
+            attempt(mw, 'https://flaky.example/a', status)
+        assert mw.domains['flaky.example'].state == 'closed'
+        attempt(mw, 'https://flaky.example/b', 500)
+        assert stats.get_value('circuit_breaker/state/flaky.example') == 'open'
+
+        assert not attempt(mw, 'https://flaky.example/c')
+        assert not attempt(mw, 'https://flaky.example/d')
+        # Other domains are unaffected
+        assert attempt(mw, 'https://ok.example/a')
+        assert stats.get_value('circuit_breaker/parked') == 2
+        assert stats.get_value('circuit_breaker/wasted_requests') == 5
+        assert stats.get_value('circuit_breaker/open_domains') == 1
+
+    def test_probe_closes_and_releases(self):
+        """Test that a successful probe closes the breaker and releases parked requests."""
+        mw, stats = make_breaker()
+        for _ in range(3):
+            attempt(mw, 'https://flaky.example/a', 503)
+        for path in 'bcd':
+            attempt(mw, f'https://flaky.example/{path}')
+        mw.clock.now += 9
+        mw.release_due()
+        assert mw.scheduled == []
+
+        mw.clock.now += 1
+        mw.release_due()
+        assert [r.url for r in mw.scheduled] == ['https://flaky.example/b']
+        probe = mw.scheduled[0]
+        assert probe.dont_filter and probe.meta['circuit_breaker_probe']
+        # Only the probe goes out while half-open
+        assert not attempt(mw, 'https://flaky.example/e')
+
+        mw.process_request(probe)
+        mw.process_response(probe, HtmlResponse(probe.url, body=b''))
+        assert stats.get_value('circuit_breaker/state/flaky.example') == 'closed'
+        assert [r.url for r in mw.scheduled[1:]] == [
+            'https://flaky.example/c', 'https://flaky.example/d', 'https://flaky.example/e']
+        assert stats.get_value('circuit_breaker/released') == 4
+
+    def test_backoff_grows_and_gives_up(self):
+        """Test that failed probes double the backoff until the domain is given up."""
+        mw, stats = make_breaker(CIRCUIT_BREAKER_MAX_TRIPS=3, CIRCUIT_BREAKER_MAX_BACKOFF=30)
+        for _ in range(3):
+            attempt(mw, 'https://down.example/a', None)
+        attempt(mw, 'https://down.example/parked')
+        domain = mw.domains['down.example']
+        backoffs = []
+        for trip in range(3):
+            backoffs.append(domain.open_until - mw.clock.now)
+            mw.clock.now = domain.open_until
+            mw.release_due()
+            probe = mw.scheduled[-1]
+            assert probe.meta['circuit_breaker_probe']
+            # Parked behind the probe
+            assert not attempt(mw, f'https://down.example/next-{trip}')
+            mw.process_request(probe)
+            mw.process_exception(probe, ConnectionRefusedError())
+        assert backoffs == [10, 20, 30]
+        assert domain.state == 'abandoned'
+        assert not attempt(mw, 'https://down.example/b')
+        # The request parked at the last trip and the one after
+        assert stats.get_value('circuit_breaker/dropped') == 2
+        assert stats.get_value('circuit_breaker/opened') == 3
+
+    def test_retry_after(self):
+        """Test that a Retry-After header can lengthen the backoff."""
+        mw, stats = make_breaker(CIRCUIT_BREAKER_THRESHOLD=1)
+        attempt(mw, 'https://limited.example/a', 429, headers={'Retry-After': '120'})
+        assert mw.domains['limited.example'].open_until - mw.clock.now == 120
+
+    def test_retry_budget(self):
+        """Test that retries beyond the domain's budget are dropped."""
+        mw, stats = make_breaker(CIRCUIT_BREAKER_THRESHOLD=100, CIRCUIT_BREAKER_RETRY_BURST=2,
+                                 CIRCUIT_BREAKER_RETRY_RATIO=0.5)
+        assert attempt(mw, 'https://flaky.example/a', 503, retry_times=1)
+        assert attempt(mw, 'https://flaky.example/a', 503, retry_times=2)
+        assert not attempt(mw, 'https://flaky.example/b', 503, retry_times=1)
+        # Two first attempts earn one retry
+        attempt(mw, 'https://flaky.example/c')
+        attempt(mw, 'https://flaky.example/d')
+        assert attempt(mw, 'https://flaky.example/b', 503, retry_times=1)
+        assert stats.get_value('circuit_breaker/retries_denied') == 1
+        assert stats.get_value('circuit_breaker/wasted_retries') == 3
+
+    def test_exempt_requests(self):
+        """Test that robots.txt and opted-out requests neither count nor get parked."""
+        mw, stats = make_breaker(CIRCUIT_BREAKER_THRESHOLD=1)
+        robots = Request('https://site.example/robots.txt', callback=NO_CALLBACK)
+        mw.process_response(robots, HtmlResponse(robots.url, status=503, body=b''))
+        assert 'site.example' not in mw.domains
+        attempt(mw, 'https://site.example/a', 503)
+        request = Request('https://site.example/b', callback=parse, meta={'dont_break_circuit': True})
+        assert mw.process_request(request) is None
+
+    def test_idle_spider_waits_for_parked_requests(self):
+        """Test that the spider is kept open while requests are parked."""
+        mw, stats = make_breaker(CIRCUIT_BREAKER_THRESHOLD=1)
+        mw.spider_idle(None)
+        attempt(mw, 'https://flaky.example/a', 503)
+        attempt(mw, 'https://flaky.example/b')
+        with pytest.raises(DontCloseSpider):
+            mw.spider_idle(None)
+
+    @pytest.mark.integration
+    def test_crawl_rides_out_an_outage(self, recipe_site, tmp_path):
+        """Test that a crawl parks requests during an outage and loses no recipes."""
+        paths = [f'/recipes/recipe-{i}' for i in range(recipe_site.recipes)]
+        pages = {path: recipe_site.page(path) for path in paths}
+        outage = {}
+
+        def flaky(path):
+            # Recipe pages fail for two seconds from the first request on
+            start = outage.setdefault('start', time.monotonic())
+            if time.monotonic() - start < 2.0:
+                return 503, {'Content-Type': 'text/html'}, b'unavailable'
+            return pages[path]
+
+        for path in paths:
+            recipe_site.routes[path] = flaky
+
+        # How many retries the outage costs depends on timing; the budget is tested on its own
+        stats = run_crawl(recipe_site, tmp_path / 'stats.json', CIRCUIT_BREAKER_ENABLED=True,
+                          CIRCUIT_BREAKER_THRESHOLD=3, CIRCUIT_BREAKER_BACKOFF=0.5,
+                          CIRCUIT_BREAKER_RETRY_BURST=100)
+        assert stats['item_scraped_count'] == recipe_site.recipes
+        assert stats['circuit_breaker/opened'] >= 1
+        assert stats['circuit_breaker/parked'] > 0
+        assert stats['circuit_breaker/state/127.0.0.1'] == 'closed'
+        # Requests already in flight when the breaker opened, plus one probe per trip
+        failed = sum(recipe_site.hits[path] for path in paths) - recipe_site.recipes
+        assert failed == stats['circuit_breaker/wasted_requests'] <= 3 + 8 + stats['circuit_breaker/opened']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,243 @@
+import glob
+import json
+import os
+import queue
+import sqlite3
+import threading
+
+import pytest
+from scrapy.exceptions import DropItem
+from scrapy.utils.test import get_crawler
+
+from webscraper.items import WebscraperItem
+from webscraper.pipelines import ChangeFeedPipeline, DatabasePipeline
+from webscraper.spiders.recipe_spider import RecipeSpider
+
+
+def make_item(url, title='Test Recipe'):
+    return WebscraperItem(url=url, title=title, ingredients=['1 cup flour'],
+                          time={'prep': 5, 'cook': 10, 'total': 15})
+
+
+class TestDatabasePipeline:
+    """Test cases for DatabasePipeline."""
+
+    def make_pipeline(self, path, **kwargs):
+        return DatabasePipeline(lambda: sqlite3.connect(path), **kwargs)
+
+    def test_not_configured_without_database(self):
+        """Test that the pipeline is disabled when no database is set."""
+        from scrapy.exceptions import NotConfigured
+        with pytest.raises(NotConfigured):
+            DatabasePipeline.from_crawler(get_crawler(RecipeSpider))
+
+    def test_items_are_upserted(self, tmp_path, spider):
+        """Test that items are written and later versions replace earlier ones."""
+        path = str(tmp_path / 'recipes.db')
+        pipeline = self.make_pipeline(path, batch_size=3)
+        pipeline.open_spider(spider)
+        for i in range(10):
+            item = make_item(f'https://example.com/recipes/r{i}')
+            assert pipeline.process_item(item, spider) is item
+        pipeline.process_item(make_item('https://example.com/recipes/r0', 'Updated'), spider)
+        pipeline.close_spider(spider)
+
+        conn = sqlite3.connect(path)
+        rows = conn.execute('SELECT url, title, time FROM recipes ORDER BY url').fetchall()
+        assert len(rows) == 10
+        assert rows[0][:2] == ('https://example.com/recipes/r0', 'Updated')
+        assert json.loads(rows[0][2]) == {'prep': 5, 'cook': 10, 'total': 15}
+
+    def test_from_crawler_uses_sqlite_path(self, tmp_path):
+        """Test that DATABASE_PATH configures a SQLite target."""
+        path = str(tmp_path / 'recipes.db')
+        crawler = get_crawler(RecipeSpider, {'DATABASE_PATH': path, 'DATABASE_TABLE': 'items'})
+        pipeline = DatabasePipeline.from_crawler(crawler)
+        pipeline.open_spider(None)
+        pipeline.close_spider(None)
+        tables = sqlite3.connect(path).execute("SELECT name FROM sqlite_master").fetchall()
+        assert ('items',) in tables
+
+    def test_upsert_sql_paramstyle(self):
+        """Test that the placeholder follows the driver's paramstyle."""
+        pipeline = DatabasePipeline(None, paramstyle='format')
+        assert '%s' in pipeline.upsert_sql()
+        assert '?' not in pipeline.upsert_sql()
+        assert '%(title)s' in DatabasePipeline(None, paramstyle='pyformat').upsert_sql()
+        with pytest.raises(ValueError, match='DATABASE_PARAMSTYLE'):
+            DatabasePipeline(None, paramstyle='dollar')
+
+    @pytest.mark.parametrize('paramstyle', ['numeric', 'named'])
+    def test_numeric_and_named_paramstyles(self, tmp_path, spider, paramstyle):
+        """Test that rows are bound by position or by name as the paramstyle needs."""
+        path = str(tmp_path / 'recipes.db')
+        pipeline = self.make_pipeline(path, paramstyle=paramstyle)
+        pipeline.open_spider(spider)
+        pipeline.process_item(make_item('https://example.com/recipes/r0'), spider)
+        pipeline.close_spider(spider)
+        assert pipeline.error is None
+        row = sqlite3.connect(path).execute('SELECT url, title FROM recipes').fetchone()
+        assert row == ('https://example.com/recipes/r0', 'Test Recipe')
+
+    def test_backpressure_keeps_rows_in_order(self, tmp_path, spider):
+        """Test that items wait for a slow database without threads, in arrival order."""
+        path = str(tmp_path / 'recipes.db')
+        slow = threading.Event()
+
+        def connect():
+            slow.wait(10)
+            return sqlite3.connect(path)
+
+        pipeline = DatabasePipeline(connect, batch_size=1, queue_size=1,
+                                    stats=get_crawler(RecipeSpider).stats)
+        pipeline.open_spider(spider)
+        calls = queue.Queue()
+        pipeline.call_in_reactor = calls.put
+
+        url = 'https://example.com/recipes/r0'
+        pipeline.process_item(make_item(url, 'First'), spider)
+        waiting = [pipeline.process_item(make_item(url, title), spider)
+                   for title in ('Second', 'Third')]
+        fired = []
+        for d in waiting:
+            d.addCallback(lambda item: fired.append(item['title']))
+        assert fired == [] and len(pipeline.waiting) == 2
+        assert pipeline.stats.get_value('database/backpressure') == 2
+
+        # Run the writer's reactor calls here until every row is queued
+        slow.set()
+        while pipeline.waiting:
+            calls.get(timeout=10)()
+        assert fired == ['Second', 'Third']
+        pipeline.close_spider(spider)
+        rows = sqlite3.connect(path).execute('SELECT title FROM recipes').fetchall()
+        assert rows == [('Third',)]
+
+
+def read_feed(directory, pattern):
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    with open(paths[-1], encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+class TestChangeFeedPipeline:
+    """Test cases for ChangeFeedPipeline."""
+
+    def crawl(self, directory, spider, items, reason='finished', **kwargs):
+        """Run one crawl over ``items``; return its change records and tombstones."""
+        for name in glob.glob(os.path.join(directory, '*-*')):
+            os.remove(name)
+        pipeline = ChangeFeedPipeline(directory, **kwargs)
+        pipeline.open_spider(spider)
+        for item in items:
+            try:
+                pipeline.process_item(item, spider)
+            except DropItem:
+                pass
+        pipeline.spider_closed(spider, reason)
+        changes = [json.loads(line) for line in read_feed(directory, 'changes-*.jl')]
+        tombstones = glob.glob(os.path.join(directory, 'tombstones-*.txt'))
+        return changes, read_feed(directory, 'tombstones-*.txt') if tombstones else None
+
+    def test_not_configured_without_directory(self):
+        """Test that the pipeline is disabled unless CHANGEFEED_DIR is set."""
+        from scrapy.exceptions import NotConfigured
+        with pytest.raises(NotConfigured):
+            ChangeFeedPipeline.from_crawler(get_crawler(RecipeSpider))
+
+    def test_change_stream(self, tmp_path, spider):
+        """Test that a recrawl emits only added, changed and removed records."""
+        directory = str(tmp_path / 'feed')
+        first = [make_item(f'https://example.com/recipes/r{i}') for i in range(5)]
+        changes, tombstones = self.crawl(directory, spider, first)
+        assert [c['op'] for c in changes] == ['added'] * 5
+        assert changes[0]['item']['ingredients'] == ['1 cup flour']
+        assert tombstones == []
+
+        second = [make_item(f'https://example.com/recipes/r{i}') for i in range(1, 6)]
+        second[0]['title'] = 'Renamed'
+        changes, tombstones = self.crawl(directory, spider, second)
+        assert changes == [
+            {'op': 'changed', 'url': 'https://example.com/recipes/r1', 'changes': {'title': 'Renamed'}},
+            {'op': 'added', 'url': 'https://example.com/recipes/r5', 'item': dict(second[-1])},
+            {'op': 'removed', 'url': 'https://example.com/recipes/r0'},
+        ]
+        assert tombstones == ['https://example.com/recipes/r0']
+
+    def test_drop_unchanged(self, tmp_path, spider):
+        """Test that unchanged items can be dropped from the rest of the export."""
+        directory = str(tmp_path / 'feed')
+        self.crawl(directory, spider, [make_item('https://example.com/recipes/r0')])
+        pipeline = ChangeFeedPipeline(directory, drop_unchanged=True)
+        pipeline.open_spider(spider)
+        with pytest.raises(DropItem):
+            pipeline.process_item(make_item('https://example.com/recipes/r0'), spider)
+        pipeline.spider_closed(spider, 'finished')
+
+    def test_interrupted_crawl_reports_no_removals(self, tmp_path, spider):
+        """Test that a partial crawl and its resumption do not remove unseen URLs."""
+        directory = str(tmp_path / 'feed')
+        items = [make_item(f'https://example.com/recipes/r{i}') for i in range(4)]
+        self.crawl(directory, spider, items)
+
+        items[0]['title'] = 'Renamed'
+        changes, tombstones = self.crawl(directory, spider, items[:2], reason='shutdown')
+        assert [c['op'] for c in changes] == ['changed']
+        assert tombstones is None
+
+        # The resumed crawl scrapes the rest; r0 and r1 still count as seen
+        changes, tombstones = self.crawl(directory, spider, items[2:3])
+        assert changes == [{'op': 'removed', 'url': 'https://example.com/recipes/r3'}]
+        assert tombstones == ['https://example.com/recipes/r3']
+
+    def test_removals_are_scoped_to_crawled_hosts(self, tmp_path, spider):
+        """Test that crawls of different sites sharing a directory keep their URLs."""
+        directory = str(tmp_path / 'feed')
+        site = [make_item(f'https://example.com/recipes/r{i}') for i in range(3)]
+        other = [make_item(f'https://other.example/recipes/r{i}') for i in range(2)]
+        self.crawl(directory, spider, site)
+        changes, tombstones = self.crawl(directory, spider, other)
+        assert [c['op'] for c in changes] == ['added'] * 2
+        assert tombstones == []
+
+        # An interrupted crawl of one site survives a finished crawl of another
+        self.crawl(directory, spider, site[:1], reason='shutdown')
+        assert self.crawl(directory, spider, other)[1] == []
+        changes, tombstones = self.crawl(directory, spider, site[1:2])
+        assert tombstones == ['https://example.com/recipes/r2']
+
+    def test_commits_on_checkpoint_snapshot(self, tmp_path, spider):
+        """Test that digests are committed before the checkpoint marks pages done."""
+        from webscraper.checkpoint import checkpoint_snapshot
+        directory = str(tmp_path / 'feed')
+        crawler = get_crawler(RecipeSpider, {'CHANGEFEED_DIR': directory})
+        pipeline = ChangeFeedPipeline.from_crawler(crawler)
+        pipeline.open_spider(spider)
+        pipeline.process_item(make_item('https://example.com/recipes/r0'), spider)
+
+        def stored():
+            db = sqlite3.connect(os.path.join(directory, 'state.db'))
+            try:
+                return db.execute('SELECT url FROM digests').fetchall()
+            finally:
+                db.close()
+
+        assert stored() == []
+        crawler.signals.send_catch_log(checkpoint_snapshot)
+        assert stored() == [('https://example.com/recipes/r0',)]
+        pipeline.spider_closed(spider, 'finished')
+
+    def test_crash_publishes_partial_changes(self, tmp_path, spider):
+        """Test that changes committed before a crash are published on restart."""
+        directory = str(tmp_path / 'feed')
+        pipeline = ChangeFeedPipeline(directory, commit_every=2)
+        pipeline.open_spider(spider)
+        for i in range(3):
+            pipeline.process_item(make_item(f'https://example.com/recipes/r{i}'), spider)
+        # No spider_closed: the process died
+        pipeline.changes.flush()
+        pipeline.db.close()
+        ChangeFeedPipeline(directory).open_spider(spider)
+        with open(pipeline.paths['changes'], encoding='utf-8') as f:
+            assert len(f.read().splitlines()) == 3
+        assert not os.path.exists(pipeline.paths['changes'] + '.part')
@@ -0,0 +1,168 @@
+import json
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from webscraper import report  # noqa: E402
+from webscraper.report import (  # noqa: E402
+    RecipeColumns, build_report, grouped_stats, main, parse_nutrition, parse_ratings,
+)
+
+
+def recipe(i):
+    return {
+        'url': f'https://{"www." if i % 2 else ""}site{i % 3}.com/recipes/r{i}',
+        'time': {'prep': 10, 'cook': i, 'total': 10 + i} if i % 5 else {},
+        'ratings': f'{i % 5 + 0.5}/5 ({i} ratings)',
+        'fitness_relevance': f'kcal: {100 + i}, protein: 5g' + (', Fibre: 2g' if i >= 7 else ''),
+        'dietary_labels': ['Vegan', 'Vegan'] if i % 3 == 0 else [],
+        'difficulty': 'Easy' if i % 2 else 'Hard',
+    }
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / 'recipes.jl'
+    path.write_text(''.join(json.dumps(recipe(i)) + '\n' for i in range(12)))
+    return str(path)
+
+
+class TestParsing:
+    """Test cases for reading the string fields of exported items."""
+
+    @pytest.mark.parametrize('text, expected', [
+        ('4.5/5 (12 ratings)', (4.5, 12)),
+        ('4.8 stars from 1,204 reviews', (4.8, 1204)),
+        ('4 out of 5', (4, None)),
+        ('57 votes', (None, 57)),
+        ('', (None, None)),
+        (None, (None, None)),
+    ])
+    def test_parse_ratings(self, text, expected):
+        """Test that the average and count are found in the ratings formats seen."""
+        result = [None if math.isnan(value) else value for value in parse_ratings(text)]
+        assert result == list(expected)
+
+    def test_parse_nutrition(self):
+        """Test that labelled numbers are read from fitness_relevance."""
+        assert parse_nutrition('kcal: 320, Protein: 12.5g, saturated fat: 2g') == {
+            'kcal': 320, 'protein': 12.5, 'saturated fat': 2}
+        assert parse_nutrition('High in protein') == {}
+
+
+class TestRecipeColumns:
+    """Test cases for the columnar view of an export."""
+
+    def test_columns(self, export):
+        """Test that every field lands in its column, with NaN for missing values."""
+        columns = RecipeColumns.load([export])
+        assert columns.rows == 12
+        assert np.isnan(columns.numeric['total'][0]) and columns.numeric['total'][3] == 13
+        assert columns.numeric['rating'][3] == 3.5
+        assert np.isnan(columns.numeric['nutrient:fibre'][6]) and columns.numeric['nutrient:fibre'][7] == 2
+        assert columns.categories['domain'] == ['site0.com', 'site1.com', 'site2.com']
+        # Duplicate labels on one recipe count once
+        assert columns.label_counts().tolist() == [[4]]
+
+    def test_chunks_give_the_same_columns(self, export):
+        """Test that chunk boundaries (and nutrients first seen late) do not change the result."""
+        whole = RecipeColumns.load([export])
+        chunked = RecipeColumns.load([export], chunk_size=5)
+        assert list(chunked.numeric) == list(whole.numeric)
+        for name, values in whole.numeric.items():
+            np.testing.assert_array_equal(chunked.numeric[name], values)
+
+    def test_cache_is_memory_mapped_and_invalidated(self, export, tmp_path):
+        """Test that cached columns are reused until the export changes."""
+        cache = str(tmp_path / 'cache')
+        RecipeColumns.load([export], cache_dir=cache)
+        cached = RecipeColumns.load([export], cache_dir=cache)
+        assert isinstance(cached.numeric['prep'], np.memmap)
+        assert cached.rows == 12
+
+        with open(export, 'a') as f:
+            f.write(json.dumps(recipe(12)) + '\n')
+        assert RecipeColumns.load([export], cache_dir=cache).rows == 13
+
+    def test_json_array_export(self, tmp_path):
+        """Test that exports written as a JSON array are read too."""
+        path = tmp_path / 'recipes.json'
+        path.write_text(json.dumps([recipe(i) for i in range(4)]))
+        assert RecipeColumns.load([str(path)]).rows == 4
+
+
+class TestAggregates:
+    """Test cases for the vectorized aggregates."""
+
+    def test_grouped_stats_match_numpy(self):
+        """Test that grouped statistics match per-group numpy results."""
+        rng = np.random.default_rng(0)
+        values = rng.normal(50, 20, 5000).astype(np.float32)
+        values[rng.random(5000) < 0.1] = np.nan
+        codes = rng.integers(0, 6, 5000).astype(np.int32)
+        codes[codes == 4] = 5  # group 4 stays empty
+        stats = grouped_stats(values, codes, 7)
+        for group in range(7):
+            selected = values[codes == group].astype(np.float64)
+            selected = selected[~np.isnan(selected)]
+            assert stats['count'][group] == len(selected)
+            if not len(selected):
+                assert all(np.isnan(stats[key][group]) for key in ('mean', 'min', 'max', 'p50', 'p90'))
+                continue
+            assert stats['mean'][group] == pytest.approx(selected.mean())
+            assert stats['min'][group] == selected.min() and stats['max'][group] == selected.max()
+            assert stats['p50'][group] == pytest.approx(np.percentile(selected, 50))
+            assert stats['p90'][group] == pytest.approx(np.percentile(selected, 90))
+
+    def test_histogram(self, export):
+        """Test that histogram bins are half-open with a final overflow bin."""
+        columns = RecipeColumns.load([export])
+        edges, counts = columns.histogram('cook', [0, 5, 10], group='difficulty')
+        # Cook times 1-4, 6-9 and 11 (multiples of 5 have no time)
+        assert counts.sum(axis=0).tolist() == [4, 4, 1]
+        assert counts.shape == (2, 3)
+
+    def test_build_report(self, export):
+        """Test the grouped report data."""
+        data = build_report(RecipeColumns.load([export]), group='domain')
+        assert [g['recipes'] for g in data['groups']] == [4, 4, 4]
+        assert data['columns']['nutrient:kcal'][0]['mean'] == 104.5
+        assert data['dietary_labels'] == {'Vegan': {'recipes': 4, 'share': [1.0, 0.0, 0.0]}}
+
+
+class TestReportCli:
+    """Test cases for the report command."""
+
+    def test_text_and_json(self, export, capsys):
+        """Test that the report is printed as tables or JSON."""
+        assert main([export, '--by', 'difficulty']) == 0
+        text = capsys.readouterr().out
+        assert text.startswith('12 recipes')
+        assert 'difficulty' in text and 'Vegan' in text
+
+        assert main([export, '--all', '--json']) == 0
+        data = json.loads(capsys.readouterr().out)
+        assert data['groups'] == [{'name': 'all', 'recipes': 12}]
+
+    def test_empty_export(self, tmp_path, capsys):
+        """Test that an export without recipes gives an empty report."""
+        path = tmp_path / 'empty.jl'
+        path.write_text('\n\n')
+        assert main([str(path)]) == 0
+        assert capsys.readouterr().out == 'no recipes\n'
+        assert main([str(path), '--json']) == 0
+        assert json.loads(capsys.readouterr().out)['recipes'] == 0
+
+    def test_requires_numpy(self, export, monkeypatch, capsys):
+        """Test that a missing NumPy is reported clearly."""
+        monkeypatch.setattr(report, 'np', None)
+        assert main([export]) == 2
+        assert 'pip install numpy' in capsys.readouterr().err
+        with pytest.raises(ImportError, match='NumPy'):
+            RecipeColumns.load([export])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,5 +1,5 @@
 import pytest
-from scrapy.http import Request, Response
+from scrapy.http import HtmlResponse, Request
 from webscraper.spiders.recipe_spider import RecipeSpider
 
 
@@ -19,7 +19,20 @@ class TestRecipeSpider:
         spider = RecipeSpider(domain=domain)
         assert spider.allowed_domains == [domain]
         assert spider.start_urls == [f'https://{domain}/recipes']
-        
+
+    def test_fixed_pages(self):
+        """Test that start_urls are kept and follow_links=0 stops link following."""
+        urls = ['https://example.com/recipes/soup', 'https://example.com/recipes/stew']
+        spider = RecipeSpider(domain='example.com', start_urls=urls, follow_links='0')
+        assert spider.start_urls == urls
+
+        body = b'<html><body><a href="/recipes/cake">cake</a></body></html>'
+        response = HtmlResponse(url='https://example.com/recipes/category/mains', body=body)
+        assert list(spider.parse(response)) == []
+        spider = RecipeSpider(domain='example.com')
+        requests = [r for r in spider.parse(response) if isinstance(r, Request)]
+        assert [r.url for r in requests] == ['https://example.com/recipes/cake']
+
     def test_is_valid_recipe_url(self):
         """Test URL validation for recipe pages."""
         spider = RecipeSpider()
@@ -0,0 +1,91 @@
+# Define here the add-ons for your project
+#
+# Don't forget to add your add-on to the ADDONS setting
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/addons.html
+
+import importlib.util
+import logging
+
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+POOLED_HANDLER = 'webscraper.handlers.PooledHTTP11DownloadHandler'
+H2_HANDLER = 'scrapy.core.downloader.handlers.http2.H2DownloadHandler'
+
+# Content-Encoding name -> module that decodes it
+ENCODINGS = {
+    'zstd': ('backports.zstd', 'compression.zstd'),
+    'br': ('brotli', 'brotlicffi'),
+}
+
+
+def available_encodings():
+    """Return the response encodings Scrapy can decode in this environment."""
+    found = []
+    for encoding, modules in ENCODINGS.items():
+        if any(_importable(module) for module in modules):
+            found.append(encoding)
+    return found + ['gzip', 'deflate']
+
+
+def _importable(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        return False
+
+
+class TransferProfile:
+    """Download profile tuned for many small pages from a few hosts.
+
+    ``TRANSFER_PROFILE`` selects it:
+
+    - ``'keepalive'``: HTTP/1.1 with a keep-alive pool sized per domain
+      (see ``webscraper.handlers.PooledHTTP11DownloadHandler``).
+    - ``'h2'``: as above, plus HTTPS over HTTP/2, so all requests to a
+      host are multiplexed over one connection. Needs the ``h2`` package;
+      without it the profile falls back to ``'keepalive'``.
+
+    Both profiles enable response decompression, so Accept-Encoding
+    advertises every encoding available (zstd and brotli when installed,
+    gzip and deflate always). ``TRANSFER_DOMAIN_CONCURRENCY`` maps
+    hostnames to their concurrency; it is merged into ``DOWNLOAD_SLOTS``
+    and also sizes the connection pool for those hosts.
+
+    Settings are applied at add-on priority, so anything set explicitly in
+    the project or on the command line still wins.
+    """
+
+    PROFILES = ('keepalive', 'h2')
+
+    def update_settings(self, settings):
+        profile = settings.get('TRANSFER_PROFILE')
+        if not profile:
+            raise NotConfigured
+        if profile not in self.PROFILES:
+            raise NotConfigured(f'unknown TRANSFER_PROFILE {profile!r}, expected one of {self.PROFILES}')
+
+        https_handler = POOLED_HANDLER
+        if profile == 'h2':
+            if _importable('h2'):
+                https_handler = H2_HANDLER
+            else:
+                logger.warning("TRANSFER_PROFILE 'h2' needs the h2 package (pip install h2), "
+                               "using HTTP/1.1 keep-alive instead")
+        handlers = settings['DOWNLOAD_HANDLERS']
+        handlers.set('http', POOLED_HANDLER, 'addon')
+        handlers.set('https', https_handler, 'addon')
+
+        settings.set('COMPRESSION_ENABLED', True, 'addon')
+
+        slots = settings['DOWNLOAD_SLOTS']
+        for host, concurrency in settings.getdict('TRANSFER_DOMAIN_CONCURRENCY').items():
+            # Explicit DOWNLOAD_SLOTS entries keep their priority and their concurrency
+            slot = dict(slots.get(host) or {})
+            slot.setdefault('concurrency', int(concurrency))
+            slots.set(host, slot, slots.getpriority(host) or 'addon')
+
+        logger.info('Transfer profile %r: https via %s, decoding %s', profile,
+                    https_handler.rsplit('.', 1)[-1], ', '.join(available_encodings()))
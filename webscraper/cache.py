@@ -0,0 +1,146 @@
+"""
+Extraction result cache keyed on page content.
+
+Mirrors, tracking-parameter variants and pages unchanged since the last
+crawl all serve the same body. The cache keys extraction results on a
+hash of the body with volatile parts (scripts other than the embedded
+recipe JSON, comments, iframes, whitespace between tags) stripped, plus
+``EXTRACTOR_VERSION``, so a hit skips HTML parsing entirely. Entries are
+kept in an in-memory LRU, optionally backed by a SQLite file that
+survives across crawls.
+
+Like ``webscraper.extract`` this module does not import Scrapy.
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+
+from webscraper.extract import EXTRACTOR_VERSION
+
+# Scripts are volatile (analytics, ads, nonces) except those carrying data
+VOLATILE_RE = re.compile(
+    rb'<script(?![^>]*(?:__POST_CONTENT__|application/ld\+json))[^>]*>.*?</script\s*>'
+    rb'|<!--.*?-->'
+    rb'|<iframe\b.*?</iframe\s*>'
+    rb'|<noscript\b.*?</noscript\s*>',
+    re.IGNORECASE | re.DOTALL,
+)
+# The scripts VOLATILE_RE keeps, split out so their content stays verbatim
+DATA_SCRIPT_RE = re.compile(
+    rb'(<script[^>]*(?:__POST_CONTENT__|application/ld\+json)[^>]*>.*?</script\s*>)',
+    re.IGNORECASE | re.DOTALL,
+)
+# Only whitespace between tags: runs inside text or embedded JSON are kept,
+# as pages differing there may extract differently
+BETWEEN_TAGS_RE = re.compile(rb'>\s+<')
+
+
+def content_key(body, version=EXTRACTOR_VERSION):
+    """Return the cache key of ``body`` (bytes) for extractor ``version``."""
+    parts = DATA_SCRIPT_RE.split(VOLATILE_RE.sub(b'', body).strip())
+    # Odd parts are the data scripts, where "</p> <p>" is part of the data
+    normalized = b''.join(part if i % 2 else BETWEEN_TAGS_RE.sub(b'><', part)
+                          for i, part in enumerate(parts))
+    digest = hashlib.blake2b(normalized, digest_size=16, person=b'extract-v%d' % version)
+    return digest.digest()
+
+
+class ExtractionCache:
+    """LRU cache of extraction results with an optional on-disk tier.
+
+    Cached results omit the ``url`` field, which callers fill in from the
+    page actually fetched. ``stats`` may be any object with Scrapy's
+    ``inc_value``/``set_value`` interface.
+    """
+
+    def __init__(self, max_entries=10000, path=None, stats=None, commit_every=100):
+        self.max_entries = max_entries
+        self.stats = stats
+        self.commit_every = commit_every
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+        self.time_saved = 0.0
+        self._extract_time = 0.0
+        self._uncommitted = 0
+        self.db = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=OFF')
+            self.db.execute('CREATE TABLE IF NOT EXISTS extractions (key BLOB PRIMARY KEY, value TEXT)')
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            return value
+        if self.db is not None:
+            row = self.db.execute('SELECT value FROM extractions WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                self._remember(key, value)
+                self._inc_stat('extraction_cache/disk_hits')
+                return value
+        return None
+
+    def put(self, key, value):
+        # Deep copies: callers may mutate the lists and dicts of their item
+        value = copy.deepcopy({name: field for name, field in value.items() if name != 'url'})
+        self._remember(key, value)
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO extractions VALUES (?, ?)',
+                            (key, json.dumps(value, ensure_ascii=False)))
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self.db.commit()
+                self._uncommitted = 0
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def extract(self, body, url, extract):
+        """Return the result for ``body`` from the cache or from ``extract(body, url)``."""
+        key = content_key(body)
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            # Each hit saves about one average extraction
+            self.time_saved += self._extract_time / max(self.misses, 1)
+            self._inc_stat('extraction_cache/hits')
+            self._update_rates()
+            return dict(copy.deepcopy(cached), url=url)
+
+        start = time.perf_counter()
+        result = extract(body, url)
+        self._extract_time += time.perf_counter() - start
+        self.misses += 1
+        self.put(key, result)
+        self._inc_stat('extraction_cache/misses')
+        self._update_rates()
+        return result
+
+    def _update_rates(self):
+        if self.stats is not None:
+            self.stats.set_value('extraction_cache/hit_rate',
+                                 round(self.hits / (self.hits + self.misses), 4))
+            self.stats.set_value('extraction_cache/time_saved_ms', round(self.time_saved * 1000, 1))
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
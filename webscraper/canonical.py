@@ -0,0 +1,229 @@
+# URL canonicalization before scheduling
+#
+# Enable by setting CANONICAL_ENABLED (see settings.py). Two forms of every
+# link are computed:
+#
+#   canonical_url()  - the URL actually fetched: tracking parameters and the
+#                      fragment removed, host lowercased, default port
+#                      dropped. Nothing that could send the request to a
+#                      different resource (or through a redirect) is changed.
+#   dedupe_key()     - the 64-bit key links are compared on: additionally
+#                      ignores a leading "www.", a trailing slash and the
+#                      order of query parameters.
+#
+# Pages declaring <link rel="canonical"> teach an alias: the fetched URL
+# (and later links to it) map to the declared URL, so once either has been
+# fetched the other never is.
+
+import fnmatch
+from urllib.parse import parse_qsl, unquote_plus, urlencode, urljoin, urlsplit, urlunsplit
+
+import scrapy
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from scrapy.http import TextResponse
+from w3lib.url import canonicalize_url
+
+from webscraper.checkpoint import url_key
+
+# Click and campaign tracking parameters that never change the page
+DEFAULT_QUERY_DENY = [
+    'utm_*', 'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'yclid', 'igshid', 'ref', 'ref_src',
+]
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class UrlRules:
+    """Canonicalization rules for one crawl.
+
+    ``query_allow`` (if given) lists the only query parameters kept;
+    otherwise parameters matching a ``query_deny`` pattern (fnmatch style,
+    case-insensitive) are dropped.
+    """
+
+    def __init__(self, query_allow=None, query_deny=None, keep_fragment=False,
+                 ignore_www=True, ignore_trailing_slash=True):
+        self.query_allow = {name.lower() for name in query_allow} if query_allow else None
+        self.query_deny = [pattern.lower() for pattern in
+                           (DEFAULT_QUERY_DENY if query_deny is None else query_deny)]
+        self.keep_fragment = keep_fragment
+        self.ignore_www = ignore_www
+        self.ignore_trailing_slash = ignore_trailing_slash
+
+    @classmethod
+    def from_settings(cls, settings):
+        deny = settings.getlist('CANONICAL_QUERY_DENY') if 'CANONICAL_QUERY_DENY' in settings else None
+        return cls(
+            query_allow=settings.getlist('CANONICAL_QUERY_ALLOW') or None,
+            query_deny=deny,
+            keep_fragment=settings.getbool('CANONICAL_KEEP_FRAGMENT'),
+            ignore_www=settings.getbool('CANONICAL_IGNORE_WWW', True),
+            ignore_trailing_slash=settings.getbool('CANONICAL_IGNORE_TRAILING_SLASH', True),
+        )
+
+    def keep_param(self, name):
+        name = name.lower()
+        if self.query_allow is not None:
+            return name in self.query_allow
+        return not any(fnmatch.fnmatchcase(name, pattern) for pattern in self.query_deny)
+
+    def canonical_url(self, url):
+        """Return ``url`` with tracking parameters, fragment and host noise removed."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        netloc = (parts.hostname or '').lower()
+        if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+            netloc = f'{netloc}:{parts.port}'
+        if parts.username:
+            netloc = f'{parts.username}{":" + parts.password if parts.password else ""}@{netloc}'
+        # Filter the raw query so the parameters kept stay encoded as they were
+        query = '&'.join(
+            param for param in parts.query.split('&')
+            if param and self.keep_param(unquote_plus(param.split('=', 1)[0]))
+        )
+        fragment = parts.fragment if self.keep_fragment else ''
+        return urlunsplit((scheme, netloc, parts.path or '/', query, fragment))
+
+    def dedupe_key(self, url):
+        """Return the key under which variants of ``url`` compare equal."""
+        parts = urlsplit(self.canonical_url(url))
+        host = parts.netloc
+        if self.ignore_www and host.startswith('www.'):
+            host = host[4:]
+        path = parts.path
+        if self.ignore_trailing_slash and len(path) > 1:
+            path = path.rstrip('/') or '/'
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return url_key(urlunsplit((parts.scheme, host, path, query, parts.fragment)))
+
+
+class CanonicalUrls:
+    """Spider middleware that canonicalizes links and collapses aliases.
+
+    Every request the spider yields is rewritten to its canonical URL and
+    dropped if a variant of it (same ``dedupe_key``, directly or through a
+    learned rel=canonical alias) was already scheduled. Items get the
+    canonical URL of their page, and items from a page whose rel=canonical
+    target was already processed under another URL are dropped.
+
+    ``canonical/avoided_fetches`` counts dropped requests that Scrapy's own
+    duplicate filter would have let through.
+    """
+
+    def __init__(self, rules, stats=None):
+        self.rules = rules
+        self.stats = stats
+        self.scheduled = set()
+        # Keys Scrapy's dupefilter has seen, to tell its drops apart from ours
+        self.fingerprints = set()
+        self.aliases = {}
+        self.processed = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CANONICAL_ENABLED'):
+            raise NotConfigured
+        return cls(UrlRules.from_settings(crawler.settings), stats=crawler.stats)
+
+    def resolve(self, url):
+        """Return the URL to fetch for ``url`` and its dedupe key."""
+        url = self.rules.canonical_url(url)
+        key = self.rules.dedupe_key(url)
+        target = self.aliases.get(key)
+        if target is not None:
+            return target, self.rules.dedupe_key(target)
+        return url, key
+
+    def learn(self, response):
+        """Record ``response``'s rel=canonical; return the page's canonical URL."""
+        url = self.rules.canonical_url(response.url)
+        key = self.rules.dedupe_key(url)
+        # Redirect targets count as scheduled too
+        self.scheduled.add(key)
+        self.fingerprints.add(url_key(canonicalize_url(response.url)))
+        canonical = self.aliases.get(key, url)
+        if response.status != 200 or not isinstance(response, TextResponse):
+            return canonical
+        href = response.css('link[rel~=canonical]::attr(href)').get()
+        if not href:
+            return canonical
+        target = self.rules.canonical_url(urljoin(response.url, href.strip()))
+        target_key = self.rules.dedupe_key(target)
+        # Same-site canonicals only, and not the home page: some sites point
+        # every page there
+        if not self._same_site(target, url) or urlsplit(target).path == '/':
+            return canonical
+        if target_key != key and self.aliases.get(key) != target:
+            self.aliases[key] = target
+            self._inc_stat('canonical/aliases')
+        self.scheduled.add(target_key)
+        return target
+
+    def process_spider_input(self, response, spider=None):
+        canonical = self.learn(response)
+        key = self.rules.dedupe_key(canonical)
+        if key in self.processed:
+            response.meta['canonical_duplicate'] = True
+        self.processed.add(key)
+        response.meta['canonical_url'] = canonical
+        return None
+
+    def process_spider_output(self, response, result, spider=None):
+        for i in result:
+            i = self._process(response, i)
+            if i is not None:
+                yield i
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        async for i in result:
+            i = self._process(response, i)
+            if i is not None:
+                yield i
+
+    async def process_start(self, start):
+        async for item_or_request in start:
+            if isinstance(item_or_request, scrapy.Request):
+                item_or_request = self._schedule(item_or_request)
+            if item_or_request is not None:
+                yield item_or_request
+
+    def _process(self, response, output):
+        if isinstance(output, scrapy.Request):
+            return self._schedule(output)
+        if response.meta.get('canonical_duplicate'):
+            self._inc_stat('canonical/duplicate_items')
+            return None
+        adapter = ItemAdapter(output)
+        if 'url' in adapter.field_names() and response.meta.get('canonical_url'):
+            adapter['url'] = response.meta['canonical_url']
+        return output
+
+    def _schedule(self, request):
+        if request.dont_filter:
+            return request
+        fingerprint = url_key(canonicalize_url(request.url))
+        new_fingerprint = fingerprint not in self.fingerprints
+        self.fingerprints.add(fingerprint)
+
+        url, key = self.resolve(request.url)
+        if key in self.scheduled:
+            if new_fingerprint:
+                self._inc_stat('canonical/avoided_fetches')
+            return None
+        self.scheduled.add(key)
+        self.fingerprints.add(url_key(canonicalize_url(url)))
+        if url != request.url:
+            self._inc_stat('canonical/rewritten')
+            request = request.replace(url=url)
+        return request
+
+    def _same_site(self, a, b):
+        def site(url):
+            host = (urlsplit(url).hostname or '').lower()
+            return host[4:] if host.startswith('www.') else host
+        return site(a) == site(b)
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
@@ -0,0 +1,299 @@
+# Crash-safe checkpointing for long crawls
+#
+# Enable by setting CHECKPOINT_DIR (see settings.py). The middleware keeps
+# three append-only logs in that directory plus a manifest:
+#
+#   frontier.log  - every URL handed to the scheduler, one per line
+#   done.log      - URLs whose page was fully processed (links scheduled
+#                   and items exported)
+#   items.jl      - exported items, JSON lines (the crash-safe export)
+#   manifest.log  - one JSON line per snapshot with the byte offsets of
+#                   the three logs at that point
+#
+# Writes are buffered in memory and flushed + fsynced on every snapshot,
+# which happens every CHECKPOINT_INTERVAL seconds, on SIGUSR1 and when the
+# spider closes. On start the logs are truncated back to the offsets of the
+# last complete manifest line, so a torn write after a crash is discarded
+# and the three logs always agree with each other.
+#
+# The checkpoint_snapshot signal is sent at the start of every snapshot,
+# before done.log is synced, so components keeping their own state (the
+# change feed) can commit it no later than the pages it covers are done.
+
+import hashlib
+import json
+import logging
+import os
+import signal
+import time
+
+import scrapy
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+# useful for handling different item types with a single interface
+from itemadapter import ItemAdapter
+
+logger = logging.getLogger(__name__)
+
+LOGS = ('frontier', 'done', 'items')
+FILENAMES = {'frontier': 'frontier.log', 'done': 'done.log', 'items': 'items.jl'}
+MANIFEST = 'manifest.log'
+
+checkpoint_snapshot = object()
+
+
+def url_key(url):
+    """Return a compact 64-bit key for ``url`` used by the in-memory seen-set."""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def read_manifest(directory):
+    """Return the offsets recorded by the last complete manifest line, or None."""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    for line in reversed(data.split(b'\n')[:-1]):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if all(name in entry for name in LOGS):
+            return entry
+    return None
+
+
+def load_checkpoint(directory):
+    """Recover the crawl state stored in ``directory``.
+
+    Truncates every log to the last snapshot and returns a dict with the
+    ``done`` key set, the ``pending`` frontier URLs (in scheduling order),
+    the number of exported ``items`` and the snapshot ``offsets``. Returns
+    None if there is no usable snapshot.
+    """
+    entry = read_manifest(directory)
+    if entry is None:
+        return None
+
+    for name in LOGS:
+        path = os.path.join(directory, FILENAMES[name])
+        if not os.path.exists(path):
+            if entry[name]:
+                logger.warning("Checkpoint log %s is missing, ignoring checkpoint", path)
+                return None
+            continue
+        if os.path.getsize(path) > entry[name]:
+            os.truncate(path, entry[name])
+
+    def read_lines(name):
+        path = os.path.join(directory, FILENAMES[name])
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            return f.read().splitlines()
+
+    done = {url_key(url.decode('utf-8')) for url in read_lines('done')}
+    pending = []
+    queued = set()
+    for raw in read_lines('frontier'):
+        url = raw.decode('utf-8')
+        key = url_key(url)
+        if key in done or key in queued:
+            continue
+        queued.add(key)
+        pending.append(url)
+
+    return {
+        'done': done,
+        'pending': pending,
+        'items': len(read_lines('items')),
+        'offsets': {name: entry[name] for name in LOGS},
+    }
+
+
+class CrawlCheckpoint:
+    """Spider middleware that checkpoints the seen-set, frontier and export.
+
+    On resume the pending frontier is scheduled instead of the spider's
+    start requests, and links to pages that were already processed are
+    dropped before they reach the scheduler, so exported pages are never
+    fetched again.
+    """
+
+    def __init__(self, directory, interval=30.0, stats=None):
+        self.directory = directory
+        self.interval = interval
+        self.stats = stats
+        self.crawler = None
+        os.makedirs(directory, exist_ok=True)
+
+        state = load_checkpoint(directory)
+        self.resumed = state is not None
+        self.done = state['done'] if state else set()
+        self.pending = state['pending'] if state else []
+        self.items_exported = state['items'] if state else 0
+
+        self._files = {
+            name: open(os.path.join(directory, FILENAMES[name]), 'ab')
+            for name in LOGS
+        }
+        self._manifest = open(os.path.join(directory, MANIFEST), 'ab')
+        self._buffers = {name: [] for name in LOGS}
+        # response url -> outstanding work (the callback output plus every
+        # item it produced that has not reached the end of the pipeline)
+        self._open = {}
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('CHECKPOINT_DIR')
+        if not directory:
+            raise NotConfigured
+        s = cls(
+            directory,
+            interval=crawler.settings.getfloat('CHECKPOINT_INTERVAL', 30.0),
+            stats=crawler.stats,
+        )
+        s.crawler = crawler
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_finished, signal=signals.item_dropped)
+        crawler.signals.connect(s.item_finished, signal=signals.item_error)
+        return s
+
+    async def process_start(self, start):
+        if not self.resumed:
+            async for item_or_request in start:
+                if isinstance(item_or_request, scrapy.Request):
+                    self._record('frontier', item_or_request.url)
+                yield item_or_request
+            return
+
+        # Resume: the frontier replaces the original start requests
+        for url in self.pending:
+            yield scrapy.Request(url)
+
+    def process_spider_output(self, response, result, spider):
+        self._open_page(response)
+        for i in result:
+            if self._track(response, i):
+                yield i
+        self._finish(response.url)
+
+    async def process_spider_output_async(self, response, result, spider):
+        self._open_page(response)
+        async for i in result:
+            if self._track(response, i):
+                yield i
+        self._finish(response.url)
+
+    def _open_page(self, response):
+        url = response.url
+        self._open[url] = self._open.get(url, 0) + 1
+        # Redirect sources are done once their target is
+        request = getattr(response, 'request', None)
+        if request is not None:
+            for source in request.meta.get('redirect_urls', ()):
+                self._mark_done(source)
+
+    def _track(self, response, output):
+        """Record one callback output; return False if it should be dropped."""
+        if isinstance(output, scrapy.Request):
+            if url_key(output.url) in self.done:
+                self._inc_stat('checkpoint/skipped_done')
+                return False
+            self._record('frontier', output.url)
+        else:
+            self._open[response.url] += 1
+        return True
+
+    def process_spider_exception(self, response, exception, spider):
+        # Leave the page in the frontier so a resumed crawl retries it
+        self._open.pop(response.url, None)
+
+    def item_scraped(self, item, response, spider):
+        self._record('items', json.dumps(ItemAdapter(item).asdict(), ensure_ascii=False))
+        self.items_exported += 1
+        self.item_finished(item, response, spider)
+
+    def item_finished(self, item, response, spider, **kwargs):
+        if response is not None and response.url in self._open:
+            self._finish(response.url)
+
+    def _finish(self, url):
+        remaining = self._open[url] - 1
+        if remaining:
+            self._open[url] = remaining
+            return
+        del self._open[url]
+        self._mark_done(url)
+
+    def _mark_done(self, url):
+        key = url_key(url)
+        if key not in self.done:
+            self.done.add(key)
+            self._record('done', url)
+
+    def _record(self, name, line):
+        self._buffers[name].append(line.encode('utf-8') + b'\n')
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+    def snapshot(self):
+        """Flush every buffered record and append a manifest entry."""
+        if self.crawler is not None:
+            self.crawler.signals.send_catch_log(checkpoint_snapshot)
+        offsets = {}
+        # frontier is flushed before done, so a page never counts as done
+        # before the links it produced are durable
+        for name in LOGS:
+            f = self._files[name]
+            if self._buffers[name]:
+                f.write(b''.join(self._buffers[name]))
+                self._buffers[name] = []
+            f.flush()
+            os.fsync(f.fileno())
+            offsets[name] = f.tell()
+        entry = dict(offsets, time=time.time())
+        self._manifest.write(json.dumps(entry).encode('utf-8') + b'\n')
+        self._manifest.flush()
+        os.fsync(self._manifest.fileno())
+        self._inc_stat('checkpoint/snapshots')
+        return entry
+
+    def _on_signal(self, signum, frame):
+        from twisted.internet import reactor
+        reactor.callFromThread(self.snapshot)
+
+    def spider_opened(self, spider):
+        if self.resumed:
+            spider.logger.info(
+                "Resuming from checkpoint %s: %d pages done, %d pending, %d items exported"
+                % (self.directory, len(self.done), len(self.pending), self.items_exported)
+            )
+            if self.stats is not None:
+                self.stats.set_value('checkpoint/resumed_done', len(self.done))
+                self.stats.set_value('checkpoint/resumed_pending', len(self.pending))
+        if self.interval > 0:
+            self._loop = task.LoopingCall(self.snapshot)
+            self._loop.start(self.interval, now=False)
+        if hasattr(signal, 'SIGUSR1'):
+            try:
+                signal.signal(signal.SIGUSR1, self._on_signal)
+            except ValueError:
+                # Not running in the main thread
+                pass
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.snapshot()
+        for f in self._files.values():
+            f.close()
+        self._manifest.close()
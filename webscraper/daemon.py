@@ -0,0 +1,1060 @@
+"""
+Crawl daemon: warm crawler processes behind a local job API.
+
+Every ``scrapy crawl`` pays for interpreter startup, the Scrapy and Twisted
+imports and settings before its first request, and starts with an empty
+DNS cache. The daemon starts ``--workers`` crawler processes once and runs
+each submitted job in one of them as its own Crawler, with its own
+settings, alongside up to ``--slots - 1`` other jobs::
+
+    python -m webscraper.daemon serve --workers 2 --slots 4 --dir jobs/
+    python -m webscraper.daemon submit example.com --max-items 500 --follow
+
+Queued jobs are taken round-robin across domains, and a domain runs at
+most ``--jobs-per-domain`` jobs at once, so a site with a long queue does
+not hold up the others (or get crawled twice at the same time). A job goes
+back to the worker that last crawled its domain when that worker has a
+free slot.
+
+HTTP API, on 127.0.0.1 (``--port``) or a Unix socket (``--socket``). Requests
+must name localhost or 127.0.0.1 as their Host, job submissions must be
+``application/json`` (so a web page cannot post one), and with ``--token``
+(or ``WEBSCRAPER_DAEMON_TOKEN``) every request needs
+``Authorization: Bearer <token>``::
+
+    GET    /status            workers and queue
+    GET    /jobs              status of every job
+    POST   /jobs              submit a job (a JSON object, see job_spec)
+    GET    /jobs/<id>         job status
+    DELETE /jobs/<id>         cancel a queued or running job
+    GET    /jobs/<id>/items   items as JSON lines, streamed until the job ends
+                              (?offset=<bytes> resumes, ?follow=0 stops at the end so far)
+    GET    /jobs/<id>/events  job status as JSON lines, one per change, until the job ends
+
+Items are kept in ``<dir>/<id>.jl`` and the final status in ``<dir>/<id>.json``.
+A ``CHECKPOINT_DIR``, ``INDEX_DIR`` or ``CHANGEFEED_DIR`` set for the daemon
+gets a subdirectory per domain, ``<CHANGEFEED_DIR>/<domain>`` and so on, so
+each job's change feed compares it with the domain's previous job and a
+job for a domain whose last job was interrupted resumes its checkpoint.
+With any of them set, a domain runs one job at a time whatever
+``--jobs-per-domain`` says.
+"""
+import argparse
+import hmac
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import socket
+import socketserver
+import shutil
+import stat
+import sys
+import threading
+import uuid
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 6810
+DISCOVERY_MODES = ('crawl', 'pages')
+# Job budgets and the CloseSpider settings that enforce them
+BUDGETS = {
+    'max_items': 'CLOSESPIDER_ITEMCOUNT',
+    'max_pages': 'CLOSESPIDER_PAGECOUNT',
+    'max_time': 'CLOSESPIDER_TIMEOUT',
+}
+FINAL_STATES = ('finished', 'failed', 'cancelled')
+# Settings a job may override: pacing and limits, nothing that loads code
+# or writes files
+JOB_SETTINGS = {
+    'AUTOTHROTTLE_ENABLED', 'AUTOTHROTTLE_MAX_DELAY', 'AUTOTHROTTLE_START_DELAY',
+    'AUTOTHROTTLE_TARGET_CONCURRENCY', 'CONCURRENT_REQUESTS', 'CONCURRENT_REQUESTS_PER_DOMAIN',
+    'DEPTH_LIMIT', 'DOWNLOAD_DELAY', 'DOWNLOAD_TIMEOUT', 'RANDOMIZE_DOWNLOAD_DELAY',
+    'RETRY_ENABLED', 'RETRY_TIMES',
+}
+# Output directories kept per domain; jobs of a domain must not share them
+# concurrently
+JOB_DIRECTORIES = ('CHECKPOINT_DIR', 'INDEX_DIR', 'CHANGEFEED_DIR')
+ALLOWED_HOSTS = ('localhost', '127.0.0.1')
+TOKEN_ENV = 'WEBSCRAPER_DAEMON_TOKEN'
+# Domains name directories, so nothing but host name characters
+DOMAIN_RE = re.compile(r'[a-z0-9-]+(?:\.[a-z0-9-]+)*')
+
+
+def job_spec(data):
+    """Validate a submitted job and return it with defaults filled in.
+
+    ``domain`` is required. ``discovery`` is ``crawl`` (follow links from
+    ``start_url``, by default ``https://<domain>/recipes``) or ``pages``
+    (fetch only ``urls``). ``max_items``, ``max_pages`` and ``max_time``
+    (seconds) budget the crawl, and ``settings`` overrides the Scrapy
+    settings in ``JOB_SETTINGS`` for this job only. Raises ValueError.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('a job is a JSON object')
+    unknown = set(data) - {'domain', 'discovery', 'start_url', 'urls', 'settings', *BUDGETS}
+    if unknown:
+        raise ValueError(f'unknown field(s): {", ".join(sorted(unknown))}')
+    domain = data.get('domain')
+    if not isinstance(domain, str) or not domain.strip():
+        raise ValueError('domain is required')
+    spec = {'domain': domain.strip().lower(), 'discovery': data.get('discovery', 'crawl')}
+    if not DOMAIN_RE.fullmatch(spec['domain']):
+        raise ValueError('domain must be a host name')
+    if spec['discovery'] not in DISCOVERY_MODES:
+        raise ValueError(f'discovery must be one of: {", ".join(DISCOVERY_MODES)}')
+
+    urls, start_url = data.get('urls'), data.get('start_url')
+    if spec['discovery'] == 'pages':
+        if not urls or not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+            raise ValueError('pages discovery needs a list of urls')
+        if start_url is not None:
+            raise ValueError('start_url is only used with crawl discovery')
+        spec['urls'] = urls
+    else:
+        if urls is not None:
+            raise ValueError('urls are only used with pages discovery')
+        if start_url is not None:
+            if not isinstance(start_url, str):
+                raise ValueError('start_url must be a string')
+            spec['start_url'] = start_url
+
+    for name in BUDGETS:
+        value = data.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0 \
+                or (name != 'max_time' and value != int(value)):
+            raise ValueError(f'{name} must be a non-negative {"number" if name == "max_time" else "integer"}')
+        spec[name] = value
+    settings = data.get('settings', {})
+    if not isinstance(settings, dict):
+        raise ValueError('settings must be an object')
+    refused = set(settings) - JOB_SETTINGS
+    if refused:
+        raise ValueError(f'setting(s) not allowed for a job: {", ".join(sorted(refused))}')
+    if not all(isinstance(value, (bool, int, float, str)) for value in settings.values()):
+        raise ValueError('setting values must be numbers, booleans or strings')
+    spec['settings'] = settings
+    return spec
+
+
+def crawl_arguments(spec):
+    """Return the spider arguments and setting overrides for a job spec."""
+    kwargs = {'domain': spec['domain']}
+    if spec['discovery'] == 'pages':
+        kwargs.update(start_urls=spec['urls'], follow_links=False)
+    elif 'start_url' in spec:
+        kwargs['start_url'] = spec['start_url']
+    settings = dict(spec['settings'])
+    for name, setting in BUDGETS.items():
+        if name in spec:
+            settings[setting] = spec[name]
+    return kwargs, settings
+
+
+def plain_stats(stats):
+    """Return crawl stats with values JSON can hold (datetimes become strings)."""
+    return {
+        key: value if value is None or isinstance(value, (bool, int, float, str)) else str(value)
+        for key, value in stats.items()
+    }
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class Job:
+    """A submitted crawl and what is known about it so far."""
+
+    def __init__(self, spec, directory):
+        self.id = uuid.uuid4().hex[:12]
+        self.spec = spec
+        # Jobs are scheduled per site, whichever host name they were given
+        domain = spec['domain']
+        self.key = domain[4:] if domain.startswith('www.') else domain
+        self.path = os.path.join(directory, f'{self.id}.jl')
+        self.state = 'queued'
+        self.worker = None
+        self.submitted = now()
+        self.started = None
+        self.finished = None
+        self.items = 0
+        self.pages = 0
+        self.reason = None
+        self.error = None
+        self.stats = None
+        self.cancelled = False
+        # Bumped on every change, for the streams waiting on this job
+        self.version = 0
+        self.output = None
+
+    @property
+    def done(self):
+        return self.state in FINAL_STATES
+
+    def status(self):
+        status = {
+            'id': self.id,
+            'domain': self.spec['domain'],
+            'discovery': self.spec['discovery'],
+            'state': self.state,
+            'worker': self.worker.pid if self.worker is not None else None,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'items': self.items,
+            'pages': self.pages,
+            'reason': self.reason,
+        }
+        if self.error is not None:
+            status['error'] = self.error
+        if self.stats is not None:
+            status['stats'] = self.stats
+        return status
+
+
+class FairQueue:
+    """Queued jobs, taken round-robin across domains.
+
+    Each domain keeps its jobs in submission order, and ``pop`` serves the
+    domains in turn, so a hundred jobs queued for one site do not hold up
+    a single job for another.
+    """
+
+    def __init__(self):
+        self._queues = OrderedDict()
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self._queues.values())
+
+    def push(self, job):
+        self._queues.setdefault(job.key, deque()).append(job)
+
+    def remove(self, job):
+        jobs = self._queues.get(job.key)
+        if not jobs or job not in jobs:
+            return False
+        jobs.remove(job)
+        if not jobs:
+            del self._queues[job.key]
+        return True
+
+    def pop(self, skip=()):
+        """Return the next job whose domain is not in ``skip``, or None."""
+        for key, jobs in self._queues.items():
+            if key in skip:
+                continue
+            job = jobs.popleft()
+            # The domain goes to the back of the rotation
+            del self._queues[key]
+            if jobs:
+                self._queues[key] = jobs
+            return job
+        return None
+
+
+class WorkerProcess:
+    """A warm crawler process (see ``worker_main``) and the jobs it runs."""
+
+    def __init__(self, index, events, settings, context):
+        self.index = index
+        self.running = {}
+        self.jobs_run = 0
+        self.ready = False
+        self.accepting = True
+        self._receiver, self._sender = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=worker_main, args=(index, self._receiver, events, settings),
+            name=f'crawl-worker-{index}', daemon=True,
+        )
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def exitcode(self):
+        return self.process.exitcode
+
+    def start(self):
+        self.process.start()
+        self._receiver.close()
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def send(self, *message):
+        try:
+            self._sender.send(message)
+        except OSError:
+            # A dead worker is noticed (and its jobs failed) by check_workers()
+            pass
+
+    def terminate(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(5)
+
+
+class CrawlDaemon:
+    """Run crawl jobs in a pool of warm crawler processes.
+
+    ``settings`` are Scrapy setting overrides for every job. Each worker runs
+    up to ``slots`` jobs at once and each domain at most ``jobs_per_domain``
+    (one if the workers keep per-domain directories, see ``JOB_DIRECTORIES``).
+    ``recycle_after`` replaces a worker once it has run that many jobs (0
+    never does), which bounds what a long-lived process can accumulate.
+    The status of the last ``keep_finished`` finished jobs stays available.
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, directory, workers=2, slots=4, jobs_per_domain=1, recycle_after=0,
+                 settings=None, keep_finished=1000, worker_class=WorkerProcess):
+        self.directory = directory
+        self.size = workers
+        self.slots = slots
+        self.jobs_per_domain = jobs_per_domain
+        self.per_domain_directories = False
+        self.recycle_after = recycle_after
+        self.settings = dict(settings or {})
+        self.keep_finished = keep_finished
+        self.worker_class = worker_class
+        self.jobs = OrderedDict()
+        self.queue = FairQueue()
+        self.workers = []
+        self.domain_jobs = Counter()
+        self.affinity = {}
+        self.changed = threading.Condition()
+        self.context = multiprocessing.get_context('spawn')
+        self.events = None
+        self._finished = deque()
+        self._retired = []
+        self._next_index = 0
+        self._stopping = False
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, timeout=120):
+        """Start the workers and return once they are all warm."""
+        self.events = self.context.Queue()
+        with self.changed:
+            for _ in range(self.size):
+                self.add_worker()
+        self._thread = threading.Thread(target=self._run, name='crawl-daemon', daemon=True)
+        self._thread.start()
+        with self.changed:
+            self.changed.wait_for(
+                lambda: len(self.workers) < self.size or all(w.ready for w in self.workers), timeout)
+            started = len(self.workers) == self.size and all(w.ready for w in self.workers)
+        if not started:
+            self.stop()
+            raise RuntimeError('crawler workers failed to start, see the log')
+        return self
+
+    def stop(self, timeout=60):
+        """Cancel queued jobs, stop running ones and wait for the workers to exit."""
+        with self.changed:
+            self._stopping = True
+            while len(self.queue):
+                self._finish(self.queue.pop(), 'cancelled', reason='shutdown')
+            for worker in self.workers:
+                worker.send('stop')
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for worker in self.workers + self._retired:
+            worker.terminate()
+        if self._thread is not None:
+            self._thread.join(self.poll_interval * 4)
+
+    def add_worker(self):
+        worker = self.worker_class(self._next_index, self.events, self.settings, self.context)
+        self._next_index += 1
+        worker.start()
+        self.workers.append(worker)
+        return worker
+
+    def submit(self, data):
+        """Queue a job (see ``job_spec``) and return it."""
+        job = Job(job_spec(data), self.directory)
+        open(job.path, 'wb').close()
+        with self.changed:
+            if self._stopping:
+                raise RuntimeError('the daemon is shutting down')
+            self.jobs[job.id] = job
+            self.queue.push(job)
+            self._touch(job)
+            self.dispatch()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job; returns it, or None for an unknown id."""
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None or job.done:
+                return job
+            if self.queue.remove(job):
+                self._finish(job, 'cancelled', reason='cancelled')
+            elif not job.cancelled:
+                job.cancelled = True
+                job.worker.send('cancel', job.id)
+                self._touch(job)
+            return job
+
+    def job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def status(self):
+        with self.changed:
+            return {
+                'workers': [{
+                    'pid': worker.pid,
+                    'ready': worker.ready,
+                    'jobs': list(worker.running),
+                    'jobs_run': worker.jobs_run,
+                } for worker in self.workers],
+                'queued': len(self.queue),
+                'running': sum(len(worker.running) for worker in self.workers),
+                'jobs': len(self.jobs),
+            }
+
+    def job_statuses(self):
+        with self.changed:
+            return [job.status() for job in self.jobs.values()]
+
+    def dispatch(self):
+        """Start queued jobs on free worker slots (call with ``changed`` held)."""
+        while len(self.queue):
+            free = [w for w in self.workers
+                    if w.ready and w.accepting and len(w.running) < self.slots]
+            if not free:
+                return
+            limit = 1 if self.per_domain_directories else self.jobs_per_domain
+            busy = {key for key, count in self.domain_jobs.items() if count >= limit}
+            job = self.queue.pop(busy)
+            if job is None:
+                return
+            worker = self.affinity.get(job.key)
+            if worker not in free:
+                worker = min(free, key=lambda w: len(w.running))
+            self.affinity[job.key] = worker
+            self.domain_jobs[job.key] += 1
+            worker.running[job.id] = job
+            worker.jobs_run += 1
+            if self.recycle_after and worker.jobs_run >= self.recycle_after:
+                worker.accepting = False
+            job.state, job.worker, job.started = 'running', worker, now()
+            job.output = open(job.path, 'ab')
+            worker.send('run', job.id, job.key, *crawl_arguments(job.spec))
+            self._touch(job)
+
+    def handle_event(self, event):
+        """Apply a message from a worker (call with ``changed`` held)."""
+        kind = event[0]
+        if kind == 'ready':
+            for worker in self.workers:
+                if worker.index == event[1]:
+                    worker.ready = True
+            directories = event[3]
+            if directories and not self.per_domain_directories:
+                self.per_domain_directories = True
+                if self.jobs_per_domain > 1:
+                    logger.warning('%s kept per domain, running one job per domain at a time',
+                                   ', '.join(directories))
+            return
+        job = self.jobs.get(event[1])
+        if job is None or job.done:
+            return
+        if kind == 'progress':
+            lines, count, job.pages = event[2:]
+            if count:
+                job.output.write(lines)
+                job.output.flush()
+                job.items += count
+            self._touch(job)
+        elif kind == 'finished':
+            stats = event[2]
+            job.pages = stats.get('response_received_count', job.pages)
+            self._finish(job, 'cancelled' if job.cancelled else 'finished',
+                         reason=stats.get('finish_reason'), stats=stats)
+        elif kind == 'failed':
+            self._finish(job, 'failed', error=event[2])
+
+    def check_workers(self):
+        """Retire recycled workers and replace dead ones (call with ``changed`` held)."""
+        for worker in self._retired[:]:
+            if not worker.alive():
+                self._retired.remove(worker)
+        for worker in self.workers[:]:
+            if worker.alive():
+                if not worker.accepting and not worker.running:
+                    worker.send('stop')
+                    self.workers.remove(worker)
+                    self._retired.append(worker)
+                    if not self._stopping:
+                        self.add_worker()
+                continue
+            if self.events is not None and not self.events.empty():
+                # Let the events it sent before exiting arrive first
+                continue
+            self.workers.remove(worker)
+            for job in list(worker.running.values()):
+                self._finish(job, 'failed', error=f'worker exited with code {worker.exitcode}')
+            if self._stopping:
+                continue
+            if worker.ready:
+                logger.error('Crawler worker %s exited with code %s, starting another',
+                             worker.pid, worker.exitcode)
+                self.add_worker()
+            else:
+                logger.error('Crawler worker %s exited with code %s during startup',
+                             worker.pid, worker.exitcode)
+
+    def follow_items(self, job, offset=0, follow=True):
+        """Yield the job's item lines from byte ``offset`` on, in chunks of bytes.
+
+        With ``follow`` this waits for more items until the job ends.
+        """
+        with open(job.path, 'rb') as f:
+            f.seek(offset)
+            partial = b''
+            while True:
+                with self.changed:
+                    version, done = job.version, job.done
+                data = f.read()
+                if data:
+                    data = partial + data
+                    end = data.rfind(b'\n') + 1
+                    partial = data[end:]
+                    if end:
+                        yield data[:end]
+                    continue
+                if done or not follow:
+                    return
+                with self.changed:
+                    self.changed.wait_for(lambda: job.version != version, self.poll_interval * 4)
+
+    def follow_status(self, job):
+        """Yield the job's status every time it changes, until the job ends."""
+        version = None
+        while True:
+            with self.changed:
+                if not self.changed.wait_for(lambda: job.version != version, self.poll_interval * 4):
+                    continue
+                version, status = job.version, job.status()
+            yield status
+            if status['state'] in FINAL_STATES:
+                return
+
+    def _run(self):
+        while True:
+            try:
+                event = self.events.get(timeout=self.poll_interval)
+            except queue.Empty:
+                event = None
+            with self.changed:
+                if event is not None:
+                    self.handle_event(event)
+                self.check_workers()
+                self.dispatch()
+                self.changed.notify_all()
+                if self._stopping and not self.workers and event is None:
+                    return
+
+    def _finish(self, job, state, reason=None, error=None, stats=None):
+        job.state, job.finished = state, now()
+        job.reason, job.error, job.stats = reason or state, error, stats
+        if job.output is not None:
+            job.output.close()
+            job.output = None
+        worker = job.worker
+        if worker is not None and worker.running.pop(job.id, None) is not None:
+            self.domain_jobs[job.key] -= 1
+            if not self.domain_jobs[job.key]:
+                del self.domain_jobs[job.key]
+        with open(os.path.join(self.directory, f'{job.id}.json'), 'w') as f:
+            json.dump(job.status(), f)
+        self._touch(job)
+        self._finished.append(job.id)
+        while len(self._finished) > self.keep_finished:
+            self.jobs.pop(self._finished.popleft(), None)
+
+    def _touch(self, job):
+        job.version += 1
+        self.changed.notify_all()
+
+
+# Worker process side; Scrapy and Twisted are only imported here
+
+def worker_main(index, jobs, events, settings):
+    """Run a crawler worker: jobs arrive on ``jobs``, results go to ``events``."""
+    # Ctrl-C reaches the whole process group; the daemon decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.project import get_project_settings
+    from scrapy.utils.reactor import install_reactor
+
+    project_settings = get_project_settings()
+    # Concurrent jobs would each take a telnet port; -s can turn it back on
+    project_settings.set('TELNETCONSOLE_ENABLED', False, priority='project')
+    project_settings.setdict(settings, priority='cmdline')
+    if project_settings.get('TWISTED_REACTOR'):
+        install_reactor(project_settings['TWISTED_REACTOR'], project_settings['ASYNCIO_EVENT_LOOP'])
+    from twisted.internet import reactor
+
+    configure_logging(project_settings)
+    worker = CrawlWorker(index, project_settings, events, reactor)
+    threading.Thread(target=worker.read, args=(jobs,), daemon=True).start()
+    reactor.callWhenRunning(worker.start)
+    reactor.run(installSignalHandlers=False)
+
+
+class _RunningJob:
+    __slots__ = ('crawler', 'lines', 'items', 'pages')
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.lines = []
+        self.items = 0
+        self.pages = 0
+
+
+class CrawlWorker:
+    """The reactor side of a worker process: each job is a concurrent crawl.
+
+    Items are serialized here and sent to the daemon in batches every
+    ``flush_interval`` seconds, together with the pages crawled so far.
+    A job's ``max_items`` is exact: items past it are not sent.
+    """
+
+    flush_interval = 0.5
+
+    def __init__(self, index, settings, events, reactor):
+        from scrapy.crawler import CrawlerRunner
+        from scrapy.utils.serialize import ScrapyJSONEncoder
+
+        from webscraper.spiders.recipe_spider import RecipeSpider
+
+        self.index = index
+        self.settings = settings
+        self.events = events
+        self.reactor = reactor
+        self.spidercls = RecipeSpider
+        self.runner = CrawlerRunner(settings)
+        self.encoder = ScrapyJSONEncoder(ensure_ascii=False)
+        self.jobs = {}
+        # Close reasons for jobs told to stop, applied once their spider is open
+        self.closing = {}
+        self.stopping = False
+
+    def start(self):
+        from twisted.internet import task
+
+        self.flusher = task.LoopingCall(self.flush)
+        self.flusher.start(self.flush_interval, now=False)
+        directories = [name for name in JOB_DIRECTORIES if self.settings.get(name)]
+        self.events.put(('ready', self.index, os.getpid(), directories))
+
+    def read(self, jobs):
+        """Hand the daemon's messages to the reactor (runs in its own thread)."""
+        while True:
+            try:
+                message = jobs.recv()
+            except (EOFError, OSError):
+                # The daemon went away
+                message = ('stop',)
+            self.reactor.callFromThread(self.handle, *message)
+            if message[0] == 'stop':
+                return
+
+    def handle(self, command, *args):
+        {'run': self.run, 'cancel': self.cancel, 'stop': self.stop}[command](*args)
+
+    def run(self, job_id, key, kwargs, overrides):
+        from itemadapter import ItemAdapter
+        from scrapy import signals
+        from scrapy.crawler import Crawler
+        from scrapy.settings import SETTINGS_PRIORITIES
+
+        # The runner merges its settings into every crawler it starts, over
+        # those of equal priority, so the job's go above the command line
+        priority = SETTINGS_PRIORITIES['cmdline'] + 1
+        settings = self.settings.copy()
+        settings.setdict(overrides, priority=priority)
+        for name in JOB_DIRECTORIES:
+            if settings.get(name):
+                settings.set(name, os.path.join(settings[name], key), priority=priority)
+        try:
+            crawler = Crawler(self.spidercls, settings)
+        except Exception as e:
+            self.events.put(('failed', job_id, f'{type(e).__name__}: {e}'))
+            return
+        job = self.jobs[job_id] = _RunningJob(crawler)
+        # CloseSpider lets the requests in flight finish; their items are not sent
+        max_items = crawler.settings.getint('CLOSESPIDER_ITEMCOUNT')
+
+        def item_scraped(item):
+            if max_items and job.items >= max_items:
+                return
+            job.items += 1
+            job.lines.append(self.encoder.encode(ItemAdapter(item).asdict()) + '\n')
+
+        def spider_opened():
+            if job_id in self.closing:
+                self.reactor.callLater(0, self.cancel, job_id, self.closing[job_id])
+
+        crawler.signals.connect(item_scraped, signal=signals.item_scraped, weak=False)
+        crawler.signals.connect(spider_opened, signal=signals.spider_opened, weak=False)
+        d = self.runner.crawl(crawler, **kwargs)
+        d.addCallbacks(lambda _: self.finished(job_id), lambda failure: self.finished(job_id, failure))
+
+    def cancel(self, job_id, reason='cancelled'):
+        from scrapy.utils.defer import deferred_from_coro
+
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        self.closing[job_id] = reason
+        engine = job.crawler.engine
+        if engine is not None and engine.spider is not None:
+            d = deferred_from_coro(engine.close_spider_async(reason=reason))
+            d.addErrback(lambda failure: logger.error('Could not close job %s: %s',
+                                                      job_id, failure.getErrorMessage()))
+
+    def stop(self):
+        self.stopping = True
+        if not self.jobs:
+            self.reactor.stop()
+        for job_id in list(self.jobs):
+            self.cancel(job_id, 'shutdown')
+
+    def flush(self):
+        for job_id, job in self.jobs.items():
+            self.send_progress(job_id, job)
+
+    def send_progress(self, job_id, job):
+        stats = job.crawler.stats
+        pages = stats.get_value('response_received_count', 0) if stats is not None else 0
+        if job.lines or pages != job.pages:
+            lines = ''.join(job.lines).encode('utf-8')
+            self.events.put(('progress', job_id, lines, len(job.lines), pages))
+            job.lines.clear()
+            job.pages = pages
+
+    def finished(self, job_id, failure=None):
+        job = self.jobs.pop(job_id)
+        self.closing.pop(job_id, None)
+        self.send_progress(job_id, job)
+        checkpoint, stats = job.crawler.settings.get('CHECKPOINT_DIR'), job.crawler.stats
+        if checkpoint and stats is not None and stats.get_value('finish_reason') == 'finished':
+            # Done with the domain: its next job starts afresh (before the
+            # daemon hears of this and can start that job)
+            shutil.rmtree(checkpoint, ignore_errors=True)
+        if failure is None:
+            self.events.put(('finished', job_id, plain_stats(job.crawler.stats.get_stats())))
+        else:
+            self.events.put(('failed', job_id, failure.getErrorMessage()))
+        if self.stopping and not self.jobs:
+            self.reactor.stop()
+
+
+# HTTP API
+
+class JobApiHandler(BaseHTTPRequestHandler):
+    server_version = 'webscraper-daemon'
+
+    def do_GET(self):
+        if not self._allowed():
+            return
+        parts, query = self._route()
+        daemon = self.server.crawl_daemon
+        if parts == ['status']:
+            return self._send_json(200, daemon.status())
+        if parts == ['jobs']:
+            return self._send_json(200, {'jobs': daemon.job_statuses()})
+        job = self._job(parts)
+        if job is None:
+            return
+        if len(parts) == 2:
+            return self._send_json(200, job.status())
+        if parts[2] == 'items':
+            try:
+                offset = int(query.get('offset', 0))
+            except ValueError:
+                return self._send_json(400, {'error': 'offset must be an integer'})
+            follow = query.get('follow', '1') not in ('0', 'false', 'no')
+            return self._stream(daemon.follow_items(job, offset, follow))
+        if parts[2] == 'events':
+            return self._stream(json.dumps(status).encode() + b'\n'
+                                for status in daemon.follow_status(job))
+        self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self._allowed():
+            return
+        parts, _ = self._route()
+        if parts != ['jobs']:
+            return self._send_json(404, {'error': 'not found'})
+        # Browsers post text/plain forms without a preflight, never JSON
+        if self.headers.get_content_type() != 'application/json':
+            return self._send_json(415, {'error': 'jobs are submitted as application/json'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = self.server.crawl_daemon.submit(json.loads(self.rfile.read(length) or b'null'))
+        except ValueError as e:
+            return self._send_json(400, {'error': str(e)})
+        except RuntimeError as e:
+            return self._send_json(503, {'error': str(e)})
+        self._send_json(201, job.status())
+
+    def do_DELETE(self):
+        if not self._allowed():
+            return
+        parts, _ = self._route()
+        if len(parts) != 2:
+            return self._send_json(404, {'error': 'not found'})
+        if self._job(parts) is None:
+            return
+        self._send_json(200, self.server.crawl_daemon.cancel(parts[1]).status())
+
+    def _allowed(self):
+        """Check the Host header and token, answering the request if they fail."""
+        # A page rebound to 127.0.0.1 by DNS still sends its own host name
+        if isinstance(self.client_address, tuple):
+            host = urlsplit('//' + self.headers.get('Host', '')).hostname
+            if host not in self.server.allowed_hosts:
+                self._send_json(403, {'error': 'requests must be addressed to localhost'})
+                return False
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get('Authorization', '').encode(),
+                                             f'Bearer {token}'.encode()):
+            self._send_json(401, {'error': 'a valid token is required'})
+            return False
+        return True
+
+    def _route(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        return parts, {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+    def _job(self, parts):
+        job = None
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.server.crawl_daemon.job(parts[1])
+        if job is None:
+            self._send_json(404, {'error': 'no such job'})
+        return job
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode() + b'\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, chunks):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                self.wfile.write(chunk)
+        except ConnectionError:
+            # The client stopped reading
+            pass
+        finally:
+            chunks.close()
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(daemon, port=DEFAULT_PORT, host='127.0.0.1', socket_path=None, token=None):
+    """Return an HTTP server for the daemon's API, on ``host:port`` or a Unix socket.
+
+    With ``token`` every request needs ``Authorization: Bearer <token>``.
+    """
+    if socket_path:
+        # Replace a socket left behind by an earlier daemon, but nothing else
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        # Create the socket owner-only from the start, not chmod it after bind
+        umask = os.umask(0o177)
+        try:
+            server = UnixHTTPServer(socket_path, JobApiHandler)
+        finally:
+            os.umask(umask)
+    else:
+        server = ThreadingHTTPServer((host, port), JobApiHandler)
+        server.daemon_threads = True
+    server.crawl_daemon = daemon
+    server.allowed_hosts = {*ALLOWED_HOSTS, host}
+    server.token = token
+    return server
+
+
+# Command line
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def api_request(args, method, path, data=None):
+    """Send one request to a running daemon and return the response."""
+    if args.socket:
+        connection = UnixHTTPConnection(args.socket)
+    else:
+        connection = http.client.HTTPConnection(args.host, args.port)
+    body, headers = None, {}
+    if data is not None:
+        body, headers['Content-Type'] = json.dumps(data), 'application/json'
+    if args.token:
+        headers['Authorization'] = f'Bearer {args.token}'
+    connection.request(method, path, body=body, headers=headers)
+    return connection.getresponse()
+
+
+def print_response(response):
+    data = json.load(response)
+    print(json.dumps(data, indent=2))
+    return 0 if response.status < 400 else 1
+
+
+def stream_items(args, job_id):
+    response = api_request(args, 'GET', f'/jobs/{job_id}/items')
+    if response.status >= 400:
+        return print_response(response)
+    for line in response:
+        sys.stdout.buffer.write(line)
+        sys.stdout.flush()
+    return 0
+
+
+def parse_settings(values):
+    settings = {}
+    for value in values:
+        name, sep, setting = value.partition('=')
+        if not sep:
+            raise SystemExit(f'-s takes NAME=VALUE, got {value!r}')
+        settings[name] = setting
+    return settings
+
+
+def serve(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+    daemon = CrawlDaemon(
+        args.dir, workers=args.workers, slots=args.slots, jobs_per_domain=args.jobs_per_domain,
+        recycle_after=args.recycle_after, settings=parse_settings(args.set),
+    )
+    logger.info('Starting %d crawler workers', args.workers)
+    daemon.start()
+    server = make_server(daemon, args.port, host=args.host, socket_path=args.socket, token=args.token)
+    logger.info('Accepting jobs on %s', args.socket or f'http://{args.host}:{args.port}')
+
+    def shut_down(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, shut_down)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info('Stopping crawler workers')
+        daemon.stop()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m webscraper.daemon',
+                                     description='Run crawls in warm crawler processes.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    connection = argparse.ArgumentParser(add_help=False)
+    connection.add_argument('--host', default='127.0.0.1')
+    connection.add_argument('--port', type=int, default=DEFAULT_PORT)
+    connection.add_argument('--socket', help='Unix socket path (instead of --host/--port)')
+    connection.add_argument('--token', default=os.environ.get(TOKEN_ENV),
+                            help=f'API token (default: ${TOKEN_ENV})')
+
+    serve_parser = commands.add_parser('serve', parents=[connection], help='run the daemon')
+    serve_parser.add_argument('--dir', default='jobs', help='where job items and statuses are kept')
+    serve_parser.add_argument('--workers', type=int, default=2)
+    serve_parser.add_argument('--slots', type=int, default=4, help='concurrent jobs per worker')
+    serve_parser.add_argument('--jobs-per-domain', type=int, default=1)
+    serve_parser.add_argument('--recycle-after', type=int, default=0,
+                              help='replace a worker after this many jobs (0: never)')
+    serve_parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                              help='Scrapy setting for every job')
+
+    submit = commands.add_parser('submit', parents=[connection], help='submit a crawl job')
+    submit.add_argument('domain')
+    submit.add_argument('--start-url')
+    submit.add_argument('--pages', nargs='+', metavar='URL', help='fetch only these pages')
+    for name in BUDGETS:
+        submit.add_argument('--' + name.replace('_', '-'), type=float if name == 'max_time' else int)
+    submit.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='Scrapy setting for this job')
+    submit.add_argument('--follow', action='store_true', help='print the items as they arrive')
+
+    status = commands.add_parser('status', parents=[connection], help='show the daemon or a job')
+    status.add_argument('job', nargs='?')
+    items = commands.add_parser('items', parents=[connection], help='print a job\'s items')
+    items.add_argument('job')
+    cancel = commands.add_parser('cancel', parents=[connection], help='cancel a job')
+    cancel.add_argument('job')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        return serve(args)
+    if args.command == 'submit':
+        data = {'domain': args.domain, 'settings': parse_settings(args.set)}
+        if args.pages:
+            data.update(discovery='pages', urls=args.pages)
+        if args.start_url:
+            data['start_url'] = args.start_url
+        for name in BUDGETS:
+            if getattr(args, name) is not None:
+                data[name] = getattr(args, name)
+        response = api_request(args, 'POST', '/jobs', data)
+        if response.status >= 400 or not args.follow:
+            return print_response(response)
+        job = json.load(response)
+        print(f'Job {job["id"]} submitted', file=sys.stderr)
+        return stream_items(args, job['id'])
+    if args.command == 'status':
+        return print_response(api_request(args, 'GET', f'/jobs/{args.job}' if args.job else '/status'))
+    if args.command == 'items':
+        return stream_items(args, args.job)
+    return print_response(api_request(args, 'DELETE', f'/jobs/{args.job}'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# Define here the extensions for your crawler
+#
+# Don't forget to add your extension to the EXTENSIONS setting
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import gc
+import logging
+import os
+import sys
+import tracemalloc
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss():
+    """Return the current resident set size in bytes.
+
+    Reads /proc on Linux; elsewhere falls back to the peak RSS, which is
+    the best the standard library offers. Where neither is available
+    (Windows) it returns 0, leaving only the in-flight budget in effect.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # on macOS ru_maxrss is in bytes, on Linux it is in KB
+    return size if sys.platform == 'darwin' else size * 1024
+
+
+class MemoryBudget:
+    """Pause scheduling while the crawl is over its memory budget.
+
+    Every ``MEMORY_BUDGET_CHECK_INTERVAL`` seconds (and on every response)
+    the extension compares the process RSS with ``MEMORY_BUDGET_RSS_MB`` and
+    the bytes of downloaded responses still waiting to be processed by the
+    spider with ``MEMORY_BUDGET_INFLIGHT_MB``. Over either limit the engine
+    is paused, so no new requests are sent while in-flight work drains; it
+    is unpaused once both drop below ``MEMORY_BUDGET_RESUME_RATIO`` of their
+    limit. If nothing is left in flight and the RSS is still too high the
+    crawl resumes anyway after a ``gc.collect()``: the budget is soft,
+    MEMUSAGE_LIMIT_MB remains the hard limit.
+
+    With ``MEMORY_BUDGET_TRACEMALLOC`` the top allocation sites are put in
+    the stats when the spider closes, and a downsampled memory timeline is
+    kept in ``memory_budget/timeline`` as ``[responses, rss_mb, traced_mb]``.
+    """
+
+    TIMELINE_SIZE = 100
+
+    def __init__(self, crawler, rss_limit=None, inflight_limit=None, resume_ratio=0.9,
+                 interval=1.0, tracemalloc_top=0):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.rss_limit = rss_limit
+        self.inflight_limit = inflight_limit
+        self.resume_ratio = resume_ratio
+        self.interval = interval
+        self.tracemalloc_top = tracemalloc_top
+        self.paused = False
+        self.responses = 0
+        self.timeline = []
+        self._timeline_step = 1
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('MEMORY_BUDGET_ENABLED'):
+            raise NotConfigured
+        rss_mb = settings.getfloat('MEMORY_BUDGET_RSS_MB')
+        inflight_mb = settings.getfloat('MEMORY_BUDGET_INFLIGHT_MB')
+        o = cls(
+            crawler,
+            rss_limit=rss_mb * 1024 * 1024 if rss_mb else None,
+            inflight_limit=inflight_mb * 1024 * 1024 if inflight_mb else None,
+            resume_ratio=settings.getfloat('MEMORY_BUDGET_RESUME_RATIO', 0.9),
+            interval=settings.getfloat('MEMORY_BUDGET_CHECK_INTERVAL', 1.0),
+            tracemalloc_top=settings.getint('MEMORY_BUDGET_TRACEMALLOC', 0),
+        )
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(o.response_received, signal=signals.response_received)
+        return o
+
+    def inflight_bytes(self):
+        scraper = self.crawler.engine.scraper
+        return scraper.slot.active_size if scraper.slot is not None else 0
+
+    def _idle(self):
+        engine = self.crawler.engine
+        return not engine.downloader.active and (
+            engine.scraper.slot is None or engine.scraper.slot.is_idle()
+        )
+
+    def spider_opened(self, spider):
+        if self.tracemalloc_top and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._loop = task.LoopingCall(self.check)
+        self._loop.start(self.interval, now=True)
+
+    def response_received(self, response, request, spider):
+        self.responses += 1
+        if self.inflight_limit and not self.paused and self.inflight_bytes() > self.inflight_limit:
+            self.check()
+
+    def check(self):
+        rss = current_rss()
+        inflight = self.inflight_bytes()
+        self.stats.max_value('memory_budget/max_rss', rss)
+        self.stats.max_value('memory_budget/max_inflight_bytes', inflight)
+        self._sample(rss)
+
+        over_rss = self.rss_limit and rss > self.rss_limit
+        over_inflight = self.inflight_limit and inflight > self.inflight_limit
+        if not self.paused:
+            if over_rss or over_inflight:
+                self.paused = True
+                self.crawler.engine.pause()
+                self.stats.inc_value('memory_budget/pauses')
+                logger.info(
+                    "Memory budget exceeded (rss=%dMB, in-flight=%dKB), pausing scheduling",
+                    rss >> 20, inflight >> 10,
+                )
+            return
+
+        below_rss = not self.rss_limit or rss < self.rss_limit * self.resume_ratio
+        below_inflight = (not self.inflight_limit
+                          or inflight < self.inflight_limit * self.resume_ratio)
+        if below_rss and below_inflight:
+            self._resume()
+        elif self._idle():
+            gc.collect()
+            self.stats.inc_value('memory_budget/stalls')
+            logger.warning(
+                "RSS is %dMB with nothing in flight, resuming above the memory budget",
+                current_rss() >> 20,
+            )
+            self._resume()
+
+    def _resume(self):
+        self.paused = False
+        self.crawler.engine.unpause()
+        logger.info("Memory back within budget, resuming scheduling")
+
+    def _sample(self, rss, force=False):
+        self.stats.inc_value('memory_budget/checks')
+        if not force and self.stats.get_value('memory_budget/checks') % self._timeline_step:
+            return
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.timeline.append([self.responses, round(rss / 2**20, 2), round(traced / 2**20, 2)])
+        if len(self.timeline) >= self.TIMELINE_SIZE:
+            # Keep the timeline bounded: drop every other point, sample half as often
+            self.timeline = self.timeline[::2]
+            self._timeline_step *= 2
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._sample(current_rss(), force=True)
+        self.stats.set_value('memory_budget/timeline', self.timeline)
+        if self.tracemalloc_top and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            top = snapshot.statistics('lineno')[:self.tracemalloc_top]
+            self.stats.set_value('memory_budget/top_allocators', [
+                f'{stat.traceback[0].filename}:{stat.traceback[0].lineno} '
+                f'size={stat.size >> 10}KiB count={stat.count}'
+                for stat in top
+            ])
+            tracemalloc.stop()
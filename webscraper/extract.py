@@ -0,0 +1,601 @@
+"""
+Recipe extraction without Scrapy.
+
+The same parsing the spider uses, as plain functions over HTML, for other
+services and short-lived jobs. Importing this module pulls in neither
+Scrapy nor Twisted, and BeautifulSoup/lxml are only imported on first use.
+
+Usage::
+
+    from webscraper.extract import extract_recipe, extract_many
+
+    recipe = extract_recipe(html, 'https://example.com/recipes/soup')
+
+    # Batch mode: one Extractor (and one parser builder) for every document
+    for recipe in extract_many((page.html, page.url) for page in pages):
+        ...
+
+Recipes are returned as dicts with the same keys as ``WebscraperItem``.
+
+Pages embedding their recipe as ``<script id="__POST_CONTENT__">`` JSON
+take a fast path that finds the script in the raw bytes and never builds
+a DOM; orjson is used to decode it when installed. Anything the fast
+path is unsure about goes through BeautifulSoup as before, so both paths
+return the same recipe.
+"""
+import html as htmllib
+import json
+import re
+
+try:
+    from orjson import JSONDecodeError as _JSONError, loads as json_loads
+except ImportError:
+    from json import JSONDecodeError as _JSONError, loads as json_loads
+
+# Bump whenever a change to the parsing below changes its output
+EXTRACTOR_VERSION = 1
+
+# Tag selectors can match hundreds of elements on some sites
+MAX_DIETARY_LABELS = 30
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+# Fast path: the embedded JSON is located in the raw page bytes
+POST_CONTENT_MARKER = b'__POST_CONTENT__'
+POST_CONTENT_OPEN_RE = re.compile(
+    rb'<script\b[^>]*?\sid\s*=\s*(["\']?)__POST_CONTENT__\1(?=[\s/>])[^>]*>', re.IGNORECASE)
+SCRIPT_CLOSE_RE = re.compile(rb'</script\s*>', re.IGNORECASE)
+TITLE_RE = re.compile(rb'<title\b[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+# Elements whose content is skipped while looking for <title>, and their ends
+TITLE_SCAN_RE = re.compile(rb'<(?:(title|script|style|svg|textarea)\b|(!--))', re.IGNORECASE)
+SKIPPED_END_RES = {
+    b'script': SCRIPT_CLOSE_RE,
+    b'style': re.compile(rb'</style\s*>', re.IGNORECASE),
+    b'!--': re.compile(rb'-->'),
+}
+ENTITY_RE = re.compile(r'&(?![#\w]+;)')
+# Pages with these are parsed as WPRM recipes, whatever JSON they embed
+WPRM_MARKERS = (b'wprm-recipe-ingredient', b'wprm-recipe-instruction')
+
+TIME_PATTERNS = [
+    # (pattern, minutes per unit); None means "<hours>h <minutes>m"
+    (re.compile(r'(\d+)\s*minutes?', re.IGNORECASE), 1),
+    (re.compile(r'(\d+)\s*hours?', re.IGNORECASE), 60),
+    (re.compile(r'(\d+)h\s*(\d+)m', re.IGNORECASE), None),
+    (re.compile(r'(\d+)\s*hrs?', re.IGNORECASE), 60),
+]
+
+
+class Extractor:
+    """Reusable extraction state.
+
+    Holds the BeautifulSoup tree builder, so a batch pays for the parser
+    lookup and setup once instead of per document. The builder is only
+    created for the first page that needs a DOM. Not thread-safe: use one
+    Extractor per thread.
+    """
+
+    def __init__(self, max_dietary_labels=MAX_DIETARY_LABELS):
+        self.max_dietary_labels = max_dietary_labels
+        self._soup_class = None
+        self._builder = None
+
+    def make_soup(self, html):
+        if self._builder is None:
+            # Heavy imports are deferred until a page actually needs parsing
+            from bs4 import BeautifulSoup
+            from bs4.builder import builder_registry
+
+            self._soup_class = BeautifulSoup
+            self._builder = builder_registry.lookup('lxml')()
+        return self._soup_class(html, builder=self._builder)
+
+    def extract(self, html, url):
+        """Return the recipe fields found in ``html`` as a dict."""
+        item = self.extract_embedded(html, url)
+        if item is None:
+            item = self.extract_dom(html, url)
+        return item
+
+    def extract_embedded(self, html, url):
+        """Return the recipe from ``html``'s __POST_CONTENT__ JSON without parsing the HTML.
+
+        Bytes must be UTF-8 (or ASCII). Returns None whenever the DOM path
+        could come to a different result: no or malformed JSON, a WPRM
+        page, an unusual title, or undecodable bytes.
+        """
+        body = html.encode('utf-8', 'surrogatepass') if isinstance(html, str) else html
+        data = find_post_content(body)
+        if data is None or any(marker in body for marker in WPRM_MARKERS):
+            return None
+        try:
+            title = find_title(body)
+            if title is None:
+                return None
+            recipe_data = json_loads(data)
+            item = parse_embedded_json(recipe_data, {'url': url, 'title': title})
+        except (_JSONError, UnicodeDecodeError, TypeError, KeyError, AttributeError):
+            return None
+        item['dietary_labels'] = limit_labels(item['dietary_labels'], self.max_dietary_labels)
+        return item
+
+    def extract_dom(self, html, url):
+        """Return the recipe fields found in ``html`` by parsing the whole page."""
+        soup = self.make_soup(html)
+        try:
+            return self.extract_soup(soup, url)
+        finally:
+            soup.decompose()
+
+    def extract_soup(self, soup, url):
+        item = {}
+        item['url'] = url
+        # str() so the result does not keep the whole tree alive via the NavigableString
+        item['title'] = str(soup.title.string) if soup.title and soup.title.string else ''
+
+        # Check if this is RecipeTin Eats (has WPRM plugin)
+        wprm_elements = soup.select('.wprm-recipe-ingredient, .wprm-recipe-instruction')
+        if wprm_elements:
+            # Use RecipeTin Eats specific parsing
+            item = parse_recipetineats_html(soup, item)
+        else:
+            # Try to extract recipe data from embedded JSON first
+            try:
+                # Find the JSON data in the page
+                script_tag = soup.find('script', {'id': '__POST_CONTENT__'})
+                if script_tag and hasattr(script_tag, 'string') and script_tag.string:
+                    recipe_data = json.loads(str(script_tag.string))
+                    item = parse_embedded_json(recipe_data, item)
+            except (json.JSONDecodeError, KeyError, AttributeError):
+                # Fallback to generic HTML parsing
+                item = parse_generic_html(soup, item)
+
+        item['dietary_labels'] = limit_labels(item.get('dietary_labels', []),
+                                              self.max_dietary_labels)
+        return item
+
+
+def extract_recipe(html, url, max_dietary_labels=MAX_DIETARY_LABELS):
+    """Extract one recipe from ``html`` (str or bytes) fetched from ``url``."""
+    return Extractor(max_dietary_labels).extract(html, url)
+
+
+def extract_many(documents, max_dietary_labels=MAX_DIETARY_LABELS):
+    """Lazily extract recipes from an iterable of ``(html, url)`` pairs.
+
+    Documents are parsed one at a time with a shared Extractor, so memory
+    stays flat however long the stream is.
+    """
+    extractor = Extractor(max_dietary_labels)
+    for html, url in documents:
+        yield extractor.extract(html, url)
+
+
+def find_post_content(body):
+    """Return the raw text of the first ``<script id="__POST_CONTENT__">`` in ``body``, or None.
+
+    Scripts inside ``<!-- ... -->`` are skipped, as the DOM has none there.
+    """
+    start = body.find(POST_CONTENT_MARKER)
+    while start != -1:
+        tag = body.rfind(b'<', 0, start)
+        match = POST_CONTENT_OPEN_RE.match(body, tag) if tag != -1 else None
+        if match is not None and match.end() > start and not _in_comment(body, tag):
+            close = SCRIPT_CLOSE_RE.search(body, match.end())
+            if close is None:
+                return None
+            data = body[match.end():close.start()]
+            return data if data.strip() else None
+        start = body.find(POST_CONTENT_MARKER, start + len(POST_CONTENT_MARKER))
+    return None
+
+
+def _in_comment(body, pos):
+    opener = body.rfind(b'<!--', 0, pos)
+    if opener == -1:
+        return False
+    # <!--> and <!---> are complete (empty) comments
+    close = body.find(b'-->', opener + 2)
+    return close == -1 or close + 3 > pos
+
+
+def find_title(body):
+    """Return the page title as BeautifulSoup would, '' without one, or None if unsure."""
+    pos = 0
+    while True:
+        match = TITLE_SCAN_RE.search(body, pos)
+        if match is None:
+            return ''
+        name = (match.group(1) or match.group(2)).lower()
+        if name == b'title':
+            break
+        end_re = SKIPPED_END_RES.get(name)
+        # An <svg> may have a <title> of its own
+        end = end_re.search(body, match.end()) if end_re is not None else None
+        if end is None:
+            return None
+        pos = end.end()
+    match = TITLE_RE.match(body, match.start())
+    if match is None:
+        return None
+    title = match.group(1).decode('utf-8')
+    if '<' in title or '\r' in title or ENTITY_RE.search(title):
+        return None
+    return htmllib.unescape(title) if '&' in title else title
+
+
+def limit_labels(labels, limit=MAX_DIETARY_LABELS):
+    """Drop duplicate labels and keep at most ``limit``"""
+    unique = list(dict.fromkeys(labels))
+    return unique[:limit]
+
+
+def embedded_ingredients(groups):
+    ingredients = []
+    for ingredient_group in groups or ():
+        for ingredient in ingredient_group.get('ingredients', []):
+            quantity = ingredient.get('quantityText', '')
+            ingredient_text = ingredient.get('ingredientText', '')
+            note = ingredient.get('note', '')
+            full_ingredient = f"{quantity} {ingredient_text}".strip()
+            if note:
+                full_ingredient += f" ({note})"
+            ingredients.append(full_ingredient)
+    return ingredients
+
+
+def embedded_time(time_info):
+    # Seconds to minutes
+    return {
+        'prep': time_info.get('preparationMax', 0) // 60,
+        'cook': time_info.get('cookingMax', 0) // 60,
+        'total': time_info.get('total', 0) // 60,
+    }
+
+
+def embedded_instructions(steps):
+    instructions = []
+    for step in steps:
+        for content in step.get('content') or ():
+            if content.get('type') == 'html' and content.get('data', {}).get('value'):
+                value = content['data']['value']
+                # Clean HTML tags from instructions
+                if '<' in value:
+                    value = TAG_RE.sub('', value)
+                instructions.append(value.strip())
+    return '\n'.join(instructions)
+
+
+def embedded_nutrition(nutritions):
+    fitness_info = []
+    for nutrition in nutritions:
+        label = nutrition.get('label', '')
+        value = nutrition.get('value', '')
+        unit = nutrition.get('unit', '')
+        if label and value:
+            fitness_info.append(f"{label}: {value}{unit}")
+    return ', '.join(fitness_info)
+
+
+# Item field -> (__POST_CONTENT__ key, converter, default when the key is
+# missing; None leaves the field out), in item field order
+EMBEDDED_SCHEMA = {
+    'ingredients': ('ingredients', embedded_ingredients, list),
+    'time': ('cookAndPrepTime', embedded_time, dict),
+    'dietary_labels': ('diet', lambda diets: [diet.get('display', '') for diet in diets], list),
+    'difficulty': ('skillLevel', None, None),
+    'instructions': ('methodSteps', embedded_instructions, str),
+    'ratings': ('userRatings', lambda r: f"{r.get('avg', 0)}/5 ({r.get('total', 0)} ratings)", None),
+    'fitness_relevance': ('nutritions', embedded_nutrition, str),
+}
+
+
+def parse_embedded_json(recipe_data, item):
+    """Fill ``item`` from a site's embedded __POST_CONTENT__ JSON"""
+    for field, (key, convert, default) in EMBEDDED_SCHEMA.items():
+        if key in recipe_data:
+            value = recipe_data[key]
+            item[field] = convert(value) if convert else value
+        elif default is not None:
+            item[field] = default()
+    return item
+
+
+def parse_generic_html(soup, item):
+    """Parse generic HTML structure for recipe data"""
+
+    # Extract ingredients
+    ingredients = []
+    ingredient_selectors = [
+        '.ingredients li',
+        '.recipe-ingredients li',
+        '.ingredient-list li',
+        '[class*="ingredient"] li',
+        'ul li'  # Fallback to any list items
+    ]
+
+    for selector in ingredient_selectors:
+        ingredient_elements = soup.select(selector)
+        for elem in ingredient_elements:
+            ingredient_text = elem.get_text(strip=True)
+            if ingredient_text and len(ingredient_text) > 5:
+                ingredients.append(ingredient_text)
+        if ingredients:
+            break
+
+    item['ingredients'] = ingredients
+
+    # Extract instructions
+    instructions = []
+    instruction_selectors = [
+        '.instructions li',
+        '.recipe-instructions li',
+        '.method li',
+        '.steps li',
+        '[class*="instruction"] li',
+        'ol li'  # Fallback to ordered lists
+    ]
+
+    for selector in instruction_selectors:
+        instruction_elements = soup.select(selector)
+        for elem in instruction_elements:
+            instruction_text = elem.get_text(strip=True)
+            if instruction_text and len(instruction_text) > 10:
+                instructions.append(instruction_text)
+        if instructions:
+            break
+
+    item['instructions'] = '\n'.join(instructions)
+
+    # Extract cooking times
+    time_data = {}
+    time_selectors = [
+        '.prep-time',
+        '.cook-time',
+        '.total-time',
+        '.recipe-time',
+        '[class*="time"]'
+    ]
+
+    for selector in time_selectors:
+        time_elements = soup.select(selector)
+        for elem in time_elements:
+            text = elem.get_text(strip=True).lower()
+            if 'prep' in text:
+                time_data['prep'] = extract_time_minutes(text)
+            elif 'cook' in text:
+                time_data['cook'] = extract_time_minutes(text)
+            elif 'total' in text:
+                time_data['total'] = extract_time_minutes(text)
+
+    item['time'] = time_data
+
+    # Extract dietary labels
+    dietary_labels = []
+    dietary_selectors = [
+        '.dietary-labels',
+        '.recipe-tags',
+        '.tags',
+        '[class*="diet"]',
+        '[class*="tag"]'
+    ]
+
+    for selector in dietary_selectors:
+        dietary_elements = soup.select(selector)
+        for elem in dietary_elements:
+            labels = elem.get_text(strip=True).split(',')
+            for label in labels:
+                clean_label = label.strip()
+                if clean_label:
+                    dietary_labels.append(clean_label)
+
+    item['dietary_labels'] = dietary_labels
+
+    # Extract difficulty level
+    difficulty = ''
+    difficulty_selectors = [
+        '.difficulty',
+        '.skill-level',
+        '[class*="difficulty"]',
+        '[class*="skill"]'
+    ]
+
+    for selector in difficulty_selectors:
+        difficulty_elem = soup.select_one(selector)
+        if difficulty_elem:
+            difficulty = difficulty_elem.get_text(strip=True)
+            break
+
+    item['difficulty'] = difficulty
+
+    # Extract ratings
+    ratings = ''
+    rating_selectors = [
+        '.rating',
+        '.stars',
+        '[class*="rating"]'
+    ]
+
+    for selector in rating_selectors:
+        rating_elem = soup.select_one(selector)
+        if rating_elem:
+            ratings = rating_elem.get_text(strip=True)
+            break
+
+    item['ratings'] = ratings
+
+    # Extract nutrition info
+    nutrition_info = []
+    nutrition_selectors = [
+        '.nutrition',
+        '.nutrition-info',
+        '[class*="nutrition"]'
+    ]
+
+    for selector in nutrition_selectors:
+        nutrition_elements = soup.select(selector)
+        for elem in nutrition_elements:
+            nutrition_text = elem.get_text(strip=True)
+            if nutrition_text:
+                nutrition_info.append(nutrition_text)
+
+    item['fitness_relevance'] = ', '.join(nutrition_info)
+
+    return item
+
+
+def parse_recipetineats_html(soup, item):
+    """Parse RecipeTin Eats HTML structure"""
+
+    # Extract ingredients - RecipeTin Eats uses WPRM plugin
+    ingredients = []
+    ingredient_elements = soup.select('.wprm-recipe-ingredient')
+    for elem in ingredient_elements:
+        ingredient_text = elem.get_text(strip=True)
+        if ingredient_text and len(ingredient_text) > 5:  # Filter out empty or very short text
+            ingredients.append(ingredient_text)
+
+    # Fallback to other selectors if WPRM not found
+    if not ingredients:
+        ingredient_selectors = [
+            '[class*="ingredient"] li',
+            '.ingredients li',
+            '.recipe-ingredients li'
+        ]
+        for selector in ingredient_selectors:
+            ingredient_elements = soup.select(selector)
+            for elem in ingredient_elements:
+                ingredient_text = elem.get_text(strip=True)
+                if ingredient_text and len(ingredient_text) > 5:
+                    ingredients.append(ingredient_text)
+            if ingredients:
+                break
+
+    item['ingredients'] = ingredients
+
+    # Extract instructions - RecipeTin Eats uses WPRM plugin
+    instructions = []
+    instruction_elements = soup.select('.wprm-recipe-instruction')
+    for elem in instruction_elements:
+        instruction_text = elem.get_text(strip=True)
+        if instruction_text and len(instruction_text) > 10:  # Filter out very short text
+            instructions.append(instruction_text)
+
+    # Fallback to other selectors if WPRM not found
+    if not instructions:
+        instruction_selectors = [
+            '[class*="instruction"] li',
+            '.instructions li',
+            '.recipe-instructions li',
+            'ol li'  # Ordered lists for steps
+        ]
+        for selector in instruction_selectors:
+            instruction_elements = soup.select(selector)
+            for elem in instruction_elements:
+                instruction_text = elem.get_text(strip=True)
+                if instruction_text and len(instruction_text) > 10:
+                    instructions.append(instruction_text)
+            if instructions:
+                break
+
+    item['instructions'] = '\n'.join(instructions)
+
+    # Extract cooking times - RecipeTin Eats format
+    time_data = {}
+    time_elements = soup.select('[class*="time"]')
+    for elem in time_elements:
+        text = elem.get_text(strip=True).lower()
+        if 'prep' in text:
+            time_data['prep'] = extract_time_minutes(text)
+        elif 'cook' in text:
+            time_data['cook'] = extract_time_minutes(text)
+        elif 'total' in text:
+            time_data['total'] = extract_time_minutes(text)
+
+    item['time'] = time_data
+
+    # Extract dietary labels and tags
+    dietary_labels = []
+
+    # Look for recipe tags/categories
+    tag_selectors = [
+        '.wprm-recipe-tag',
+        '.recipe-tags',
+        '.tags',
+        '[class*="tag"]'
+    ]
+
+    for selector in tag_selectors:
+        tag_elements = soup.select(selector)
+        for elem in tag_elements:
+            tag_text = elem.get_text(strip=True)
+            if tag_text and len(tag_text) > 2:
+                dietary_labels.append(tag_text)
+
+    item['dietary_labels'] = dietary_labels
+
+    # Extract difficulty level
+    difficulty = ''
+    difficulty_selectors = [
+        '.wprm-recipe-difficulty',
+        '.difficulty',
+        '.skill-level'
+    ]
+
+    for selector in difficulty_selectors:
+        difficulty_elem = soup.select_one(selector)
+        if difficulty_elem:
+            difficulty = difficulty_elem.get_text(strip=True)
+            break
+
+    item['difficulty'] = difficulty
+
+    # Extract ratings
+    ratings = ''
+    rating_selectors = [
+        '.wprm-recipe-rating',
+        '.rating',
+        '.stars'
+    ]
+
+    for selector in rating_selectors:
+        rating_elem = soup.select_one(selector)
+        if rating_elem:
+            ratings = rating_elem.get_text(strip=True)
+            break
+
+    item['ratings'] = ratings
+
+    # Extract nutrition info
+    nutrition_info = []
+    nutrition_selectors = [
+        '.wprm-recipe-nutrition',
+        '.nutrition',
+        '.nutrition-info'
+    ]
+
+    for selector in nutrition_selectors:
+        nutrition_elements = soup.select(selector)
+        for elem in nutrition_elements:
+            nutrition_text = elem.get_text(strip=True)
+            if nutrition_text:
+                nutrition_info.append(nutrition_text)
+
+    item['fitness_relevance'] = ', '.join(nutrition_info)
+
+    return item
+
+
+def extract_time_minutes(text):
+    """Extract time in minutes from text"""
+    # Look for patterns like "15 minutes", "1 hour", "1h 30m", etc.
+    for pattern, unit in TIME_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            if unit is None:
+                # Handle "1h 30m" format
+                return int(match.group(1)) * 60 + int(match.group(2))
+            # Handle single time unit
+            return int(match.group(1)) * unit
+
+    return 0
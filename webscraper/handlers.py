@@ -0,0 +1,73 @@
+# Download handlers used by the transfer profiles in webscraper.addons
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/settings.html#download-handlers
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from twisted.web.client import HTTPConnectionPool
+
+
+class DomainConnectionPool(HTTPConnectionPool):
+    """HTTP/1.1 keep-alive pool with a per-host number of idle connections.
+
+    Twisted's pool keeps at most ``maxPersistentPerHost`` idle connections
+    for every host. Here the limit comes from ``sizes`` (hostname to size)
+    and falls back to ``default_size`` for hosts not listed.
+    """
+
+    def __init__(self, reactor, default_size, sizes=None, timeout=240):
+        super().__init__(reactor, persistent=True)
+        self.default_size = default_size
+        self.sizes = {host.lower(): size for host, size in (sizes or {}).items()}
+        self.maxPersistentPerHost = default_size
+        self.cachedConnectionTimeout = timeout
+
+    def size_for(self, key):
+        # Agent keys are (scheme, host, port), host as bytes
+        host = key[1].decode('ascii', 'ignore') if isinstance(key[1], bytes) else str(key[1])
+        return self.sizes.get(host.lower(), self.default_size)
+
+    def _putConnection(self, key, connection):
+        # The base class evicts the oldest idle connection at the limit
+        self.maxPersistentPerHost = self.size_for(key)
+        super()._putConnection(key, connection)
+
+
+class PooledHTTP11DownloadHandler(HTTP11DownloadHandler):
+    """HTTP/1.1 handler whose connection pool is sized per domain.
+
+    Scrapy sizes its pool with ``CONCURRENT_REQUESTS_PER_DOMAIN`` for every
+    host, so connections to busy hosts are closed and reopened whenever
+    their concurrency is raised through ``DOWNLOAD_SLOTS``. This handler
+    keeps as many idle connections to a host as requests it may send in
+    parallel, for ``TRANSFER_KEEPALIVE_TIMEOUT`` seconds.
+
+    Neither Scrapy nor Twisted has a public way to plug in a pool, so this
+    relies on the handler's ``_pool`` and the pool's ``_factory`` and
+    ``_putConnection``. requirements.txt caps Scrapy and Twisted at the
+    versions this was checked against, and tests/test_addons.py fails if
+    any of those names goes away.
+    """
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        from twisted.internet import reactor
+
+        # Take over the pool Scrapy just built: it holds no connections yet,
+        # and keeping its protocol factory keeps Scrapy's lenient parsing
+        scrapy_pool = self._pool
+
+        settings = crawler.settings
+        sizes = {
+            host: slot['concurrency']
+            for host, slot in settings.getdict('DOWNLOAD_SLOTS').items()
+            if 'concurrency' in slot
+        }
+        self._pool = DomainConnectionPool(
+            reactor,
+            default_size=settings.getint('TRANSFER_POOL_SIZE')
+            or settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'),
+            sizes=sizes,
+            timeout=settings.getint('TRANSFER_KEEPALIVE_TIMEOUT', 240),
+        )
+        self._pool._factory = scrapy_pool._factory
@@ -0,0 +1,464 @@
+"""
+Incremental inverted index over crawled recipes.
+
+Items are indexed as they arrive (see ``IndexPipeline``) into immutable
+segments of ``segment_size`` documents. Each segment file holds posting
+lists over normalized ingredient tokens and dietary labels, plus the
+total time of every document both by doc id and as a sorted array. Queries
+memory-map the segments and intersect postings in place, so nothing is
+loaded beyond the pages they touch.
+
+Usage::
+
+    python -m webscraper.index build INDEX_DIR output/recipes.jl
+    python -m webscraper.index query INDEX_DIR -i chicken -i lemon --max-time 30
+
+Index directory layout:
+
+    manifest.json   - segments, document count and log sizes (replaced atomically)
+    seg-NNNNN.idx   - one immutable segment
+    urls.txt        - document URLs, one per line, in doc id order
+    urls.idx        - byte offset of every URL in urls.txt (uint64)
+    deleted.bin     - doc ids superseded by a later version of the same URL
+
+Binary files use native byte order.
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+
+MAGIC = b'RIDX1\x00\x00\x00'
+HEADER = struct.Struct('=IIIII')  # first_doc, n_docs, n_terms, n_timed, blob_len
+TERM = struct.Struct('=III')      # term offset, postings offset, postings length
+NO_TIME = 0xFFFFFFFF
+
+UNITS = {
+    'cup', 'tbsp', 'tsp', 'tablespoon', 'teaspoon', 'g', 'gram', 'kg', 'ml',
+    'l', 'litre', 'liter', 'oz', 'ounce', 'lb', 'pound', 'pinch', 'dash',
+    'handful', 'can', 'tin', 'pack', 'packet', 'bunch', 'slice', 'piece',
+}
+STOPWORDS = {
+    'a', 'an', 'and', 'or', 'of', 'to', 'the', 'for', 'with', 'in', 'into',
+    'about', 'plus', 'extra', 'taste', 'optional', 'large', 'small', 'medium',
+}
+WORD_RE = re.compile(r"[a-z]+(?:-[a-z]+)*")
+PAREN_RE = re.compile(r'\([^)]*\)')
+
+
+def normalize_word(word):
+    """Fold simple English plurals so 'lemons' and 'lemon' share postings."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith('oes'):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def ingredient_tokens(text):
+    """Return the normalized tokens of one ingredient line."""
+    text = PAREN_RE.sub(' ', text.lower())
+    tokens = []
+    for word in WORD_RE.findall(text):
+        word = normalize_word(word)
+        if word in UNITS or word in STOPWORDS:
+            continue
+        tokens.append(word)
+    return tokens
+
+
+def diet_token(label):
+    return '-'.join(WORD_RE.findall(label.lower()))
+
+
+def item_terms(item):
+    """Return the set of index terms of ``item``."""
+    terms = set()
+    for line in item.get('ingredients') or ():
+        terms.update('i:' + token for token in ingredient_tokens(line))
+    for label in item.get('dietary_labels') or ():
+        token = diet_token(label)
+        if token:
+            terms.add('d:' + token)
+    return terms
+
+
+def item_total_time(item):
+    time_data = item.get('time') or {}
+    total = time_data.get('total') if isinstance(time_data, dict) else None
+    if not total and isinstance(time_data, dict):
+        total = (time_data.get('prep') or 0) + (time_data.get('cook') or 0)
+    return int(total) if total else None
+
+
+def _url_key(url):
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(path):
+        return {'segments': [], 'docs': 0, 'urls_bytes': 0, 'deleted': 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+class IndexBuilder:
+    """Append items to the index in ``directory``.
+
+    Documents are buffered and written out as a new segment every
+    ``segment_size`` items and on ``close()``. Re-adding a URL supersedes
+    its previous version. A crash loses at most the unflushed buffer:
+    anything past the sizes recorded in the manifest is truncated on open.
+    """
+
+    def __init__(self, directory, segment_size=10000):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = _read_manifest(directory)
+        self._truncate(
+            ('urls.txt', self.manifest['urls_bytes']),
+            ('urls.idx', self.manifest['docs'] * 8),
+            ('deleted.bin', self.manifest['deleted'] * 4),
+        )
+        self.url_docs = {}
+        path = os.path.join(directory, 'urls.txt')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for doc, line in enumerate(f):
+                    self.url_docs[_url_key(line.rstrip(b'\n').decode('utf-8'))] = doc
+        self.next_doc = self.manifest['docs']
+        self._reset()
+
+    def _truncate(self, *files):
+        for name, size in files:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _reset(self):
+        self.first_doc = self.next_doc
+        self.postings = {}
+        self.totals = []
+        self.urls = []
+        self.deleted = array('I')
+
+    def add(self, item):
+        url = item.get('url')
+        if not url:
+            return None
+        doc = self.next_doc
+        self.next_doc += 1
+        key = _url_key(url)
+        previous = self.url_docs.get(key)
+        if previous is not None:
+            self.deleted.append(previous)
+        self.url_docs[key] = doc
+        self.urls.append(url)
+        for term in item_terms(item):
+            self.postings.setdefault(term, array('I')).append(doc)
+        total = item_total_time(item)
+        self.totals.append(NO_TIME if total is None else total)
+        if len(self.urls) >= self.segment_size:
+            self.flush()
+        return doc
+
+    def flush(self):
+        """Write buffered documents as a new segment."""
+        if not self.urls:
+            return
+        name = 'seg-%05d.idx' % len(self.manifest['segments'])
+        write_segment(os.path.join(self.directory, name), self.first_doc,
+                      self.postings, self.totals)
+
+        encoded = [url.encode('utf-8') + b'\n' for url in self.urls]
+        offsets = array('Q')
+        position = self.manifest['urls_bytes']
+        for line in encoded:
+            offsets.append(position)
+            position += len(line)
+        with open(os.path.join(self.directory, 'urls.txt'), 'ab') as f:
+            f.write(b''.join(encoded))
+        with open(os.path.join(self.directory, 'urls.idx'), 'ab') as f:
+            offsets.tofile(f)
+        with open(os.path.join(self.directory, 'deleted.bin'), 'ab') as f:
+            self.deleted.tofile(f)
+
+        self.manifest = {
+            'segments': self.manifest['segments'] + [name],
+            'docs': self.next_doc,
+            'urls_bytes': position,
+            'deleted': self.manifest['deleted'] + len(self.deleted),
+        }
+        tmp = os.path.join(self.directory, 'manifest.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, 'manifest.json'))
+        self._reset()
+
+    def close(self):
+        self.flush()
+
+
+def write_segment(path, first_doc, postings, totals):
+    terms = sorted(postings)
+    blob = bytearray()
+    table = bytearray()
+    data = array('I')
+    for term in terms:
+        encoded = term.encode('utf-8')
+        table += TERM.pack(len(blob), len(data), len(postings[term]))
+        blob += encoded + b'\x00'
+        data.extend(postings[term])
+    blob += b'\x00' * (-len(blob) % 4)
+
+    by_doc = array('I', totals)
+    timed = sorted((total, first_doc + i) for i, total in enumerate(totals) if total != NO_TIME)
+    sorted_totals = array('I', (total for total, _ in timed))
+    sorted_docs = array('I', (doc for _, doc in timed))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(first_doc, len(totals), len(terms), len(timed), len(blob)))
+        f.write(table)
+        by_doc.tofile(f)
+        sorted_totals.tofile(f)
+        sorted_docs.tofile(f)
+        f.write(blob)
+        data.tofile(f)
+    os.replace(tmp, path)
+
+
+class Segment:
+    """A memory-mapped, read-only index segment."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._mmap)
+        if view[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an index segment')
+        position = len(MAGIC)
+        (self.first_doc, self.n_docs, self.n_terms,
+         n_timed, blob_len) = HEADER.unpack_from(view, position)
+        position += HEADER.size
+
+        def take(size):
+            nonlocal position
+            chunk = view[position:position + size]
+            position += size
+            return chunk
+
+        self._table = take(self.n_terms * TERM.size)
+        self.totals = take(self.n_docs * 4).cast('I')
+        self.sorted_totals = take(n_timed * 4).cast('I')
+        self.sorted_docs = take(n_timed * 4).cast('I')
+        self._blob_start = position
+        self._blob = take(blob_len)
+        self._postings = view[position:].cast('I')
+
+    def _term(self, i):
+        start = self._blob_start + TERM.unpack_from(self._table, i * TERM.size)[0]
+        return self._mmap[start:self._mmap.find(b'\x00', start)]
+
+    def postings(self, term):
+        """Return the sorted doc ids of ``term`` as a memoryview (empty if absent)."""
+        encoded = term.encode('utf-8')
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and self._term(lo) == encoded:
+            _, offset, length = TERM.unpack_from(self._table, lo * TERM.size)
+            return self._postings[offset:offset + length]
+        return self._postings[:0]
+
+    def time_range(self, min_time=None, max_time=None):
+        """Return the doc ids whose total time lies in [min_time, max_time]."""
+        lo = 0 if min_time is None else bisect.bisect_left(self.sorted_totals, min_time)
+        hi = len(self.sorted_totals) if max_time is None else bisect.bisect_right(self.sorted_totals, max_time)
+        return self.sorted_docs[lo:hi]
+
+    def close(self):
+        for name in ('_table', 'totals', 'sorted_totals', 'sorted_docs', '_blob', '_postings', '_view'):
+            getattr(self, name).release()
+        self._mmap.close()
+
+
+def intersect(lists):
+    """Intersect sorted doc id sequences, probing the larger ones by bisection."""
+    lists = sorted(lists, key=len)
+    result = list(lists[0])
+    for other in lists[1:]:
+        kept = []
+        lo = 0
+        for doc in result:
+            lo = bisect.bisect_left(other, doc, lo)
+            if lo == len(other):
+                break
+            if other[lo] == doc:
+                kept.append(doc)
+        result = kept
+        if not result:
+            break
+    return result
+
+
+class RecipeIndex:
+    """Query an index directory written by ``IndexBuilder``."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        manifest = _read_manifest(directory)
+        self.docs = manifest['docs']
+        self.segments = [Segment(os.path.join(directory, name)) for name in manifest['segments']]
+        deleted = array('I')
+        path = os.path.join(directory, 'deleted.bin')
+        if manifest['deleted']:
+            with open(path, 'rb') as f:
+                deleted.fromfile(f, manifest['deleted'])
+        self.deleted = set(deleted)
+        self._urls = self._url_offsets = None
+        if self.docs:
+            with open(os.path.join(directory, 'urls.txt'), 'rb') as f:
+                self._urls = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(os.path.join(directory, 'urls.idx'), 'rb') as f:
+                self._url_offsets_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._url_offsets = memoryview(self._url_offsets_map)[:self.docs * 8].cast('Q')
+
+    def url(self, doc):
+        start = self._url_offsets[doc]
+        end = self._urls.find(b'\n', start)
+        return self._urls[start:end].decode('utf-8')
+
+    def search(self, ingredients=(), diets=(), min_time=None, max_time=None, limit=None):
+        """Return the URLs of recipes matching every ingredient and diet.
+
+        ``min_time``/``max_time`` filter on the total time in minutes;
+        recipes without a known total time never match a time filter.
+        Raises ValueError for an ingredient or diet with nothing to search
+        for (only units or stopwords, such as ``cups`` or ``of``).
+        """
+        terms = []
+        for text in ingredients:
+            tokens = ingredient_tokens(text)
+            if not tokens:
+                raise ValueError(f'ingredient {text!r} has no searchable words')
+            terms += ['i:' + token for token in tokens]
+        for label in diets:
+            token = diet_token(label)
+            if not token:
+                raise ValueError(f'diet {label!r} has no searchable words')
+            terms.append('d:' + token)
+        timed = min_time is not None or max_time is not None
+        urls = []
+        for segment in self.segments:
+            if terms:
+                docs = intersect([segment.postings(term) for term in terms])
+                if timed:
+                    low = -1 if min_time is None else min_time
+                    high = NO_TIME - 1 if max_time is None else max_time
+                    first = segment.first_doc
+                    docs = [doc for doc in docs
+                            if low <= segment.totals[doc - first] <= high]
+            elif timed:
+                docs = sorted(segment.time_range(min_time, max_time))
+            else:
+                docs = range(segment.first_doc, segment.first_doc + segment.n_docs)
+            for doc in docs:
+                if doc in self.deleted:
+                    continue
+                urls.append(self.url(doc))
+                if limit is not None and len(urls) >= limit:
+                    return urls
+        return urls
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        if self._urls is not None:
+            self._url_offsets.release()
+            self._url_offsets_map.close()
+            self._urls.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_export(path):
+    """Yield items from a JSON lines export, or a JSON array export."""
+    with open(path, encoding='utf-8') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            yield from json.load(f)
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m webscraper.index',
+                                     description='Build and query the recipe index.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='add an exported feed to the index')
+    build.add_argument('directory')
+    build.add_argument('export', nargs='+', help='JSON lines (or JSON array) export')
+    build.add_argument('--segment-size', type=int, default=10000)
+
+    query = commands.add_parser('query', help='find recipes')
+    query.add_argument('directory')
+    query.add_argument('-i', '--ingredient', action='append', default=[])
+    query.add_argument('-d', '--diet', action='append', default=[])
+    query.add_argument('--min-time', type=int)
+    query.add_argument('--max-time', type=int)
+    query.add_argument('--limit', type=int)
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        builder = IndexBuilder(args.directory, segment_size=args.segment_size)
+        added = 0
+        for path in args.export:
+            for item in iter_export(path):
+                if builder.add(item) is not None:
+                    added += 1
+        builder.close()
+        print(f'Indexed {added} recipes into {args.directory}', file=sys.stderr)
+        return 0
+
+    with RecipeIndex(args.directory) as index:
+        try:
+            urls = index.search(args.ingredient, args.diet, args.min_time,
+                                args.max_time, args.limit)
+        except ValueError as e:
+            parser.error(str(e))
+        for url in urls:
+            print(url)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
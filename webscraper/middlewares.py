@@ -3,11 +3,22 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import logging
+import posixpath
+import time
+from collections import Counter, defaultdict, deque
+from urllib.parse import urlparse
+
 from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured, StopDownload
+from scrapy.http.request import NO_CALLBACK
+from twisted.internet import task
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+logger = logging.getLogger(__name__)
+
 
 class WebscraperSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -54,47 +65,413 @@ class WebscraperSpiderMiddleware:
 
 
 class WebscraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """Reject non-HTML and oversized responses as soon as their headers arrive.
+
+    On ``headers_received`` the Content-Type is checked against
+    ``EARLY_ABORT_CONTENT_TYPES`` and the Content-Length against
+    ``EARLY_ABORT_MAXSIZE``; a rejected response has its body download
+    cancelled and its request is dropped with ``IgnoreRequest``, so the
+    spider never sees it. Responses without these headers are let through
+    (``DOWNLOAD_MAXSIZE`` still applies to those).
+
+    Rules are also learned per domain: a file extension, or a last path
+    segment without one, that has returned ``EARLY_ABORT_LEARN_THRESHOLD``
+    non-HTML responses and never an HTML one is not requested again.
+    Script and page extensions (``.php``, ``.html``, ...) serve pages and
+    assets alike, so for those the whole file name is learned instead.
+    Directories are not learned, as assets and recipes often share one. Set
+    ``dont_abort_early`` in a request's meta to opt out; requests without
+    a spider callback (such as robots.txt) are never rejected.
+
+    Bandwidth saved is the Content-Length of rejected responses, plus the
+    average rejected size for requests skipped by a rule. Time saved is
+    estimated from the body transfer rate measured on accepted responses
+    of at least 64 KiB, plus the average time to headers for requests skipped by a rule.
+    """
+
+    HTML_TYPES = ['text/html', 'application/xhtml+xml']
+    RATE_MIN_SIZE = 64 * 1024
+    # A skipped request is never fetched, so no HTML response could undo a
+    # rule on one of these
+    PAGE_EXTENSIONS = {'.asp', '.aspx', '.cfm', '.cgi', '.htm', '.html', '.jsp', '.php', '.pl',
+                       '.shtml', '.xhtml'}
+
+    def __init__(self, stats, content_types=None, maxsize=5 * 1024 * 1024, learn_threshold=3):
+        self.stats = stats
+        self.content_types = {t.lower() for t in (content_types or self.HTML_TYPES)}
+        self.maxsize = maxsize
+        self.learn_threshold = learn_threshold
+        # host -> Counter of path keys that returned non-HTML / set of keys that returned HTML
+        self.rejections = defaultdict(Counter)
+        self.html_keys = defaultdict(set)
+        self.rules = defaultdict(set)
+        self.rejected_bytes = self.rejected_sized = 0
+        self.abort_seconds = self.aborts = 0
+        self.received_bytes = 0
+        self.received_seconds = 0.0
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        if not settings.getbool('EARLY_ABORT_ENABLED'):
+            raise NotConfigured
+        s = cls(
+            crawler.stats,
+            content_types=settings.getlist('EARLY_ABORT_CONTENT_TYPES') or None,
+            maxsize=settings.getint('EARLY_ABORT_MAXSIZE', 5 * 1024 * 1024),
+            learn_threshold=settings.getint('EARLY_ABORT_LEARN_THRESHOLD', 3),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.headers_received, signal=signals.headers_received)
         return s
 
-    def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
+    def process_request(self, request, spider=None):
+        if not self._applies(request):
+            return None
+        host, keys = self._path_keys(request.url)
+        learned = self.rules[host].intersection(keys)
+        if not learned:
+            return None
+        self.stats.inc_value('early_abort/learned_skips')
+        if self.rejected_sized:
+            self._count_saved(self.rejected_bytes / self.rejected_sized)
+        if self.aborts:
+            self._count_time(self.abort_seconds / self.aborts)
+        raise IgnoreRequest(f'{request.url} matches learned non-HTML rule {sorted(learned)[0]}')
 
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
-
-    def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
+    def headers_received(self, headers, body_length, request, spider=None):
+        if not self._applies(request):
+            return
+        content_type = self._content_type(headers)
+        length = body_length if isinstance(body_length, int) and body_length >= 0 else None
+        if content_type and content_type not in self.content_types:
+            reason = 'content_type'
+            self._learn(request.url)
+        elif length is not None and self.maxsize and length > self.maxsize:
+            reason = 'too_large'
+        else:
+            request.meta['early_abort_headers'] = time.monotonic()
+            return
+        request.meta['early_abort'] = reason
+        self.stats.inc_value(f'early_abort/{reason}')
+        # Requests queued in the downloader before a rule was learned end up here too
+        if length is not None:
+            self._count_saved(length)
+            if reason == 'content_type':
+                self.rejected_bytes += length
+                self.rejected_sized += 1
+        raise StopDownload(fail=True)
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+    def process_response(self, request, response, spider=None):
+        if not self._applies(request) or 'early_abort' in request.meta:
+            return response
+        headers_time = request.meta.get('early_abort_headers')
+        # Small bodies arrive with the headers and say nothing about bandwidth
+        if headers_time is not None and len(response.body) >= self.RATE_MIN_SIZE:
+            self.received_bytes += len(response.body)
+            self.received_seconds += time.monotonic() - headers_time
+        content_type = self._content_type(response.headers)
+        if not content_type or content_type in self.content_types:
+            host, keys = self._path_keys(request.url)
+            self.html_keys[host].update(keys)
+            # An HTML page arriving after a rule was learned disproves it
+            self.rules[host].difference_update(keys)
         return response
 
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+    def process_exception(self, request, exception, spider=None):
+        reason = request.meta.get('early_abort')
+        if reason is None or not isinstance(exception, StopDownload):
+            return None
+        # download_latency is the time until the headers arrived
+        self.abort_seconds += request.meta.get('download_latency', 0)
+        self.aborts += 1
+        raise IgnoreRequest(f'{request.url} rejected on headers ({reason})')
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+    @staticmethod
+    def _content_type(headers):
+        return headers.get(b'Content-Type', b'').split(b';')[0].strip().lower().decode('latin-1')
+
+    def _applies(self, request):
+        return request.callback is not NO_CALLBACK and not request.meta.get('dont_abort_early')
+
+    @classmethod
+    def _path_keys(cls, url):
+        """Return the host of ``url`` and the path keys rules are learned on."""
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        name = posixpath.basename(path.rstrip('/'))
+        extension = posixpath.splitext(name)[1].lower()
+        keys = set()
+        if extension and extension not in cls.PAGE_EXTENSIONS:
+            keys.add(('ext', extension))
+        elif name:
+            keys.add(('name', name.lower()))
+        return (parsed.hostname or '').lower(), keys
+
+    def _learn(self, url):
+        host, keys = self._path_keys(url)
+        counts = self.rejections[host]
+        for key in keys:
+            counts[key] += 1
+            if counts[key] >= self.learn_threshold and key not in self.html_keys[host] \
+                    and key not in self.rules[host]:
+                self.rules[host].add(key)
+                self.stats.inc_value('early_abort/rules')
+
+    def _count_saved(self, size):
+        self.stats.inc_value('early_abort/bytes_saved', int(size))
+        if self.received_seconds:
+            self._count_time(size / (self.received_bytes / self.received_seconds))
+
+    def _count_time(self, seconds):
+        saved = self.stats.get_value('early_abort/time_saved_ms', 0)
+        self.stats.set_value('early_abort/time_saved_ms', round(saved + seconds * 1000, 1))
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class _Domain:
+    """Circuit breaker state of one domain."""
+
+    def __init__(self, tokens):
+        self.state = 'closed'
+        self.failures = 0       # consecutive, while closed
+        self.trips = 0          # opens since the domain last recovered
+        self.open_until = 0.0
+        self.probe_deadline = None
+        self.parked = deque()
+        self.tokens = tokens    # retry budget
+
+
+class DomainCircuitBreaker:
+    """Per-domain retry budget and circuit breaker.
+
+    A domain whose requests fail ``CIRCUIT_BREAKER_THRESHOLD`` times in a
+    row (exceptions, or a status in ``CIRCUIT_BREAKER_HTTP_CODES``, which
+    defaults to ``RETRY_HTTP_CODES``) is opened for
+    ``CIRCUIT_BREAKER_BACKOFF`` seconds, doubling on each consecutive trip
+    up to ``CIRCUIT_BREAKER_MAX_BACKOFF`` (or longer if a Retry-After header
+    asks for it). Requests for an open domain are parked instead of sent,
+    which frees their concurrency slot for other domains. When the backoff
+    ends, the breaker is half-open and one parked request goes out as a probe.
+    A successful probe closes the breaker and releases every parked request
+    back to the scheduler. A failed probe opens the breaker again. After
+    ``CIRCUIT_BREAKER_MAX_TRIPS`` consecutive trips the domain is given up.
+
+    Retries also come out of a per-domain budget: every first attempt adds
+    ``CIRCUIT_BREAKER_RETRY_RATIO`` of a retry, up to
+    ``CIRCUIT_BREAKER_RETRY_BURST``. A retry finding the budget empty is
+    dropped.
+
+    Sits closer to the downloader than RetryMiddleware (order above 550),
+    so its ``process_response`` runs before RetryMiddleware's and every
+    attempt is counted before it is retried. Requests without a spider callback (such as
+    robots.txt) and those with ``dont_break_circuit`` in their meta are
+    exempt.
+    """
+
+    def __init__(self, stats, schedule=None, clock=time.monotonic, threshold=5, backoff=5.0,
+                 max_backoff=300.0, max_trips=8, max_parked=10000, http_codes=(500, 502, 503, 504),
+                 retry_ratio=0.2, retry_burst=10.0):
+        self.stats = stats
+        self.schedule = schedule
+        self.clock = clock
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_trips = max_trips
+        self.max_parked = max_parked
+        self.http_codes = set(http_codes)
+        self.retry_ratio = retry_ratio
+        self.retry_burst = retry_burst
+        self.domains = {}
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CIRCUIT_BREAKER_ENABLED'):
+            raise NotConfigured
+        s = cls(
+            crawler.stats,
+            schedule=lambda request: crawler.engine.crawl(request),
+            threshold=settings.getint('CIRCUIT_BREAKER_THRESHOLD', 5),
+            backoff=settings.getfloat('CIRCUIT_BREAKER_BACKOFF', 5.0),
+            max_backoff=settings.getfloat('CIRCUIT_BREAKER_MAX_BACKOFF', 300.0),
+            max_trips=settings.getint('CIRCUIT_BREAKER_MAX_TRIPS', 8),
+            max_parked=settings.getint('CIRCUIT_BREAKER_MAX_PARKED', 10000),
+            http_codes=[int(code) for code in (settings.getlist('CIRCUIT_BREAKER_HTTP_CODES')
+                                               or settings.getlist('RETRY_HTTP_CODES'))],
+            retry_ratio=settings.getfloat('CIRCUIT_BREAKER_RETRY_RATIO', 0.2),
+            retry_burst=settings.getfloat('CIRCUIT_BREAKER_RETRY_BURST', 10.0),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider=None):
+        if not self._applies(request):
+            return None
+        self.release_due()
+        host = self._host(request)
+        domain = self._domain(host)
+        if domain.state == 'abandoned':
+            self.stats.inc_value('circuit_breaker/dropped')
+            raise IgnoreRequest(f'{host} has been given up on after repeated failures')
+        if domain.state == 'open':
+            self._park(domain, host, request)
+        if domain.state == 'half_open' and not request.meta.get('circuit_breaker_probe'):
+            deadline = domain.probe_deadline
+            if deadline is not None and self.clock() < deadline:
+                self._park(domain, host, request)
+            # Nothing parked to probe with (or the probe got lost): this request probes
+            request.meta['circuit_breaker_probe'] = True
+            domain.probe_deadline = self.clock() + self.max_backoff
+
+        if request.meta.get('retry_times'):
+            if domain.tokens < 1:
+                self.stats.inc_value('circuit_breaker/retries_denied')
+                raise IgnoreRequest(f'Retry budget of {host} exhausted, not retrying {request.url}')
+            domain.tokens -= 1
+        else:
+            domain.tokens = min(self.retry_burst, domain.tokens + self.retry_ratio)
+        return None
+
+    def process_response(self, request, response, spider=None):
+        if not self._applies(request):
+            return response
+        if response.status in self.http_codes:
+            self._failure(request, self._retry_after(response))
+        else:
+            self._success(request)
+        return response
+
+    def process_exception(self, request, exception, spider=None):
+        if not self._applies(request):
+            return None
+        if isinstance(exception, StopDownload):
+            # Stopped on purpose once the response started: the server answered
+            self._success(request)
+        elif isinstance(exception, IgnoreRequest):
+            if request.meta.pop('circuit_breaker_probe', False):
+                # A probe dropped before it was sent: let the next request probe
+                self._domain(self._host(request)).probe_deadline = None
+        else:
+            self._failure(request)
+        return None
+
+    def release_due(self):
+        """Half-open every domain whose backoff has ended, sending out a probe."""
+        now = self.clock()
+        for host, domain in self.domains.items():
+            if domain.state == 'open' and now >= domain.open_until:
+                self._set_state(host, domain, 'half_open')
+                domain.probe_deadline = None
+                if domain.parked:
+                    domain.probe_deadline = now + self.max_backoff
+                    request = domain.parked.popleft()
+                    request.meta['circuit_breaker_probe'] = True
+                    self._release(request)
+
+    def _failure(self, request, retry_after=None):
+        host = self._host(request)
+        domain = self._domain(host)
+        probe = request.meta.pop('circuit_breaker_probe', False)
+        self.stats.inc_value('circuit_breaker/wasted_requests')
+        if request.meta.get('retry_times'):
+            self.stats.inc_value('circuit_breaker/wasted_retries')
+        if domain.state == 'closed':
+            domain.failures += 1
+            if domain.failures >= self.threshold:
+                self._open(host, domain, retry_after)
+        elif domain.state == 'half_open' and probe:
+            self._open(host, domain, retry_after)
+
+    def _success(self, request):
+        host = self._host(request)
+        domain = self._domain(host)
+        probe = request.meta.pop('circuit_breaker_probe', False)
+        if domain.state == 'closed':
+            domain.failures = 0
+        elif domain.state == 'half_open' and probe:
+            self._set_state(host, domain, 'closed')
+            domain.failures = domain.trips = 0
+            logger.info("Circuit for %s closed, releasing %d parked requests", host, len(domain.parked))
+            while domain.parked:
+                self._release(domain.parked.popleft())
+
+    def _open(self, host, domain, retry_after=None):
+        domain.trips += 1
+        if domain.trips > self.max_trips:
+            self._set_state(host, domain, 'abandoned')
+            self.stats.inc_value('circuit_breaker/dropped', len(domain.parked))
+            logger.warning("Giving up on %s after %d circuit breaker trips, dropping %d parked requests",
+                           host, self.max_trips, len(domain.parked))
+            domain.parked.clear()
+            return
+        backoff = self.backoff * 2 ** (domain.trips - 1)
+        if retry_after:
+            backoff = max(backoff, retry_after)
+        backoff = min(backoff, self.max_backoff)
+        domain.open_until = self.clock() + backoff
+        self._set_state(host, domain, 'open')
+        self.stats.inc_value('circuit_breaker/opened')
+        logger.info("Circuit for %s opened for %.1fs (trip %d)", host, backoff, domain.trips)
+
+    def _park(self, domain, host, request):
+        if len(domain.parked) >= self.max_parked:
+            self.stats.inc_value('circuit_breaker/dropped')
+            raise IgnoreRequest(f'Circuit for {host} is open and its parking is full')
+        domain.parked.append(request)
+        self.stats.inc_value('circuit_breaker/parked')
+        raise IgnoreRequest(f'Circuit for {host} is open, parked {request.url}')
+
+    def _release(self, request):
+        self.stats.inc_value('circuit_breaker/released')
+        # Already seen by the dupefilter when first scheduled
+        self.schedule(request.replace(dont_filter=True))
+
+    def _set_state(self, host, domain, state):
+        domain.state = state
+        self.stats.set_value(f'circuit_breaker/state/{host}', state)
+        self.stats.set_value('circuit_breaker/open_domains', sum(
+            1 for d in self.domains.values() if d.state in ('open', 'half_open')))
+
+    def _domain(self, host):
+        domain = self.domains.get(host)
+        if domain is None:
+            domain = self.domains[host] = _Domain(self.retry_burst)
+        return domain
+
+    @staticmethod
+    def _host(request):
+        return (urlparse(request.url).hostname or '').lower()
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get(b'Retry-After', b'').strip()
+        # Only the delay-seconds form; HTTP dates are rare for rate limits
+        return float(value) if value.isdigit() else None
+
+    def _applies(self, request):
+        return request.callback is not NO_CALLBACK and not request.meta.get('dont_break_circuit')
+
+    def spider_opened(self, spider):
+        self._loop = task.LoopingCall(self.release_due)
+        self._loop.start(min(1.0, self.backoff / 2), now=False)
+
+    def spider_idle(self, spider):
+        self.release_due()
+        if any(domain.parked for domain in self.domains.values()):
+            # Parked requests go back to the scheduler when their breaker closes
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        parked = sum(len(domain.parked) for domain in self.domains.values())
+        if parked:
+            self.stats.set_value('circuit_breaker/parked_at_close', parked)
+            logger.warning("%d parked requests were not sent before the spider closed", parked)
@@ -3,11 +3,442 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.misc import load_object
+from twisted.internet.defer import Deferred
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from webscraper.checkpoint import checkpoint_snapshot
+from webscraper.index import IndexBuilder
+
+logger = logging.getLogger(__name__)
+
 
 class WebscraperPipeline:
     def process_item(self, item, spider):
         return item
+
+
+RECIPE_COLUMNS = [
+    'url', 'title', 'ingredients', 'time', 'dietary_labels',
+    'fitness_relevance', 'difficulty', 'instructions', 'ratings',
+]
+
+# DB-API paramstyles; named and pyformat bind rows as dicts
+PARAMSTYLES = ('qmark', 'numeric', 'named', 'format', 'pyformat')
+
+_CLOSE = object()
+
+
+class DatabasePipeline:
+    """Upsert items into a database table keyed on URL.
+
+    Rows are written by a dedicated thread in batches of ``batch_size``
+    with one ``executemany`` and one transaction per batch. The thread is
+    fed through a bounded queue: when it is full, ``process_item`` returns
+    a Deferred that fires once the row is queued, so Scrapy stops pulling
+    new items instead of the reactor blocking on the database. Waiting rows
+    are queued in arrival order as the writer makes room, so a later
+    version of a URL is never written before an earlier one.
+
+    Any DB-API connection works: ``DATABASE_CONNECT`` names a callable
+    returning one, otherwise ``DATABASE_PATH`` opens a SQLite file. The
+    target must support ``INSERT ... ON CONFLICT (url) DO UPDATE`` (SQLite
+    3.24+, PostgreSQL).
+    """
+
+    def __init__(self, connect, table='recipes', batch_size=500, queue_size=5000,
+                 paramstyle='qmark', stats=None):
+        self.connect = connect
+        self.table = table
+        self.batch_size = batch_size
+        if paramstyle not in PARAMSTYLES:
+            raise ValueError(f'Unsupported DATABASE_PARAMSTYLE {paramstyle!r}, '
+                             f'expected one of {", ".join(PARAMSTYLES)}')
+        self.paramstyle = paramstyle
+        self.stats = stats
+        self.queue = queue.Queue(maxsize=queue_size)
+        # (row, Deferred) pairs waiting for room in the queue
+        self.waiting = deque()
+        self.call_in_reactor = None
+        self.thread = None
+        self.error = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if settings.get('DATABASE_CONNECT'):
+            connect = load_object(settings.get('DATABASE_CONNECT'))
+        elif settings.get('DATABASE_PATH'):
+            path = settings.get('DATABASE_PATH')
+            connect = lambda: sqlite3.connect(path)
+        else:
+            raise NotConfigured
+        return cls(
+            connect,
+            table=settings.get('DATABASE_TABLE', 'recipes'),
+            batch_size=settings.getint('DATABASE_BATCH_SIZE', 500),
+            queue_size=settings.getint('DATABASE_QUEUE_SIZE', 5000),
+            paramstyle=settings.get('DATABASE_PARAMSTYLE', 'qmark'),
+            stats=crawler.stats,
+        )
+
+    def create_table_sql(self):
+        columns = ', '.join(
+            f'"{name}" TEXT PRIMARY KEY' if name == 'url' else f'"{name}" TEXT'
+            for name in RECIPE_COLUMNS
+        )
+        return f'CREATE TABLE IF NOT EXISTS "{self.table}" ({columns})'
+
+    def upsert_sql(self):
+        names = ', '.join(f'"{name}"' for name in RECIPE_COLUMNS)
+        markers = ', '.join({
+            'qmark': '?',
+            'numeric': f':{i}',
+            'named': f':{name}',
+            'format': '%s',
+            'pyformat': f'%({name})s',
+        }[self.paramstyle] for i, name in enumerate(RECIPE_COLUMNS, 1))
+        updates = ', '.join(
+            f'"{name}" = excluded."{name}"' for name in RECIPE_COLUMNS if name != 'url'
+        )
+        return (
+            f'INSERT INTO "{self.table}" ({names}) VALUES ({markers}) '
+            f'ON CONFLICT ("url") DO UPDATE SET {updates}'
+        )
+
+    @staticmethod
+    def row(item):
+        """Return the column values of ``item``; lists and dicts are stored as JSON."""
+        adapter = ItemAdapter(item)
+        values = []
+        for name in RECIPE_COLUMNS:
+            value = adapter.get(name)
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value, ensure_ascii=False)
+            values.append(value)
+        return tuple(values)
+
+    def open_spider(self, spider):
+        from twisted.internet import reactor
+        self.call_in_reactor = reactor.callFromThread
+        self.thread = threading.Thread(target=self._writer, name='DatabasePipeline', daemon=True)
+        self.thread.start()
+
+    def close_spider(self, spider):
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        if self.error is not None:
+            spider.logger.error("Database writer stopped: %s" % self.error)
+
+    def process_item(self, item, spider):
+        row = self.row(item)
+        if not self.waiting:
+            try:
+                self.queue.put_nowait(row)
+                return item
+            except queue.Full:
+                pass
+        # Wait in the reactor rather than in a pool thread; rows behind a
+        # waiting row wait too, so they reach the database in order
+        self._inc_stat('database/backpressure')
+        d = Deferred()
+        self.waiting.append((row, d))
+        return d.addCallback(lambda _: item)
+
+    def _release(self):
+        # In the reactor thread: move waiting rows into the queue while it has room
+        while self.waiting:
+            row, d = self.waiting[0]
+            try:
+                self.queue.put_nowait(row)
+            except queue.Full:
+                return
+            self.waiting.popleft()
+            d.callback(None)
+
+    def _made_room(self):
+        # Called by the writer after every batch it takes, whether or not rows
+        # are waiting: checking from this thread could miss one just added
+        if self.call_in_reactor is not None:
+            self.call_in_reactor(self._release)
+
+    def _writer(self):
+        conn = None
+        sql = self.upsert_sql()
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute(self.create_table_sql())
+            conn.commit()
+            closing = False
+            while not closing:
+                # Block for the first row, then take whatever else is queued
+                first = self.queue.get()
+                batch = []
+                if first is _CLOSE:
+                    closing = True
+                else:
+                    batch.append(first)
+                while len(batch) < self.batch_size and not closing:
+                    try:
+                        row = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if row is _CLOSE:
+                        closing = True
+                    else:
+                        batch.append(row)
+                self._made_room()
+                if batch:
+                    if self.paramstyle in ('named', 'pyformat'):
+                        batch = [dict(zip(RECIPE_COLUMNS, row)) for row in batch]
+                    self._write_batch(conn, cursor, sql, batch)
+        except Exception as e:
+            self.error = e
+            logger.exception("Database writer failed")
+            # Keep draining so producers never block on a dead writer
+            while self.queue.get() is not _CLOSE:
+                self._made_room()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _write_batch(self, conn, cursor, sql, batch):
+        try:
+            cursor.executemany(sql, batch)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Failed to write a batch of %d rows", len(batch))
+            self._inc_stat('database/failed_batches')
+            return
+        self._inc_stat('database/batches')
+        self._inc_stat('database/rows', len(batch))
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+
+class IndexPipeline:
+    """Add every item to the ingredient/diet/time index in ``INDEX_DIR``.
+
+    See ``webscraper.index`` for the format and the query CLI.
+    """
+
+    def __init__(self, directory, segment_size=10000):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.builder = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('INDEX_DIR')
+        if not directory:
+            raise NotConfigured
+        return cls(directory, segment_size=crawler.settings.getint('INDEX_SEGMENT_SIZE', 10000))
+
+    def open_spider(self, spider):
+        self.builder = IndexBuilder(self.directory, segment_size=self.segment_size)
+
+    def close_spider(self, spider):
+        self.builder.close()
+
+    def process_item(self, item, spider):
+        self.builder.add(ItemAdapter(item))
+        return item
+
+
+class ChangeFeedPipeline:
+    """Write a change stream against the previous crawl instead of a full export.
+
+    ``CHANGEFEED_DIR`` holds ``state.db``, a compact per-URL digest of the
+    item fields (8 bytes per field), and the files of every crawl:
+
+    - ``changes-<timestamp>.jl``: one JSON line per ``added`` item (with the
+      full item), ``changed`` item (with only the changed fields, as
+      ``{"field": new_value}``) and ``removed`` URL.
+    - ``tombstones-<timestamp>.txt``: the removed URLs, one per line.
+
+    A URL is removed when a crawl of its host finishes normally without
+    having scraped it since the previous finished crawl of that host, so
+    crawls of different sites can share a directory. A crawl that is
+    interrupted still publishes its changes but reports no removals; its
+    digests count towards the next crawl that finishes, so a crawl resumed
+    from a checkpoint does not report the pages of the interrupted part as
+    removed. Changes are flushed and the state committed every
+    ``CHANGEFEED_COMMIT_EVERY`` items and on every checkpoint snapshot, so
+    a page the checkpoint counts as done always has its digest stored.
+    Files left as ``.part`` by a crash are published on the next start
+    (records written after the last commit are emitted again by the next
+    crawl).
+
+    With ``CHANGEFEED_DROP_UNCHANGED`` unchanged items are dropped (after
+    the database and index pipelines), so feed exports shrink to the
+    changed items as well.
+    """
+
+    FIELDS = [name for name in RECIPE_COLUMNS if name != 'url']
+
+    def __init__(self, directory, drop_unchanged=False, commit_every=1000, stats=None):
+        self.directory = directory
+        self.drop_unchanged = drop_unchanged
+        self.commit_every = commit_every
+        self.stats = stats
+        self.db = None
+        self.run = None
+        self.hosts = set()
+        self.last_finished = 0
+        self.stored_fields = None
+        self.changes = None
+        self.paths = {}
+        self._uncommitted = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        directory = settings.get('CHANGEFEED_DIR')
+        if not directory:
+            raise NotConfigured
+        pipeline = cls(
+            directory,
+            drop_unchanged=settings.getbool('CHANGEFEED_DROP_UNCHANGED'),
+            commit_every=settings.getint('CHANGEFEED_COMMIT_EVERY', 1000),
+            stats=crawler.stats,
+        )
+        # close_spider() runs before the close reason is known
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.checkpoint_snapshot, signal=checkpoint_snapshot)
+        return pipeline
+
+    @staticmethod
+    def field_digest(value):
+        data = json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        return hashlib.blake2b(data, digest_size=8).digest()
+
+    def digest(self, adapter):
+        return b''.join(self.field_digest(adapter.get(name)) for name in self.FIELDS)
+
+    def open_spider(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('changes-') and name.endswith('.part'):
+                os.replace(path, path[:-len('.part')])
+            elif name.startswith('tombstones-') and name.endswith('.part'):
+                os.remove(path)
+
+        self.db = sqlite3.connect(os.path.join(self.directory, 'state.db'))
+        self.db.execute('CREATE TABLE IF NOT EXISTS digests (url TEXT PRIMARY KEY, digest BLOB, run INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, finished_run INTEGER)')
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        # Every crawl gets the next run number; hosts record the run of
+        # their last finished crawl (finished_run predates per-host state)
+        self.last_finished = int(meta.get('finished_run', 0))
+        self.run = max(int(meta.get('last_run', 0)), self.last_finished) + 1
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('last_run', ?)", (str(self.run),))
+        self.stored_fields = json.loads(meta.get('fields', json.dumps(self.FIELDS)))
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('fields', ?)", (json.dumps(self.FIELDS),))
+
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+        self.paths = {
+            name: os.path.join(self.directory, f'{name}-{stamp}.{ext}')
+            for name, ext in (('changes', 'jl'), ('tombstones', 'txt'))
+        }
+        self.changes = open(self.paths['changes'] + '.part', 'w', encoding='utf-8')
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        url = adapter.get('url')
+        digest = self.digest(adapter)
+        row = self.db.execute('SELECT digest FROM digests WHERE url = ?', (url,)).fetchone()
+        self.db.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?)', (url, digest, self.run))
+        self.hosts.add(self._host(url))
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self._commit()
+
+        if row is None:
+            self._emit({'op': 'added', 'url': url, 'item': adapter.asdict()})
+            return item
+        old = dict(zip(self.stored_fields, self._chunks(row[0])))
+        changes = {
+            name: adapter.get(name)
+            for name, new in zip(self.FIELDS, self._chunks(digest))
+            if old.get(name) != new
+        }
+        if changes:
+            self._emit({'op': 'changed', 'url': url, 'changes': changes})
+            return item
+        self._inc_stat('changefeed/unchanged')
+        if self.drop_unchanged:
+            raise DropItem('unchanged since the last crawl', log_level='DEBUG')
+        return item
+
+    def spider_closed(self, spider, reason):
+        if reason == 'finished':
+            finished = dict(self.db.execute('SELECT host, finished_run FROM hosts'))
+            removed = [
+                url for url, run in self.db.execute('SELECT url, run FROM digests WHERE run < ?', (self.run,))
+                if self._host(url) in self.hosts
+                and run <= finished.get(self._host(url), self.last_finished)
+            ]
+            with open(self.paths['tombstones'] + '.part', 'w', encoding='utf-8') as tombstones:
+                for url in removed:
+                    self._emit({'op': 'removed', 'url': url})
+                    tombstones.write(url + '\n')
+            self.db.executemany('DELETE FROM digests WHERE url = ?', ((url,) for url in removed))
+            self.db.executemany('INSERT OR REPLACE INTO hosts VALUES (?, ?)',
+                                ((host, self.run) for host in self.hosts))
+        self._commit()
+        self.db.close()
+        self.db = None
+        self.changes.close()
+        for path in self.paths.values():
+            if os.path.exists(path + '.part'):
+                os.replace(path + '.part', path)
+
+    def checkpoint_snapshot(self):
+        # Sent before the checkpoint syncs done.log, whose pages must not be
+        # crawled again on resume
+        if self.db is not None:
+            self._commit()
+
+    def _commit(self):
+        # Changes reach the disk before the state that supersedes them
+        self.changes.flush()
+        os.fsync(self.changes.fileno())
+        self.db.commit()
+        self._uncommitted = 0
+
+    def _emit(self, record):
+        self.changes.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._inc_stat(f'changefeed/{record["op"]}')
+
+    @staticmethod
+    def _host(url):
+        return (urlparse(url).hostname or '').lower()
+
+    @staticmethod
+    def _chunks(digest):
+        return (digest[i:i + 8] for i in range(0, len(digest), 8))
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
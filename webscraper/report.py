@@ -0,0 +1,503 @@
+"""
+Distribution report over exported recipes.
+
+Exports are read once, in chunks, into columnar NumPy arrays:
+
+    prep, cook, total       minutes (total falls back to prep + cook, as in the index)
+    rating, rating_count    parsed from the ``ratings`` string ("4.5/5 (12 ratings)")
+    nutrient columns        one per label in ``fitness_relevance`` ("kcal: 320, protein: 12g")
+    domain, difficulty      category codes
+    dietary labels          (row, label code) pairs
+
+Missing values are NaN. Counts, means, quantiles and histograms are then
+computed per group (domain or difficulty) with vectorized NumPy calls
+rather than row by row.
+
+Usage::
+
+    python -m webscraper.report output/recipes.jl
+    python -m webscraper.report output/*.jl --by difficulty --json
+    python -m webscraper.report output/recipes.jl --cache report-cache/
+
+With ``--cache`` the columns are written to ``.bin`` files in that
+directory and memory-mapped, so later reports over the same (unchanged)
+exports skip parsing and never hold more than the pages they touch.
+
+Needs NumPy (listed in requirements.txt). Nothing else in the package imports
+it, so the crawler itself runs without it.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+from webscraper.extract import json_loads
+from webscraper.index import item_total_time, iter_export
+
+# Bump when the column files change meaning
+FORMAT_VERSION = 1
+
+TIME_COLUMNS = ['prep', 'cook', 'total']
+RATING_COLUMNS = ['rating', 'rating_count']
+GROUP_COLUMNS = ['domain', 'difficulty']
+# Free-text nutrition on generic sites could otherwise add a column per phrase
+MAX_NUTRIENTS = 64
+
+RATING_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:/\s*5\b|out of 5|stars?)', re.IGNORECASE)
+RATING_COUNT_RE = re.compile(r'(\d[\d,]*)\s*(?:ratings?|reviews?|votes?)', re.IGNORECASE)
+NUTRIENT_RE = re.compile(r'([A-Za-z][A-Za-z ]*?)\s*:\s*(\d+(?:\.\d+)?)')
+# Host of an absolute URL, without userinfo or port
+HOST_RE = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^@/?#]*@)?(\[[^\]]*\]|[^/?#:]*)')
+NAN = float('nan')
+
+HISTOGRAM_BINS = {
+    'prep': list(range(0, 121, 10)),
+    'cook': list(range(0, 241, 15)),
+    'total': list(range(0, 241, 15)),
+    'rating': [x / 2 for x in range(11)],
+}
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError('webscraper.report needs NumPy: pip install numpy')
+
+
+def parse_ratings(text):
+    """Return ``(average, count)`` from a ratings string; NaN where not found."""
+    average = count = NAN
+    if isinstance(text, str) and text:
+        match = RATING_RE.search(text)
+        if match and float(match.group(1)) <= 5:
+            average = float(match.group(1))
+        match = RATING_COUNT_RE.search(text)
+        if match:
+            count = float(match.group(1).replace(',', ''))
+    return average, count
+
+
+def parse_nutrition(text):
+    """Return ``{label: value}`` from a fitness_relevance string."""
+    if not isinstance(text, str) or not text:
+        return {}
+    return {label.strip().lower(): float(value) for label, value in NUTRIENT_RE.findall(text)}
+
+
+def item_domain(url):
+    match = HOST_RE.match(url) if isinstance(url, str) else None
+    host = match.group(1).lower() if match else ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def _minutes(time_data, key):
+    value = time_data.get(key) if isinstance(time_data, dict) else None
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else NAN
+
+
+def iter_items(path):
+    """Yield items from a JSON lines (or JSON array) export."""
+    with open(path, 'rb') as f:
+        head = f.read(64).lstrip()
+    if head.startswith(b'['):
+        yield from iter_export(path)
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield json_loads(line)
+
+
+class ColumnWriter:
+    """Collect columns chunk by chunk, in memory or as ``.bin`` files in ``directory``."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.dtypes = {}
+        self.lengths = {}
+        self.chunks = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def append(self, name, values, dtype):
+        array = np.asarray(values, dtype=dtype)
+        if name not in self.dtypes:
+            self.dtypes[name] = np.dtype(dtype).str
+            self.lengths[name] = 0
+            self.chunks[name] = []
+            if self.directory:
+                open(self.path(name), 'wb').close()
+        if self.directory:
+            with open(self.path(name), 'ab') as f:
+                array.tofile(f)
+        else:
+            self.chunks[name].append(array)
+        self.lengths[name] += len(array)
+
+    def finish(self):
+        """Return ``{name: array}``; file-backed columns come back memory-mapped."""
+        if self.directory:
+            return {name: _memmap(self.path(name), dtype, self.lengths[name])
+                    for name, dtype in self.dtypes.items()}
+        return {name: np.concatenate(chunks) if chunks else np.empty(0, self.dtypes[name])
+                for name, chunks in self.chunks.items()}
+
+
+def _memmap(path, dtype, length):
+    if not length:
+        return np.empty(0, dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+
+class RecipeColumns:
+    """Exported recipes as columns; see the module docstring for the layout.
+
+    ``numeric`` maps column names (including ``nutrient:<label>``) to
+    float32 arrays. ``codes[group]`` holds an int32 code per row into
+    ``categories[group]``. Dietary labels are ``label_rows``/``label_codes``
+    pairs into ``labels``.
+    """
+
+    def __init__(self, rows, numeric, codes, categories, label_rows, label_codes, labels):
+        self.rows = rows
+        self.numeric = numeric
+        self.codes = codes
+        self.categories = categories
+        self.label_rows = label_rows
+        self.label_codes = label_codes
+        self.labels = labels
+
+    @classmethod
+    def load(cls, paths, cache_dir=None, chunk_size=100000):
+        """Read the exports in ``paths``, or their columns from ``cache_dir`` if still current."""
+        require_numpy()
+        sources = [_signature(path) for path in paths]
+        if cache_dir:
+            cached = cls._load_cache(cache_dir, sources)
+            if cached is not None:
+                return cached
+
+        if cache_dir and os.path.exists(os.path.join(cache_dir, 'meta.json')):
+            # Stale columns are about to be overwritten
+            os.remove(os.path.join(cache_dir, 'meta.json'))
+        writer = ColumnWriter(cache_dir)
+        categories = {group: {} for group in GROUP_COLUMNS}
+        labels = {}
+        nutrients = {}
+        rows = 0
+        chunk = _Chunk()
+        for path in paths:
+            for item in iter_items(path):
+                chunk.add(item, rows, categories, labels, nutrients)
+                rows += 1
+                if len(chunk) >= chunk_size:
+                    chunk.write(writer, nutrients)
+                    chunk = _Chunk()
+        chunk.write(writer, nutrients)
+
+        meta = {
+            'version': FORMAT_VERSION,
+            'sources': sources,
+            'rows': rows,
+            'columns': writer.dtypes,
+            'lengths': writer.lengths,
+            'categories': {group: list(values) for group, values in categories.items()},
+            'labels': list(labels),
+            'nutrients': list(nutrients),
+        }
+        if cache_dir:
+            tmp = os.path.join(cache_dir, 'meta.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(cache_dir, 'meta.json'))
+        return cls._from_columns(writer.finish(), meta)
+
+    @classmethod
+    def _load_cache(cls, cache_dir, sources):
+        try:
+            with open(os.path.join(cache_dir, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != FORMAT_VERSION or meta.get('sources') != sources:
+            return None
+        columns = {
+            name: _memmap(os.path.join(cache_dir, name + '.bin'), dtype, meta['lengths'][name])
+            for name, dtype in meta['columns'].items()
+        }
+        return cls._from_columns(columns, meta)
+
+    @classmethod
+    def _from_columns(cls, columns, meta):
+        rows = meta['rows']
+        numeric = {name: columns.get(name, np.full(rows, np.nan, np.float32))
+                   for name in TIME_COLUMNS + RATING_COLUMNS}
+        for i, label in enumerate(meta['nutrients']):
+            numeric['nutrient:' + label] = columns[f'nutrient-{i}']
+        codes = {group: columns.get(group, np.zeros(rows, np.int32)) for group in GROUP_COLUMNS}
+        return cls(
+            rows, numeric, codes, meta['categories'],
+            columns.get('label_rows', np.empty(0, np.int32)),
+            columns.get('label_codes', np.empty(0, np.int32)),
+            meta['labels'],
+        )
+
+    def group_stats(self, column, group=None, quantiles=(0.5, 0.9)):
+        """Return per-group statistics of ``column``; see ``grouped_stats``."""
+        codes, names = self._groups(group)
+        stats = grouped_stats(self.numeric[column], codes, len(names), quantiles)
+        stats['group'] = names
+        return stats
+
+    def histogram(self, column, bins, group=None):
+        """Return ``(edges, counts)``; ``counts`` has one row per group.
+
+        Values beyond the last edge are counted in an extra overflow bin.
+        """
+        codes, names = self._groups(group)
+        values = np.asarray(self.numeric[column])
+        mask = ~np.isnan(values)
+        edges = np.asarray(bins, dtype=np.float64)
+        # Bin i holds edges[i] <= value < edges[i + 1]; the last bin is open-ended
+        index = np.clip(np.searchsorted(edges, values[mask], side='right') - 1, 0, len(edges) - 1)
+        flat = np.bincount(codes[mask].astype(np.int64) * len(edges) + index,
+                           minlength=len(names) * len(edges))
+        return edges, flat.reshape(len(names), len(edges))
+
+    def label_counts(self, group=None):
+        """Return the number of recipes with each dietary label, one row per group."""
+        codes, names = self._groups(group)
+        n_labels = len(self.labels)
+        flat = np.bincount(codes[self.label_rows].astype(np.int64) * n_labels + self.label_codes,
+                           minlength=len(names) * n_labels)
+        return flat.reshape(len(names), n_labels)
+
+    def group_sizes(self, group=None):
+        codes, names = self._groups(group)
+        return np.bincount(codes, minlength=len(names))
+
+    def _groups(self, group):
+        if group is None:
+            return np.zeros(self.rows, np.int32), ['all']
+        return np.asarray(self.codes[group]), self.categories[group]
+
+
+class _Chunk:
+    """Row values of up to ``chunk_size`` items, as Python lists."""
+
+    def __init__(self):
+        self.values = {name: [] for name in TIME_COLUMNS + RATING_COLUMNS + GROUP_COLUMNS}
+        self.nutrients = []
+        self.label_rows = []
+        self.label_codes = []
+
+    def __len__(self):
+        return len(self.nutrients)
+
+    def add(self, item, row, categories, labels, nutrients):
+        values = self.values
+        time_data = item.get('time')
+        values['prep'].append(_minutes(time_data, 'prep'))
+        values['cook'].append(_minutes(time_data, 'cook'))
+        total = item_total_time(item)
+        values['total'].append(NAN if total is None else float(total))
+        average, count = parse_ratings(item.get('ratings'))
+        values['rating'].append(average)
+        values['rating_count'].append(count)
+
+        domains = categories['domain']
+        domain = item_domain(item.get('url'))
+        values['domain'].append(domains.setdefault(domain, len(domains)))
+        difficulties = categories['difficulty']
+        difficulty = item.get('difficulty')
+        difficulty = difficulty.strip().lower() if isinstance(difficulty, str) else ''
+        values['difficulty'].append(difficulties.setdefault(difficulty, len(difficulties)))
+
+        seen = set()
+        for label in item.get('dietary_labels') or ():
+            if not isinstance(label, str) or not label.strip():
+                continue
+            code = labels.setdefault(label.strip(), len(labels))
+            if code not in seen:
+                seen.add(code)
+                self.label_rows.append(row)
+                self.label_codes.append(code)
+
+        found = parse_nutrition(item.get('fitness_relevance'))
+        for label in found:
+            if label not in nutrients and len(nutrients) < MAX_NUTRIENTS:
+                nutrients[label] = len(nutrients)
+        self.nutrients.append(found)
+
+    def write(self, writer, nutrients):
+        size = len(self)
+        for name in TIME_COLUMNS + RATING_COLUMNS:
+            writer.append(name, self.values[name], np.float32)
+        for name in GROUP_COLUMNS:
+            writer.append(name, self.values[name], np.int32)
+        writer.append('label_rows', self.label_rows, np.int32)
+        writer.append('label_codes', self.label_codes, np.int32)
+        for label, i in nutrients.items():
+            name = f'nutrient-{i}'
+            if name not in writer.lengths:
+                # First seen in this chunk: earlier rows did not have it
+                writer.append(name, np.full(writer.lengths['prep'] - size, NAN), np.float32)
+            writer.append(name, [found.get(label, NAN) for found in self.nutrients], np.float32)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def grouped_stats(values, codes, n_groups, quantiles=(0.5, 0.9)):
+    """Return count, mean, min, max and quantiles of ``values`` per group code.
+
+    NaN values are ignored. Quantiles interpolate linearly like
+    ``numpy.percentile``. Every statistic is an array of ``n_groups``
+    (NaN for groups without values).
+    """
+    values = np.asarray(values)
+    codes = np.asarray(codes)
+    mask = ~np.isnan(values)
+    values = values[mask].astype(np.float64)
+    codes = codes[mask]
+    count = np.bincount(codes, minlength=n_groups)
+    total = np.bincount(codes, weights=values, minlength=n_groups)
+    present = count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(present, total / count, np.nan)
+
+    stats = {'count': count, 'mean': mean}
+    if not len(values):
+        for key in ['min', 'max'] + [f'p{round(q * 100)}' for q in quantiles]:
+            stats[key] = np.full(n_groups, np.nan)
+        return stats
+
+    # Sorted by group, then value: each group is a contiguous sorted run
+    ordered = values[np.lexsort((values, codes))]
+    starts = np.minimum(np.concatenate(([0], np.cumsum(count)[:-1])), len(ordered) - 1)
+    spans = np.maximum(count - 1, 0)
+    stats['min'] = np.where(present, ordered[starts], np.nan)
+    stats['max'] = np.where(present, ordered[starts + spans], np.nan)
+    for q in quantiles:
+        position = q * spans
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        below = ordered[starts + low]
+        value = below + (ordered[starts + high] - below) * (position - low)
+        stats[f'p{round(q * 100)}'] = np.where(present, value, np.nan)
+    return stats
+
+
+def build_report(columns, group=None, top=10, max_groups=20):
+    """Return the report as plain (JSON-serializable) data."""
+    sizes = columns.group_sizes(group)
+    order = np.argsort(-sizes, kind='stable')[:max_groups]
+    names = columns.categories[group] if group else ['all']
+    report = {
+        'recipes': columns.rows,
+        'group_by': group,
+        'groups': [{'name': names[i] or '(none)', 'recipes': int(sizes[i])} for i in order],
+        'columns': {},
+        'histograms': {},
+        'dietary_labels': {},
+    }
+    numeric = [name for name in columns.numeric
+               if not name.startswith('nutrient:') or np.any(~np.isnan(columns.numeric[name]))]
+    for name in numeric:
+        stats = columns.group_stats(name, group)
+        report['columns'][name] = [
+            {key: _plain(stats[key][i]) for key in stats if key != 'group'} for i in order
+        ]
+    for name, bins in HISTOGRAM_BINS.items():
+        edges, counts = columns.histogram(name, bins)
+        report['histograms'][name] = {'edges': edges.tolist(), 'counts': counts[0].tolist()}
+
+    overall = columns.label_counts()[0]
+    by_group = columns.label_counts(group)
+    for code in np.argsort(-overall, kind='stable')[:top]:
+        if overall[code]:
+            report['dietary_labels'][columns.labels[code]] = {
+                'recipes': int(overall[code]),
+                'share': [_plain(by_group[i, code] / sizes[i]) if sizes[i] else None for i in order],
+            }
+    return report
+
+
+def _plain(value):
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return int(value) if value.is_integer() else round(value, 2)
+
+
+def format_report(report):
+    """Render ``build_report`` output as text tables."""
+    if not report['recipes']:
+        return 'no recipes'
+    lines = [f"{report['recipes']} recipes"]
+    groups = report['groups']
+    label = report['group_by'] or 'all'
+    width = max([len(label)] + [len(str(g['name'])) for g in groups])
+
+    for name, rows in report['columns'].items():
+        lines += ['', name, f"  {label:<{width}}  " + ''.join(f'{key:>9}' for key in rows[0])]
+        for group, row in zip(groups, rows):
+            cells = ''.join(f"{'-' if value is None else value:>9}" for value in row.values())
+            lines.append(f"  {group['name']:<{width}}  {cells}")
+
+    for name, histogram in report['histograms'].items():
+        counts = histogram['counts']
+        if not any(counts):
+            continue
+        lines += ['', f'{name} histogram']
+        peak = max(counts)
+        edges = histogram['edges']
+        # Empty bins past the last value are left out
+        last = max(i for i, count in enumerate(counts) if count)
+        for i, count in enumerate(counts[:last + 1]):
+            bucket = f'{edges[i]:g}-{edges[i + 1]:g}' if i + 1 < len(edges) else f'{edges[i]:g}+'
+            lines.append(f"  {bucket:>9}  {count:>8}  {'#' * round(40 * count / peak)}")
+
+    if report['dietary_labels']:
+        lines += ['', 'dietary labels (share of recipes)',
+                  f"  {'label':<24}{'recipes':>9}  " + ''.join(f"{str(g['name'])[:12]:>13}" for g in groups)]
+        for name, entry in report['dietary_labels'].items():
+            shares = ''.join(f"{'-' if s is None else f'{s:.1%}':>13}" for s in entry['share'])
+            lines.append(f"  {name[:24]:<24}{entry['recipes']:>9}  {shares}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m webscraper.report',
+                                     description='Summarize exported recipes.')
+    parser.add_argument('export', nargs='+', help='JSON lines (or JSON array) export')
+    parser.add_argument('--by', choices=GROUP_COLUMNS, default='domain',
+                        help='group statistics by this field (default: domain)')
+    parser.add_argument('--all', action='store_true', help='do not group')
+    parser.add_argument('--cache', help='directory for memory-mapped column files')
+    parser.add_argument('--top', type=int, default=10, help='dietary labels to list')
+    parser.add_argument('--max-groups', type=int, default=20, help='largest groups to list')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print('webscraper.report needs NumPy: pip install numpy', file=sys.stderr)
+        return 2
+    columns = RecipeColumns.load(args.export, cache_dir=args.cache)
+    report = build_report(columns, None if args.all else args.by, args.top, args.max_groups)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,7 +12,18 @@ BOT_NAME = "webscraper"
 SPIDER_MODULES = ["webscraper.spiders"]
 NEWSPIDER_MODULE = "webscraper.spiders"
 
-ADDONS = {}
+ADDONS = {
+    "webscraper.addons.TransferProfile": 100,
+}
+
+# Download profile for many small pages from a few hosts (disabled unless
+# set): "keepalive" sizes the HTTP/1.1 connection pool per domain, "h2" also
+# multiplexes HTTPS over HTTP/2 (needs the h2 package). Both decode
+# zstd/br/gzip responses. TRANSFER_DOMAIN_CONCURRENCY feeds DOWNLOAD_SLOTS.
+#TRANSFER_PROFILE = "h2"
+#TRANSFER_POOL_SIZE = 8
+#TRANSFER_KEEPALIVE_TIMEOUT = 240
+#TRANSFER_DOMAIN_CONCURRENCY = {"www.recipetineats.com": 16}
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -40,27 +51,97 @@ DOWNLOAD_DELAY = 1
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    "webscraper.middlewares.WebscraperSpiderMiddleware": 543,
-#}
+    "webscraper.checkpoint.CrawlCheckpoint": 950,
+    "webscraper.canonical.CanonicalUrls": 960,
+}
+
+# Canonicalize links before scheduling and collapse rel=canonical aliases, so
+# tracking, www. and trailing-slash variants of a page are fetched once
+CANONICAL_ENABLED = True
+# Query parameters dropped (fnmatch patterns), or the only ones kept
+#CANONICAL_QUERY_DENY = ["utm_*", "fbclid", "gclid"]
+#CANONICAL_QUERY_ALLOW = ["page"]
+#CANONICAL_KEEP_FRAGMENT = False
+#CANONICAL_IGNORE_WWW = True
+#CANONICAL_IGNORE_TRAILING_SLASH = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "webscraper.middlewares.WebscraperDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "webscraper.middlewares.WebscraperDownloaderMiddleware": 543,
+    # Above RetryMiddleware (550), so it sees every attempt before retries
+    "webscraper.middlewares.DomainCircuitBreaker": 560,
+}
+
+# Drop non-HTML and oversized responses as soon as their headers arrive, and
+# stop requesting paths that keep returning non-HTML (per domain)
+EARLY_ABORT_ENABLED = True
+#EARLY_ABORT_CONTENT_TYPES = ["text/html", "application/xhtml+xml"]
+#EARLY_ABORT_MAXSIZE = 5242880
+#EARLY_ABORT_LEARN_THRESHOLD = 3
+
+# Stop sending requests to a failing domain: after CIRCUIT_BREAKER_THRESHOLD
+# consecutive failures its requests are parked for an exponentially growing
+# backoff, then one probe decides whether to release them. Retries come out
+# of a per-domain budget of CIRCUIT_BREAKER_RETRY_RATIO retries per request
+CIRCUIT_BREAKER_ENABLED = True
+#CIRCUIT_BREAKER_THRESHOLD = 5
+#CIRCUIT_BREAKER_BACKOFF = 5.0
+#CIRCUIT_BREAKER_MAX_BACKOFF = 300.0
+#CIRCUIT_BREAKER_MAX_TRIPS = 8
+#CIRCUIT_BREAKER_MAX_PARKED = 10000
+#CIRCUIT_BREAKER_HTTP_CODES = [500, 502, 503, 504, 522, 524, 408, 429]
+#CIRCUIT_BREAKER_RETRY_RATIO = 0.2
+#CIRCUIT_BREAKER_RETRY_BURST = 10
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "webscraper.extensions.MemoryBudget": 500,
+}
+
+# Memory-budgeted crawling: pause scheduling above an RSS ceiling or when too
+# many downloaded bytes are waiting for the spider (disabled by default)
+#MEMORY_BUDGET_ENABLED = True
+#MEMORY_BUDGET_RSS_MB = 1024
+#MEMORY_BUDGET_INFLIGHT_MB = 32
+#MEMORY_BUDGET_RESUME_RATIO = 0.9
+#MEMORY_BUDGET_CHECK_INTERVAL = 1.0
+# Report the top N allocation sites in the stats (slows the crawl down)
+#MEMORY_BUDGET_TRACEMALLOC = 10
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
+ITEM_PIPELINES = {
 #    "webscraper.pipelines.WebscraperPipeline": 300,
-#}
+    "webscraper.pipelines.DatabasePipeline": 800,
+    "webscraper.pipelines.IndexPipeline": 850,
+    "webscraper.pipelines.ChangeFeedPipeline": 900,
+}
+
+# Write only what changed since the previous crawl (added/changed/removed
+# records plus a tombstone list) to CHANGEFEED_DIR (disabled unless set).
+# CHANGEFEED_DROP_UNCHANGED also keeps unchanged items out of feed exports.
+#CHANGEFEED_DIR = "changes"
+#CHANGEFEED_DROP_UNCHANGED = True
+#CHANGEFEED_COMMIT_EVERY = 1000
+
+# Upsert items straight into a database (disabled unless one is configured).
+# DATABASE_CONNECT may name any callable returning a DB-API connection.
+#DATABASE_PATH = "recipes.db"
+#DATABASE_CONNECT = "myproject.db.connect"
+#DATABASE_PARAMSTYLE = "qmark"
+#DATABASE_TABLE = "recipes"
+#DATABASE_BATCH_SIZE = 500
+#DATABASE_QUEUE_SIZE = 5000
+
+# Maintain an ingredient/diet/time index while crawling (disabled unless set).
+# Query it with: python -m webscraper.index query INDEX_DIR -i chicken --max-time 30
+#INDEX_DIR = "index"
+#INDEX_SEGMENT_SIZE = 10000
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -83,5 +164,16 @@ DOWNLOAD_DELAY = 1
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Cache extraction results by normalized page content; a hit skips HTML
+# parsing. EXTRACTION_CACHE_PATH adds a SQLite tier that survives crawls.
+#EXTRACTION_CACHE_ENABLED = True
+#EXTRACTION_CACHE_SIZE = 10000
+#EXTRACTION_CACHE_PATH = "cache/extractions.db"
+
+# Crash-safe checkpoints (disabled unless CHECKPOINT_DIR is set). Rerunning
+# the crawl with the same directory resumes where the last snapshot left off.
+#CHECKPOINT_DIR = "crawls/recipes"
+CHECKPOINT_INTERVAL = 30
+
 # Set settings whose default value is deprecated to a future-proof value
 FEED_EXPORT_ENCODING = "utf-8"
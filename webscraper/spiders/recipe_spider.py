@@ -1,6 +1,9 @@
 import scrapy
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin
+from webscraper import extract
+from webscraper.cache import ExtractionCache
+from webscraper.checkpoint import url_key
+from webscraper.extract import Extractor
 from webscraper.items import WebscraperItem
 
 class RecipeSpider(scrapy.Spider):
@@ -20,24 +23,53 @@ class RecipeSpider(scrapy.Spider):
         'AUTOTHROTTLE_TARGET_CONCURRENCY': 2.0,
     }
 
-    def __init__(self, domain=None, *args, **kwargs):
+    # Tag selectors can match hundreds of elements on some sites
+    max_dietary_labels = extract.MAX_DIETARY_LABELS
+
+    def __init__(self, domain=None, start_url=None, follow_links=True, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if domain:
             self.allowed_domains = [domain]
             # Start from recipes page for better recipe discovery
-            self.start_urls = [f'https://{domain}/recipes']
+            if start_url or not self.start_urls:
+                self.start_urls = [start_url or f'https://{domain}/recipes']
+        # follow_links=0 fetches only the start URLs (-a values are strings)
+        self.follow_links = str(follow_links).lower() not in ('0', 'false', 'no')
+        # 64-bit URL hashes rather than URL strings, to keep long crawls small
         self.visited_urls = set()
+        self._extractor = None
+        self.extraction_cache = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        if settings.getbool('EXTRACTION_CACHE_ENABLED'):
+            spider.extraction_cache = ExtractionCache(
+                max_entries=settings.getint('EXTRACTION_CACHE_SIZE', 10000),
+                path=settings.get('EXTRACTION_CACHE_PATH'),
+                stats=crawler.stats,
+            )
+        return spider
+
+    def closed(self, reason):
+        if self.extraction_cache is not None:
+            self.extraction_cache.close()
 
     def parse(self, response):
         url = response.url
-        if url in self.visited_urls:
+        key = url_key(url)
+        if key in self.visited_urls:
             return
-        self.visited_urls.add(url)
+        self.visited_urls.add(key)
 
         # Only parse valid recipe pages
         if self.is_valid_recipe_url(url):
             yield self.parse_recipe(response)
 
+        if not self.follow_links:
+            return
+
         # Recursively follow internal links, but be more flexible about what we follow
         all_links = response.css('a::attr(href)').getall()
         self.logger.info(f"Found {len(all_links)} links on {response.url}")
@@ -137,8 +169,8 @@ class RecipeSpider(scrapy.Spider):
 
     def is_internal_link(self, url):
         parsed = urlparse(url)
-        # Handle www subdomain variations
-        domain = parsed.netloc
+        # Handle www subdomain variations (ports are ignored, like OffsiteMiddleware)
+        domain = parsed.hostname or ''
         allowed_domain = self.allowed_domains[0]
         
         # Remove www. prefix for comparison
@@ -187,403 +219,40 @@ class RecipeSpider(scrapy.Spider):
         return False
 
     def parse_recipe(self, response):
-        # Generic recipe parsing
-        soup = BeautifulSoup(response.text, 'lxml')
-        item = WebscraperItem()
-        item['url'] = response.url
-        item['title'] = soup.title.string if soup.title else ''
-        
-        # Check if this is RecipeTin Eats (has WPRM plugin)
-        wprm_elements = soup.select('.wprm-recipe-ingredient, .wprm-recipe-instruction')
-        if wprm_elements:
-            # Use RecipeTin Eats specific parsing
-            item = self.parse_recipetineats_html(soup, item)
-        else:
-            # Try to extract recipe data from embedded JSON first
-            try:
-                # Find the JSON data in the page
-                script_tag = soup.find('script', {'id': '__POST_CONTENT__'})
-                if script_tag and hasattr(script_tag, 'string') and script_tag.string:
-                    import json
-                    recipe_data = json.loads(str(script_tag.string))
-                    
-                    # Extract ingredients
-                    ingredients = []
-                    if 'ingredients' in recipe_data and recipe_data['ingredients']:
-                        for ingredient_group in recipe_data['ingredients']:
-                            for ingredient in ingredient_group.get('ingredients', []):
-                                quantity = ingredient.get('quantityText', '')
-                                ingredient_text = ingredient.get('ingredientText', '')
-                                note = ingredient.get('note', '')
-                                full_ingredient = f"{quantity} {ingredient_text}".strip()
-                                if note:
-                                    full_ingredient += f" ({note})"
-                                ingredients.append(full_ingredient)
-                    item['ingredients'] = ingredients
-                    
-                    # Extract cooking times
-                    time_data = {}
-                    if 'cookAndPrepTime' in recipe_data:
-                        time_info = recipe_data['cookAndPrepTime']
-                        time_data['prep'] = time_info.get('preparationMax', 0) // 60  # Convert seconds to minutes
-                        time_data['cook'] = time_info.get('cookingMax', 0) // 60
-                        time_data['total'] = time_info.get('total', 0) // 60
-                    item['time'] = time_data
-                    
-                    # Extract dietary labels
-                    dietary_labels = []
-                    if 'diet' in recipe_data:
-                        for diet in recipe_data['diet']:
-                            dietary_labels.append(diet.get('display', ''))
-                    item['dietary_labels'] = dietary_labels
-                    
-                    # Extract difficulty level
-                    if 'skillLevel' in recipe_data:
-                        item['difficulty'] = recipe_data['skillLevel']
-                    
-                    # Extract instructions
-                    instructions = []
-                    if 'methodSteps' in recipe_data:
-                        for step in recipe_data['methodSteps']:
-                            if step.get('content'):
-                                for content in step['content']:
-                                    if content.get('type') == 'html' and content.get('data', {}).get('value'):
-                                        # Clean HTML tags from instructions
-                                        import re
-                                        clean_text = re.sub(r'<[^>]+>', '', content['data']['value'])
-                                        instructions.append(clean_text.strip())
-                    item['instructions'] = '\n'.join(instructions)
-                    
-                    # Extract ratings
-                    if 'userRatings' in recipe_data:
-                        ratings = recipe_data['userRatings']
-                        item['ratings'] = f"{ratings.get('avg', 0)}/5 ({ratings.get('total', 0)} ratings)"
-                    
-                    # Extract fitness relevance (from nutrition info)
-                    fitness_info = []
-                    if 'nutritions' in recipe_data:
-                        for nutrition in recipe_data['nutritions']:
-                            label = nutrition.get('label', '')
-                            value = nutrition.get('value', '')
-                            unit = nutrition.get('unit', '')
-                            if label and value:
-                                fitness_info.append(f"{label}: {value}{unit}")
-                    item['fitness_relevance'] = ', '.join(fitness_info)
-                    
-            except (json.JSONDecodeError, KeyError, AttributeError) as e:
-                # Fallback to generic HTML parsing
-                item = self.parse_generic_html(soup, item)
-        
-        return item
-    
+        # Generic recipe parsing, shared with the Scrapy-free webscraper.extract API
+        if self._extractor is None:
+            self._extractor = Extractor(self.max_dietary_labels)
+        if self.extraction_cache is None:
+            return WebscraperItem(self.extract_recipe(response, response.url))
+        # Identical content (mirrors, tracking variants, unchanged pages) skips the parser
+        result = self.extraction_cache.extract(
+            response.body, response.url,
+            lambda body, url: self.extract_recipe(response, url),
+        )
+        return WebscraperItem(result)
+
+    def extract_recipe(self, response, url):
+        # Embedded JSON is read straight from the body bytes when they are UTF-8
+        # compatible; everything else is parsed from the decoded text
+        encoding = response.encoding
+        if encoding == 'utf-8' or (encoding == 'cp1252' and response.body.isascii()):
+            item = self._extractor.extract_embedded(response.body, url)
+            if item is not None:
+                return item
+        return self._extractor.extract_dom(response.text, url)
+
+    def limit_labels(self, labels):
+        """Drop duplicate labels and keep at most ``max_dietary_labels``"""
+        return extract.limit_labels(labels, self.max_dietary_labels)
+
     def parse_generic_html(self, soup, item):
         """Parse generic HTML structure for recipe data"""
-        
-        # Extract ingredients
-        ingredients = []
-        ingredient_selectors = [
-            '.ingredients li',
-            '.recipe-ingredients li',
-            '.ingredient-list li',
-            '[class*="ingredient"] li',
-            'ul li'  # Fallback to any list items
-        ]
-        
-        for selector in ingredient_selectors:
-            ingredient_elements = soup.select(selector)
-            for elem in ingredient_elements:
-                ingredient_text = elem.get_text(strip=True)
-                if ingredient_text and len(ingredient_text) > 5:
-                    ingredients.append(ingredient_text)
-            if ingredients:
-                break
-        
-        item['ingredients'] = ingredients
-        
-        # Extract instructions
-        instructions = []
-        instruction_selectors = [
-            '.instructions li',
-            '.recipe-instructions li',
-            '.method li',
-            '.steps li',
-            '[class*="instruction"] li',
-            'ol li'  # Fallback to ordered lists
-        ]
-        
-        for selector in instruction_selectors:
-            instruction_elements = soup.select(selector)
-            for elem in instruction_elements:
-                instruction_text = elem.get_text(strip=True)
-                if instruction_text and len(instruction_text) > 10:
-                    instructions.append(instruction_text)
-            if instructions:
-                break
-        
-        item['instructions'] = '\n'.join(instructions)
-        
-        # Extract cooking times
-        time_data = {}
-        time_selectors = [
-            '.prep-time',
-            '.cook-time',
-            '.total-time',
-            '.recipe-time',
-            '[class*="time"]'
-        ]
-        
-        for selector in time_selectors:
-            time_elements = soup.select(selector)
-            for elem in time_elements:
-                text = elem.get_text(strip=True).lower()
-                if 'prep' in text:
-                    time_data['prep'] = self.extract_time_minutes(text)
-                elif 'cook' in text:
-                    time_data['cook'] = self.extract_time_minutes(text)
-                elif 'total' in text:
-                    time_data['total'] = self.extract_time_minutes(text)
-        
-        item['time'] = time_data
-        
-        # Extract dietary labels
-        dietary_labels = []
-        dietary_selectors = [
-            '.dietary-labels',
-            '.recipe-tags',
-            '.tags',
-            '[class*="diet"]',
-            '[class*="tag"]'
-        ]
-        
-        for selector in dietary_selectors:
-            dietary_elements = soup.select(selector)
-            for elem in dietary_elements:
-                labels = elem.get_text(strip=True).split(',')
-                for label in labels:
-                    clean_label = label.strip()
-                    if clean_label:
-                        dietary_labels.append(clean_label)
-        
-        item['dietary_labels'] = dietary_labels
-        
-        # Extract difficulty level
-        difficulty = ''
-        difficulty_selectors = [
-            '.difficulty',
-            '.skill-level',
-            '[class*="difficulty"]',
-            '[class*="skill"]'
-        ]
-        
-        for selector in difficulty_selectors:
-            difficulty_elem = soup.select_one(selector)
-            if difficulty_elem:
-                difficulty = difficulty_elem.get_text(strip=True)
-                break
-        
-        item['difficulty'] = difficulty
-        
-        # Extract ratings
-        ratings = ''
-        rating_selectors = [
-            '.rating',
-            '.stars',
-            '[class*="rating"]'
-        ]
-        
-        for selector in rating_selectors:
-            rating_elem = soup.select_one(selector)
-            if rating_elem:
-                ratings = rating_elem.get_text(strip=True)
-                break
-        
-        item['ratings'] = ratings
-        
-        # Extract nutrition info
-        nutrition_info = []
-        nutrition_selectors = [
-            '.nutrition',
-            '.nutrition-info',
-            '[class*="nutrition"]'
-        ]
-        
-        for selector in nutrition_selectors:
-            nutrition_elements = soup.select(selector)
-            for elem in nutrition_elements:
-                nutrition_text = elem.get_text(strip=True)
-                if nutrition_text:
-                    nutrition_info.append(nutrition_text)
-        
-        item['fitness_relevance'] = ', '.join(nutrition_info)
-        
-        return item
-    
+        return extract.parse_generic_html(soup, item)
+
     def parse_recipetineats_html(self, soup, item):
         """Parse RecipeTin Eats HTML structure"""
-        
-        # Extract ingredients - RecipeTin Eats uses WPRM plugin
-        ingredients = []
-        ingredient_elements = soup.select('.wprm-recipe-ingredient')
-        for elem in ingredient_elements:
-            ingredient_text = elem.get_text(strip=True)
-            if ingredient_text and len(ingredient_text) > 5:  # Filter out empty or very short text
-                ingredients.append(ingredient_text)
-        
-        # Fallback to other selectors if WPRM not found
-        if not ingredients:
-            ingredient_selectors = [
-                '[class*="ingredient"] li',
-                '.ingredients li',
-                '.recipe-ingredients li'
-            ]
-            for selector in ingredient_selectors:
-                ingredient_elements = soup.select(selector)
-                for elem in ingredient_elements:
-                    ingredient_text = elem.get_text(strip=True)
-                    if ingredient_text and len(ingredient_text) > 5:
-                        ingredients.append(ingredient_text)
-                if ingredients:
-                    break
-        
-        item['ingredients'] = ingredients
-        
-        # Extract instructions - RecipeTin Eats uses WPRM plugin
-        instructions = []
-        instruction_elements = soup.select('.wprm-recipe-instruction')
-        for elem in instruction_elements:
-            instruction_text = elem.get_text(strip=True)
-            if instruction_text and len(instruction_text) > 10:  # Filter out very short text
-                instructions.append(instruction_text)
-        
-        # Fallback to other selectors if WPRM not found
-        if not instructions:
-            instruction_selectors = [
-                '[class*="instruction"] li',
-                '.instructions li',
-                '.recipe-instructions li',
-                'ol li'  # Ordered lists for steps
-            ]
-            for selector in instruction_selectors:
-                instruction_elements = soup.select(selector)
-                for elem in instruction_elements:
-                    instruction_text = elem.get_text(strip=True)
-                    if instruction_text and len(instruction_text) > 10:
-                        instructions.append(instruction_text)
-                if instructions:
-                    break
-        
-        item['instructions'] = '\n'.join(instructions)
-        
-        # Extract cooking times - RecipeTin Eats format
-        time_data = {}
-        time_elements = soup.select('[class*="time"]')
-        for elem in time_elements:
-            text = elem.get_text(strip=True).lower()
-            if 'prep' in text:
-                time_data['prep'] = self.extract_time_minutes(text)
-            elif 'cook' in text:
-                time_data['cook'] = self.extract_time_minutes(text)
-            elif 'total' in text:
-                time_data['total'] = self.extract_time_minutes(text)
-        
-        item['time'] = time_data
-        
-        # Extract dietary labels and tags
-        dietary_labels = []
-        
-        # Look for recipe tags/categories
-        tag_selectors = [
-            '.wprm-recipe-tag',
-            '.recipe-tags',
-            '.tags',
-            '[class*="tag"]'
-        ]
-        
-        for selector in tag_selectors:
-            tag_elements = soup.select(selector)
-            for elem in tag_elements:
-                tag_text = elem.get_text(strip=True)
-                if tag_text and len(tag_text) > 2:
-                    dietary_labels.append(tag_text)
-        
-        item['dietary_labels'] = dietary_labels
-        
-        # Extract difficulty level
-        difficulty = ''
-        difficulty_selectors = [
-            '.wprm-recipe-difficulty',
-            '.difficulty',
-            '.skill-level'
-        ]
-        
-        for selector in difficulty_selectors:
-            difficulty_elem = soup.select_one(selector)
-            if difficulty_elem:
-                difficulty = difficulty_elem.get_text(strip=True)
-                break
-        
-        item['difficulty'] = difficulty
-        
-        # Extract ratings
-        ratings = ''
-        rating_selectors = [
-            '.wprm-recipe-rating',
-            '.rating',
-            '.stars'
-        ]
-        
-        for selector in rating_selectors:
-            rating_elem = soup.select_one(selector)
-            if rating_elem:
-                ratings = rating_elem.get_text(strip=True)
-                break
-        
-        item['ratings'] = ratings
-        
-        # Extract nutrition info
-        nutrition_info = []
-        nutrition_selectors = [
-            '.wprm-recipe-nutrition',
-            '.nutrition',
-            '.nutrition-info'
-        ]
-        
-        for selector in nutrition_selectors:
-            nutrition_elements = soup.select(selector)
-            for elem in nutrition_elements:
-                nutrition_text = elem.get_text(strip=True)
-                if nutrition_text:
-                    nutrition_info.append(nutrition_text)
-        
-        item['fitness_relevance'] = ', '.join(nutrition_info)
-        
-        return item
-    
+        return extract.parse_recipetineats_html(soup, item)
+
     def extract_time_minutes(self, text):
         """Extract time in minutes from text"""
-        import re
-        # Look for patterns like "15 minutes", "1 hour", "1h 30m", etc.
-        time_patterns = [
-            r'(\d+)\s*minutes?',
-            r'(\d+)\s*hours?',
-            r'(\d+)h\s*(\d+)m',
-            r'(\d+)\s*hrs?'
-        ]
-        
-        for pattern in time_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                if 'h' in pattern and len(match.groups()) > 1:
-                    # Handle "1h 30m" format
-                    hours = int(match.group(1))
-                    minutes = int(match.group(2))
-                    return hours * 60 + minutes
-                else:
-                    # Handle single time unit
-                    value = int(match.group(1))
-                    if 'hour' in pattern or 'hr' in pattern:
-                        return value * 60
-                    else:
-                        return value
-        
-        return 0 
\ No newline at end of file
+        return extract.extract_time_minutes(text)